@@ -0,0 +1,119 @@
+"""
+Local load benchmark comparing the two RAG execution modes:
+
+* thread  - asyncio.to_thread(asyncio.run, RAGEngine.aprocess_query(...))  (a blocking call per request,
+            like the old webhook behaviour)
+* async   - await RAGEngine.aprocess_query(...)
+
+OpenAI and MongoDB are replaced with stubs that only sleep for a configurable latency,
+so the numbers show scheduling overhead and concurrency limits, not network speed.
+
+Usage:
+    python -m benchmarks.bench_async_rag --requests 500 --concurrency 200 --latency-ms 150
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+os.environ.setdefault("OPEN_AI_KEY", "benchmark")
+
+from benchmarks.common import summarize, format_summary  # noqa: E402
+from src.ai.rag_engine import RAGEngine  # noqa: E402
+from src.ai.semantic_cache import SemanticCache  # noqa: E402
+
+EMBEDDING = [0.0] * 1536
+DOCUMENTS = [
+    {"title": "Euvic", "pageNumber": i, "content": "Euvic services " * 50, "createdAt": None, "wordCount": 100}
+    for i in range(10)
+]
+
+
+class StubOpenAIClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def agenerate_embeddings(self, text):
+        await asyncio.sleep(self.latency / 3)
+        return EMBEDDING
+
+    async def agenerate_chat_completion(self, messages):
+        await asyncio.sleep(self.latency)
+        return "Stub answer"
+
+    async def aclose(self):
+        pass
+
+
+class StubMongoDBClient:
+    def __init__(self, latency):
+        self.latency = latency
+
+    async def aensure_vector_search_index(self, force=False):
+        pass
+
+    async def avector_search(self, query_embedding, num_results=10, include_vectors=False):
+        await asyncio.sleep(self.latency / 3)
+        return DOCUMENTS[:num_results]
+
+    async def aconnect(self):
+        pass
+
+    def close(self):
+        pass
+
+
+async def run_mode(mode, engine, total_requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    peak_threads = threading.active_count()
+
+    async def one_request(i):
+        async with semaphore:
+            started = time.perf_counter()
+            if mode == "thread":
+                # Każdy wątek z własną pętlą zdarzeń - tak wyglądało wywołanie blokującego pipeline'u z webhooka
+                await asyncio.to_thread(asyncio.run, engine.aprocess_query(f"question {i}"))
+            else:
+                await engine.aprocess_query(f"question {i}")
+            latencies.append(time.perf_counter() - started)
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample_threads())
+    started = time.perf_counter()
+    await asyncio.gather(*(one_request(i) for i in range(total_requests)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+
+    summary = summarize(latencies, elapsed)
+    summary["peak_threads"] = peak_threads
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Stubbed chat completion latency")
+    args = parser.parse_args()
+
+    latency = args.latency_ms / 1000
+    # Stub embeddings are identical for every question, so the semantic cache has to stay off here
+    engine = RAGEngine(mongodb_client=StubMongoDBClient(latency), openai_client=StubOpenAIClient(latency),
+                       semantic_cache=SemanticCache(capacity=0))
+
+    print(f"requests={args.requests} concurrency={args.concurrency} latency={args.latency_ms}ms "
+          f"cpu_count={os.cpu_count()}")
+    for mode in ("thread", "async"):
+        result = asyncio.run(run_mode(mode, engine, args.requests, args.concurrency))
+        print(f"{format_summary(mode, result)}  peak_threads={result['peak_threads']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Micro-benchmark of the time a request spends inside logging calls on the event loop thread:
+
+* sync   - RotatingFileHandler + StreamHandler attached directly, pytz conversion per record
+           (the old src/logger.py setup)
+* queue  - QueueHandler on the loggers, file / console handlers on the listener thread,
+           timezone conversion cached per second (the current src/logger.py setup)
+
+Every "request" emits the records a webhook message produces with INFO enabled (~20 lines,
+including the multi-line chat history block). The console goes to os.devnull.
+
+Usage:
+    python -m benchmarks.bench_logging --requests 2000
+"""
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, QueueHandler
+
+from benchmarks.common import percentile
+from src.logger import POLAND_TZ, PolandFormatter, LoggerRoutingListener
+
+LOGGER_NAMES = ("bench-main", "bench-mysql", "bench-openai", "bench-whatsapp")
+HISTORY = [{"query": "Jakie usługi chmurowe oferuje Euvic? " * 3, "answer": "Euvic oferuje migracje do Azure. " * 8,
+            "created_at": "2024-05-01T12:00:00"} for _ in range(5)]
+
+
+class LegacyPolandFormatter(logging.Formatter):
+    def formatTime(self, record, datefmt=None):
+        return datetime.fromtimestamp(record.created, POLAND_TZ).isoformat(timespec='milliseconds')
+
+
+def make_handlers(directory, name, formatter, console):
+    file_handler = RotatingFileHandler(os.path.join(directory, f"{name}.log"), maxBytes=10 * 1024 * 1024,
+                                       backupCount=5, encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    return [file_handler, console]
+
+
+def setup(mode, directory, devnull):
+    listener = None
+    if mode == "sync":
+        formatter = LegacyPolandFormatter('%(asctime)s %(levelname)s %(message)s')
+    else:
+        formatter = PolandFormatter('%(asctime)s %(levelname)s %(message)s')
+        listener = LoggerRoutingListener(queue.SimpleQueue())
+        queue_handler = QueueHandler(listener.queue)
+    console = logging.StreamHandler(devnull)
+    console.setFormatter(formatter)
+
+    loggers = []
+    for name in LOGGER_NAMES:
+        logger = logging.getLogger(f"{name}-{mode}")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handlers = make_handlers(directory, f"{name}-{mode}", formatter, console)
+        if listener is not None:
+            listener.routes[logger.name] = handlers
+            logger.addHandler(queue_handler)
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
+        loggers.append(logger)
+    if listener is not None:
+        listener.start()
+    return loggers, listener
+
+
+def one_request(main, mysql, openai, whatsapp, i):
+    whatsapp.info(f'✅ Received message: question {i} from 48123456789')
+    log_lines = [f"📜 Retrieved {len(HISTORY)} entries from chat history for user 48123456789:"]
+    for n, entry in enumerate(HISTORY, 1):
+        log_lines.append(f"  {n}. 🗨️ Query: {entry['query'][:50]}...")
+        log_lines.append(f"     💬 Answer: {entry['answer'][:50]}...")
+        log_lines.append(f"     🕒 Time: {entry['created_at']}")
+    mysql.info("➡️ Chat history retrieved successfully.")
+    mysql.info("\n".join(log_lines))
+    main.info(f'🔄 Processing query: question {i}')
+    main.info(f"📜 Chat history provided with {len(HISTORY)} entries")
+    openai.info("Embeddings generated successfully")
+    main.info("🔎 Vector search completed with 10 results")
+    main.info("💬 Prepared 14 messages for OpenAI")
+    openai.info("Chat completion generated successfully")
+    main.info("✅ Chat completion generated")
+    main.info("✅ Query processed successfully")
+    whatsapp.info('🤖 RAGEngine processed query with chat history')
+    whatsapp.info('✅ AI answer sent successfully!')
+    mysql.info("➡️ Answer-query pair inserted successfully.")
+    whatsapp.info('✅ AI answer sent and data inserted into MySQL')
+
+
+def run_mode(mode, total_requests, directory, devnull):
+    loggers, listener = setup(mode, directory, devnull)
+    timings = []
+    for i in range(total_requests):
+        started = time.perf_counter()
+        one_request(*loggers, i)
+        timings.append(time.perf_counter() - started)
+    drain_started = time.perf_counter()
+    if listener is not None:
+        listener.stop()
+    drain = time.perf_counter() - drain_started
+    for logger in loggers:
+        for handler in set(logger.handlers) | set(listener.routes.get(logger.name, ()) if listener else ()):
+            handler.close()
+    return timings, drain
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-logging-") as directory, open(os.devnull, "w") as devnull:
+        for mode in ("sync", "queue"):
+            timings, drain = run_mode(mode, args.requests, directory, devnull)
+            results[mode] = sum(timings) / len(timings)
+            print(f"{mode:>6}: {results[mode] * 1e6:8.1f} us/request on the calling thread  "
+                  f"p50={percentile(timings, 50) * 1e6:7.1f}us  p99={percentile(timings, 99) * 1e6:7.1f}us  "
+                  f"(listener drain after the run: {drain * 1000:.1f} ms)")
+    saved = results["sync"] - results["queue"]
+    print(f"saved: {saved * 1e6:.1f} us of event loop blocking per request "
+          f"({saved / results['sync'] * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
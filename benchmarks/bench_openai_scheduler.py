@@ -0,0 +1,127 @@
+"""
+OpenAI traffic against a quota, with and without the client-side scheduler (src.ai.rate_limiter):
+
+* interactive - questions arriving at --rps, each one query embedding + one chat completion
+                (what RAGEngine does per message), measured end to end
+* background  - an ingestion run pushing embedding batches with --ingest-concurrency batches in flight
+
+Both share the stub's per-model RPM / TPM quota (--rpm / --tpm), which answers with 429 and the
+x-ratelimit-* / retry-after-ms headers like the real API. Without the scheduler the openai SDK's own
+retries (2, honouring retry-after) are all there is; with it, calls wait for budget, interactive calls
+go first and background batches leave OPENAI_BACKGROUND_RESERVE of the quota free.
+
+Usage:
+    python -m benchmarks.bench_openai_scheduler --duration 40 --rps 3 --rpm 60
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.common import percentile
+from benchmarks.stubs import StubOpenAIServer
+
+QUESTION = "Jakie usługi chmurowe oferuje Euvic i ile kosztuje migracja do Azure?"
+CONTEXT = "Euvic oferuje migracje do Azure, wsparcie 24/7 i zarządzanie klastrami Kubernetes. " * 60
+
+
+async def interactive(client, rps, duration, results):
+    from src.ai.openai_client import CHAT_COMPLETION_ERROR
+
+    async def one(i):
+        started = time.perf_counter()
+        try:
+            await client.agenerate_embeddings(f"{QUESTION} #{i}")
+            answer = await client.agenerate_chat_completion([
+                {"role": "system", "content": CONTEXT},
+                {"role": "user", "content": QUESTION},
+            ])
+            ok = answer != CHAT_COMPLETION_ERROR
+        except Exception:
+            ok = False
+        results.append((ok, time.perf_counter() - started))
+
+    tasks = []
+    started = time.perf_counter()
+    i = 0
+    while time.perf_counter() - started < duration:
+        tasks.append(asyncio.create_task(one(i)))
+        i += 1
+        await asyncio.sleep(max(0.0, started + i / rps - time.perf_counter()))
+    await asyncio.gather(*tasks)
+
+
+async def background(client, batch, chunk_words, concurrency, stop, counters):
+    chunk = " ".join(["chmura"] * chunk_words)
+
+    async def worker(n):
+        while not stop.is_set():
+            try:
+                vectors = await client.agenerate_embeddings_batch([f"{chunk} {n} {i}" for i in range(batch)],
+                                                                  batch_size=batch)
+                counters["embedded"] += len(vectors)
+            except Exception:
+                counters["failed_batches"] += 1
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+
+
+async def run_mode(scheduled, args):
+    stub = StubOpenAIServer(latency=args.openai_latency_ms / 1000, token_latency=0.005, answer_tokens=80,
+                            embedding_latency=args.embedding_latency_ms / 1000, rpm=args.rpm, tpm=args.tpm)
+    os.environ["OPENAI_BASE_URL"] = await stub.start()
+    from src.ai.embedding_cache import EmbeddingCache
+    from src.ai.openai_client import OpenAIClient
+
+    client = OpenAIClient(embedding_cache=EmbeddingCache(max_size=0))
+    if not scheduled:
+        client.schedulers = None
+
+    results, counters, stop = [], {"embedded": 0, "failed_batches": 0}, asyncio.Event()
+    started = time.perf_counter()
+    ingestion = asyncio.create_task(background(client, args.batch, args.chunk_words, args.ingest_concurrency,
+                                               stop, counters))
+    await interactive(client, args.rps, args.duration, results)
+    stop.set()
+    await ingestion
+    elapsed = time.perf_counter() - started
+    await client.aclose()
+    await stub.stop()
+
+    latencies = [latency for ok, latency in results if ok]
+    failed = sum(1 for ok, _ in results if not ok)
+    print(f"{'scheduler' if scheduled else 'sdk retries':>12}: interactive ok={len(latencies)} failed={failed}  "
+          + (f"p50={percentile(latencies, 50):.2f}s p95={percentile(latencies, 95):.2f}s "
+             f"p99={percentile(latencies, 99):.2f}s  " if latencies else "")
+          + f"background {counters['embedded'] / elapsed:.0f} chunks/s (failed batches {counters['failed_batches']})  "
+          f"429s={stub.rate_limited}")
+    if scheduled:
+        for model, stats in client.scheduler_stats().items():
+            print(f"{'':>14}{model}: concurrency limit {stats['concurrency_limit']}, "
+                  f"decreases {stats['concurrency_decreases']}, deadline exceeded {stats['deadline_exceeded']}")
+
+
+async def main_async(args):
+    for scheduled in (False, True):
+        await run_mode(scheduled, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=40.0)
+    parser.add_argument("--rps", type=float, default=3.0)
+    parser.add_argument("--rpm", type=int, default=60)
+    parser.add_argument("--tpm", type=int, default=400000)
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--chunk-words", type=int, default=300)
+    parser.add_argument("--ingest-concurrency", type=int, default=8)
+    parser.add_argument("--openai-latency-ms", type=float, default=400.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=80.0)
+    args = parser.parse_args()
+    os.environ.setdefault("OPEN_AI_KEY", "bench")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Retrieval quality of follow-up questions with and without query rewriting (src.ai.query_rewriter).
+
+A small knowledge base has one document per (service, aspect) - price, rollout time, SLA,
+requirements - in Polish and English. Every conversation asks about a service first and then a
+follow-up that names only the aspect ("A ile to kosztuje?", "What SLA do you offer for it?").
+The follow-up is searched in the BM25 index (the real LexicalIndex) as asked and after the heuristic
+rewrite; the target is the document of the service from the first turn. Embeddings are hashed in the
+stubs, so vector retrieval cannot be judged offline - BM25 stands in for it.
+
+Also reports how many standalone questions asked mid-conversation stay cache-eligible and the cost
+of the heuristic rewrite.
+
+Usage:
+    python -m benchmarks.bench_query_rewrite
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+
+from benchmarks.common import percentile
+from benchmarks.stubs import fake_embedding, attach_in_memory_collection
+
+SERVICES = [
+    ("migracja do Azure", "Azure migration"),
+    ("klastry Kubernetes AKS", "Kubernetes AKS clusters"),
+    ("Microsoft 365", "Microsoft 365"),
+    ("kopie zapasowe Veeam", "Veeam backups"),
+    ("monitoring Zabbix", "Zabbix monitoring"),
+    ("licencje Microsoft", "Microsoft licensing"),
+    ("centrum bezpieczeństwa SOC", "SOC security center"),
+    ("hurtownia danych Synapse", "Synapse data warehouse"),
+]
+ASPECTS = {
+    "price": ("Ile kosztuje {pl}? Usługa {pl} kosztuje od 2000 zł miesięcznie, cena zależy od skali.",
+              "How much does {en} cost? The {en} service costs from 500 EUR per month, price depends on scale.",
+              ["A ile to kosztuje?", "Ile kosztuje?", "and how much does it cost?", "What's the price?"]),
+    "rollout": ("Jak długo trwa wdrożenie: {pl}? Wdrożenie {pl} trwa zwykle od 2 do 6 tygodni.",
+                "How long does the {en} rollout take? A {en} rollout usually takes 2 to 6 weeks.",
+                ["Jak długo trwa wdrożenie?", "A wdrożenie?", "How long does the rollout take?"]),
+    "sla": ("Jakie SLA dla {pl}? Dla {pl} gwarantujemy SLA 99,9% i wsparcie 24/7.",
+            "What SLA do you offer for {en}? For {en} we guarantee a 99.9% SLA and 24/7 support.",
+            ["Jakie SLA dla tego?", "What SLA do you offer for it?", "A SLA?"]),
+    "requirements": ("Jakie są wymagania: {pl}? Przed startem {pl} potrzebujemy dostępu administratora i audytu.",
+                     "What are the requirements for {en}? Before {en} starts we need admin access and an audit.",
+                     ["Jakie są wymagania?", "What do you need from us for that?", "A wymagania?"]),
+}
+FIRST_TURNS = ["Czy oferujecie {pl}?", "Opowiedz mi o usłudze {pl}", "Do you provide {en}?"]
+STANDALONE = ["Ile kosztuje {pl}?", "What SLA do you offer for {en}?", "Jak długo trwa wdrożenie: {pl}?"]
+
+
+def knowledge_base():
+    documents = []
+    created_at = datetime.datetime(2024, 1, 1)
+    for s, (pl, en) in enumerate(SERVICES):
+        for aspect, (pl_text, en_text, _) in ASPECTS.items():
+            for language, text in (("pl", pl_text), ("en", en_text)):
+                content = text.format(pl=pl, en=en) + " Euvic Services realizuje projekty w całej Polsce." * 3
+                documents.append({"_id": f"{s}-{aspect}-{language}", "title": f"{en} - {aspect}", "pageNumber": 1,
+                                  "content": content, "createdAt": created_at + datetime.timedelta(minutes=len(documents)),
+                                  "wordCount": len(content.split()), "vector": fake_embedding(content, 64).tolist()})
+    return documents
+
+
+def conversations():
+    for s, (pl, en) in enumerate(SERVICES):
+        for first in FIRST_TURNS:
+            history = [{"query": first.format(pl=pl, en=en), "answer": "Tak, Euvic Services to oferuje.",
+                        "created_at": "2024-05-01T12:00:00"}]
+            for aspect, (_, _, follow_ups) in ASPECTS.items():
+                for follow_up in follow_ups:
+                    yield history, follow_up, s, aspect
+
+
+def rank(results, service, aspect):
+    for position, result in enumerate(results, 1):
+        if result["_id"].startswith(f"{service}-{aspect}-"):
+            return position
+    return None
+
+
+async def rewrite_all(rewriter, cases):
+    """(rewritten queries, per-call seconds) - one event loop for all calls, so only the rewrite is timed."""
+    queries, timings = [], []
+    for history, follow_up, _, _ in cases:
+        started = time.perf_counter()
+        query, _ = await rewriter.arewrite(follow_up, history)
+        timings.append(time.perf_counter() - started)
+        queries.append(query)
+    return queries, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+    os.environ.setdefault("OPEN_AI_KEY", "bench")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    from src.ai.query_rewriter import QueryRewriter, is_follow_up
+    from src.database.lexical_index import LexicalIndex
+    from src.database.mongodb_client import MongoDBClient
+
+    mongodb_client = MongoDBClient()
+    attach_in_memory_collection(mongodb_client, knowledge_base())
+    rewriter = QueryRewriter(mode="heuristic", cache_size=0)
+
+    with tempfile.TemporaryDirectory(prefix="bench-rewrite-") as directory:
+        index = LexicalIndex(directory)
+        index.refresh(mongodb_client)
+
+        ranks = {"as asked": [], "rewritten": []}
+        detected = 0
+        cases = list(conversations())
+        queries, timings = asyncio.run(rewrite_all(rewriter, cases))
+        for (history, follow_up, service, aspect), query in zip(cases, queries):
+            detected += is_follow_up(follow_up)
+            ranks["as asked"].append(rank(index.search(follow_up, args.top_k), service, aspect))
+            ranks["rewritten"].append(rank(index.search(query, args.top_k), service, aspect))
+
+    total = len(timings)
+    print(f"{total} follow-ups over {len(SERVICES)} services, {detected} detected as follow-ups "
+          f"({detected / total * 100:.0f}%)")
+    for name, values in ranks.items():
+        found = [value for value in values if value is not None]
+        mrr = sum(1 / value for value in found) / total
+        hits = "  ".join(f"hit@{k}={sum(1 for value in found if value <= k) / total * 100:5.1f}%"
+                         for k in (1, 3, 6, args.top_k))
+        print(f"  {name:>9}: {hits}  MRR={mrr:.3f}")
+
+    standalone = [question.format(pl=pl, en=en) for pl, en in SERVICES for question in STANDALONE]
+    eligible = sum(1 for question in standalone if not is_follow_up(question))
+    print(f"standalone questions asked mid-conversation: {eligible}/{len(standalone)} cache-eligible "
+          f"(before: 0 - any chat history disabled the semantic cache)")
+    print(f"heuristic rewrite: p50={percentile(timings, 50) * 1e6:.1f}us p99={percentile(timings, 99) * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Startup cost of the service, measured without any external dependency:
+
+* import   - cold `import <module>` in a fresh interpreter (median of --runs). src.config is what the
+             src.server supervisor loads, main is what every worker loads.
+* startup  - one worker from process spawn to "ready to serve": import main, then before_serving with
+             the steps run one after another (the old main.py) vs concurrently (the current main.py).
+             MySQL is the SQLite stand-in with --mysql-connect-ms per pool, Cosmos DB the in-memory
+             collection with --cosmos-latency-ms per call, local / lexical indexes are built from scratch.
+* workers  - --workers processes spawned at once (like `python -m src.server`) vs a single one: wall
+             time until the last worker is ready. Index snapshots are built by the first worker under
+             the file lock and memory-mapped by the others. Importing is CPU-bound, so with fewer
+             cores than workers the imports queue up behind each other.
+
+Usage:
+    python -m benchmarks.bench_startup --runs 5 --workers 4
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import percentile
+
+IMPORT_MODULES = ("src.config", "main")
+
+
+def cold_import(module, runs):
+    code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    env = {**os.environ, "OPEN_AI_KEY": os.environ.get("OPEN_AI_KEY", "bench"), "LOG_LEVEL": "WARNING"}
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env, check=True)
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def worker_settings(workdir, workers):
+    settings = {
+        "OPEN_AI_KEY": "bench",
+        "PHONE_NUMBER_ID": "123456789",
+        "ACCESS_TOKEN": "bench",
+        "LOG_LEVEL": "WARNING",
+        "LOG_DIR": os.path.join(workdir, "logs"),
+        "LOCAL_INDEX_DIR": os.path.join(workdir, "local_index"),
+        "LEXICAL_INDEX_DIR": os.path.join(workdir, "lexical_index"),
+        "QUEUE_JOURNAL_PATH": os.path.join(workdir, "journal.sqlite"),
+    }
+    if workers > 1:
+        # To samo, co src.server.configure_workers
+        settings["HISTORY_CACHE_ENABLED"] = "false"
+        settings["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite")
+    return settings
+
+
+async def sequential_startup(main):
+    """before_serving as it was before the steps were gathered."""
+    from src.database.mysql_queries import initialize_connection_pools
+    from src.ai.context_builder import load_tokenizer
+    from src.whatsapp.whatsapp_client import WhatsAppClient
+
+    rag_engine = main.get_rag_engine()
+    await initialize_connection_pools()
+    await rag_engine.aconnect()
+    await rag_engine._aensure_index()
+    await rag_engine.retriever.astart()
+    if rag_engine.lexical_retriever:
+        await rag_engine.lexical_retriever.astart()
+    await rag_engine._arefresh_knowledge_base_version()
+    await asyncio.to_thread(load_tokenizer)
+    rag_engine.openai_client.create_clients()
+    await WhatsAppClient.start()
+    await main.get_message_queue().start()
+
+
+async def run_startup(main, mode):
+    started = time.perf_counter()
+    if mode == "sequential":
+        await sequential_startup(main)
+    else:
+        await main.before_serving()
+    elapsed = time.perf_counter() - started
+    ready_at = time.time()
+    await main.after_serving()
+    return ready_at, elapsed
+
+
+def boot_worker(settings, options, mode, ready):
+    """multiprocessing target: a fresh interpreter doing what one Hypercorn worker does at startup."""
+    os.environ.update(settings)
+    started = time.perf_counter()
+    import main
+    from benchmarks.stubs import wire_application
+
+    wire_application(options["documents"], cosmos_latency=options["cosmos_latency"],
+                     mysql_connect_latency=options["mysql_connect_latency"])
+    imported = time.perf_counter() - started
+    ready_at, startup = asyncio.run(run_startup(main, mode))
+    ready.put((ready_at, imported, startup))
+
+
+def boot(workers, mode, options):
+    """Spawns `workers` processes at once; returns (wall time until the last one is ready, per-worker results)."""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as workdir:
+        settings = worker_settings(workdir, workers)
+        launched = time.time()
+        processes = [context.Process(target=boot_worker, args=(settings, options, mode, ready))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        results = [ready.get(timeout=120) for _ in processes]
+        for process in processes:
+            process.join()
+    wall = max(ready_at for ready_at, _, _ in results) - launched
+    return wall, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--mysql-connect-ms", type=float, default=150.0)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=40.0)
+    args = parser.parse_args()
+    options = {"documents": args.documents, "cosmos_latency": args.cosmos_latency_ms / 1000,
+               "mysql_connect_latency": args.mysql_connect_ms / 1000}
+
+    print("cold import (fresh interpreter):")
+    for module in IMPORT_MODULES:
+        timings = cold_import(module, args.runs)
+        print(f"  {module:>10}: median {statistics.median(timings) * 1000:7.1f} ms  "
+              f"max {max(timings) * 1000:7.1f} ms")
+
+    print(f"\nsingle worker startup ({args.documents} documents, mysql connect {args.mysql_connect_ms:.0f} ms, "
+          f"cosmos {args.cosmos_latency_ms:.0f} ms/call):")
+    startups = {}
+    for mode in ("sequential", "parallel"):
+        samples = [boot(1, mode, options) for _ in range(args.runs)]
+        walls = [wall for wall, _ in samples]
+        startups[mode] = [results[0][2] for _, results in samples]
+        imports = [results[0][1] for _, results in samples]
+        print(f"  {mode:>10}: spawn->ready median {statistics.median(walls) * 1000:7.1f} ms  "
+              f"(import {statistics.median(imports) * 1000:6.1f} ms, "
+              f"before_serving {statistics.median(startups[mode]) * 1000:6.1f} ms)")
+    saved = statistics.median(startups["sequential"]) - statistics.median(startups["parallel"])
+    print(f"  before_serving saved: {saved * 1000:.1f} ms")
+
+    print(f"\nworker processes ({args.workers} vs 1, parallel startup):")
+    for workers in (1, args.workers):
+        walls, per_worker = [], []
+        for _ in range(args.runs):
+            wall, results = boot(workers, "parallel", options)
+            walls.append(wall)
+            per_worker.extend(startup for _, _, startup in results)
+        print(f"  {workers:>3} worker(s): all ready after median {statistics.median(walls) * 1000:7.1f} ms  "
+              f"before_serving p50={percentile(per_worker, 50) * 1000:6.1f} ms "
+              f"p95={percentile(per_worker, 95) * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
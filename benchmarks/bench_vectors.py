@@ -0,0 +1,118 @@
+"""
+Recall versus size of the embedding representations (src.database.vectors):
+
+* wire / memory - one embedding as a BSON array of doubles (what `vector` costs on every Cosmos read),
+                  as the packed float32 BSON binary (`vectorPacked`), as a Python list of floats and
+                  as a float32 array
+* local index   - every LOCAL_INDEX_VECTOR_DTYPE x LOCAL_INDEX_PCA_DIMENSIONS setting: bytes per vector
+                  (codes + the precomputed per-row factor), recall@1 / recall@10 against exact float32
+                  search and the latency of one exact (brute force) query
+
+Without --embeddings the corpus is synthetic: topic clusters in a low-rank subspace with a shared
+offset and isotropic noise, which is roughly how ada-002 embeddings are spread (they are far from
+uniform on the sphere, which is what makes PCA work). Pass a .npy matrix of real embeddings
+(rows = documents) to choose a setting on your own data; queries are then held-out rows.
+
+Usage:
+    python -m benchmarks.bench_vectors --documents 20000 --queries 200
+    python -m benchmarks.bench_vectors --embeddings embeddings.npy
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import bson
+
+from benchmarks.common import percentile
+
+SETTINGS = [("float32", 0), ("float16", 0), ("int8", 0), ("float32", 512), ("int8", 512), ("float32", 256),
+            ("int8", 256), ("int8", 128), ("int8", 64)]
+
+
+def synthetic_embeddings(count, dimensions, topics=200, rank=256, seed=0):
+    rng = np.random.default_rng(seed)
+    basis = np.linalg.qr(rng.standard_normal((dimensions, rank)))[0].T  # (rank, d), orthonormal rows
+    spectrum = (1 / np.sqrt(np.arange(1, rank + 1))).astype(np.float32)
+    centers = rng.standard_normal((topics, rank)).astype(np.float32) * spectrum
+    latent = centers[rng.integers(topics, size=count)] + 0.35 * rng.standard_normal((count, rank)) * spectrum
+    offset = rng.standard_normal(dimensions).astype(np.float32) * 0.02
+    vectors = latent.astype(np.float32) @ basis.astype(np.float32) + offset
+    vectors += rng.standard_normal((count, dimensions)).astype(np.float32) * 0.004
+    return vectors.astype(np.float32)
+
+
+def wire_sizes(vector):
+    from src.database.vectors import pack_vector
+
+    values = vector.tolist()
+    python_list = sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values)
+    return [
+        ("BSON array of doubles", len(bson.encode({"vector": values}))),
+        ("BSON binary float32 (vectorPacked)", len(bson.encode({"vectorPacked": pack_vector(vector)}))),
+        ("Python list of floats", python_list),
+        ("float32 array", vector.nbytes),
+    ]
+
+
+def top_k(scores, k):
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--embeddings", help=".npy matrix of real embeddings, one row per document")
+    args = parser.parse_args()
+
+    from src.database.vectors import VectorCodec, normalize_rows
+
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype(np.float32)
+        documents, queries = vectors[:-args.queries], vectors[-args.queries:]
+    else:
+        vectors = synthetic_embeddings(args.documents + args.queries, args.dimensions)
+        documents, queries = vectors[:args.documents], vectors[args.documents:]
+    documents = normalize_rows(documents.copy())[0]
+    k = min(args.top_k, len(documents))
+
+    print(f"one {documents.shape[1]}-d embedding:")
+    for name, size in wire_sizes(vectors[0]):
+        print(f"  {name:>36}: {size:7d} bytes")
+
+    exact = top_k(normalize_rows(queries.copy())[0] @ documents.T, k)
+    print(f"\nlocal index, {len(documents)} documents, {len(queries)} queries "
+          f"(recall against exact float32 search):")
+    for dtype, dimensions in SETTINGS:
+        if dimensions >= documents.shape[1]:
+            continue
+        started = time.perf_counter()
+        codec = VectorCodec.fit(documents, dtype, dimensions)
+        codes, factors = codec.encode(codec.project(documents))
+        built = time.perf_counter() - started
+
+        prepared = codec.project(queries)
+        found = top_k(codec.scores(codes, factors, prepared), k)
+        recall_1 = np.mean(found[:, 0] == exact[:, 0])
+        recall_k = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, exact)])
+
+        timings = []
+        for query in prepared[:50]:
+            started = time.perf_counter()
+            top_k(codec.scores(codes, factors, query[None, :]), k)
+            timings.append(time.perf_counter() - started)
+
+        size = codes.nbytes + factors.nbytes
+        name = f"{dtype}" + (f" + PCA {dimensions}" if dimensions else "")
+        print(f"  {name:>16}: {size / len(documents):7.0f} B/vector ({size / 2 ** 20:7.1f} MiB)  "
+              f"recall@1={recall_1 * 100:5.1f}%  recall@{k}={recall_k * 100:5.1f}%  "
+              f"query p50={percentile(timings, 50) * 1000:6.2f}ms  build {built:5.2f}s")
+
+
+if __name__ == "__main__":
+    main()
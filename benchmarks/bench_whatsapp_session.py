@@ -0,0 +1,76 @@
+"""
+Benchmark of outgoing WhatsApp messages against a local TLS stub of the Graph API:
+
+* per-message - a new aiohttp.ClientSession (TCP + TLS handshake) for every message (old behaviour)
+* shared      - WhatsAppClient with one long-lived session and keep-alive connection pool
+
+Usage:
+    python -m benchmarks.bench_whatsapp_session --messages 1000 --concurrency 50 --latency-ms 20
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("OPEN_AI_KEY", "benchmark")
+os.environ.setdefault("PHONE_NUMBER_ID", "123456789")
+
+from benchmarks.common import summarize, format_summary  # noqa: E402
+from benchmarks.stubs import StubGraphServer, make_self_signed_ssl  # noqa: E402
+import src.whatsapp.whatsapp_client as whatsapp_module  # noqa: E402
+from src.whatsapp.whatsapp_client import WhatsAppClient  # noqa: E402
+import aiohttp  # noqa: E402
+
+
+async def send_with_new_session(url, client_ssl, text, recipient):
+    payload = {'messaging_product': 'whatsapp', 'recipient_type': 'individual', 'to': recipient, 'type': 'text',
+               'text': {'preview_url': False, 'body': text}}
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=client_ssl)) as session:
+        async with session.post(url, json=payload) as response:
+            return response.status
+
+
+async def run(args):
+    server_ssl, client_ssl = make_self_signed_ssl()
+    server = StubGraphServer(latency=args.latency_ms / 1000, error_rate=args.error_rate, ssl_context=server_ssl)
+    endpoint = await server.start()
+    whatsapp_module.META_ENDPOINT = endpoint
+    url = f"{endpoint}{whatsapp_module.PHONE_NUMBER_ID}/messages"
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def measure(name, send):
+        latencies = []
+
+        async def one(i):
+            async with semaphore:
+                started = time.perf_counter()
+                await send(i)
+                latencies.append(time.perf_counter() - started)
+
+        server.connections.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(args.messages)))
+        summary = summarize(latencies, time.perf_counter() - started)
+        print(f"{format_summary(name, summary)}  tcp_connections={len(server.connections)}")
+
+    await measure("per-message", lambda i: send_with_new_session(url, client_ssl, f"answer {i}", "48123456789"))
+
+    await WhatsAppClient.start(ssl=client_ssl)
+    await measure("shared", lambda i: WhatsAppClient.send_message(f"answer {i}", "48123456789"))
+    await WhatsAppClient.close()
+    await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="Stub Graph API processing time")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of 429 responses from the stub")
+    args = parser.parse_args()
+    print(f"messages={args.messages} concurrency={args.concurrency} latency={args.latency_ms}ms (TLS)")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import statistics
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "count": len(latencies),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+def format_summary(name, summary):
+    return (f"{name:>10}: {summary['throughput_rps']:8.1f} req/s  p50={summary['p50_ms']:7.1f}ms  "
+            f"p95={summary['p95_ms']:7.1f}ms  p99={summary['p99_ms']:7.1f}ms")
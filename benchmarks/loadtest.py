@@ -0,0 +1,290 @@
+"""
+End-to-end load test of the whole service without any external dependency.
+
+The Quart `app` from main.py is served by Hypercorn on localhost, with:
+
+* OpenAI      -> StubOpenAIServer (latency to first token, per-token latency, SSE streaming)
+* Cosmos DB   -> InMemoryVectorCollection behind the real MongoDBClient (exact cosine search)
+* MySQL       -> SQLite in-memory database behind the real mysql_queries / PoolManager
+* Graph API   -> StubGraphServer, which also marks when each answer is delivered
+
+Webhook payloads are posted at a fixed rate (open loop, optionally Poisson arrivals). The report has
+throughput, webhook ack and end-to-end (message posted -> first answer delivered) percentiles,
+per-stage p95 from src.metrics and process resource usage. Stubs run in the same process,
+so CPU numbers include them.
+
+Usage:
+    python -m benchmarks.loadtest --rps 50 --duration 30
+    python -m benchmarks.loadtest --rps 200 --duration 60 --openai-latency-ms 800 --stream-mode chunks
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import socket
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile
+from benchmarks.stubs import StubOpenAIServer, StubGraphServer, wire_application
+
+try:
+    import psutil
+except ImportError:  # psutil is optional, resource.getrusage gives the totals
+    psutil = None
+
+QUESTIONS = [
+    "Jakie usługi chmurowe oferuje Euvic?",
+    "Ile kosztuje migracja do Azure?",
+    "Czy zapewniacie wsparcie 24/7?",
+    "What SLA do you offer for Kubernetes clusters?",
+    "Jak wygląda proces wdrożenia?",
+    "Do you help with Microsoft licensing?",
+    "Jakie certyfikaty bezpieczeństwa posiadacie?",
+    "cennik Azure",
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def webhook_payload(sender, message_id, text):
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{"id": "loadtest", "changes": [{"field": "messages", "value": {
+            "messaging_product": "whatsapp",
+            "metadata": {"display_phone_number": "48000000000", "phone_number_id": os.environ["PHONE_NUMBER_ID"]},
+            "contacts": [{"profile": {"name": "Load Test"}, "wa_id": str(sender)}],
+            "messages": [{"from": str(sender), "id": message_id, "timestamp": str(int(time.time())),
+                          "type": "text", "text": {"body": text}}],
+        }}]}],
+    }
+
+
+class ResourceSampler:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.cpu = []
+        self.peak_rss_mb = 0.0
+        self.peak_threads = threading.active_count()
+        self._process = psutil.Process() if psutil else None
+
+    async def run(self):
+        if self._process:
+            self._process.cpu_percent(None)
+        while True:
+            await asyncio.sleep(self.interval)
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            if self._process:
+                self.cpu.append(self._process.cpu_percent(None))
+                self.peak_rss_mb = max(self.peak_rss_mb, self._process.memory_info().rss / 2 ** 20)
+
+    def report(self, elapsed, cpu_started):
+        cpu_seconds = time.process_time() - cpu_started
+        rss = self.peak_rss_mb or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        line = (f"resources: cpu={cpu_seconds:.1f}s ({cpu_seconds / elapsed * 100:.0f}% of one core)  "
+                f"peak_rss={rss:.0f}MB  peak_threads={self.peak_threads}")
+        if self.cpu:
+            line += f"  cpu_p95={percentile(self.cpu, 95):.0f}%"
+        return line
+
+
+class LoadTest:
+    def __init__(self, args, graph, openai_stub):
+        self.args = args
+        self.graph = graph
+        self.openai_stub = openai_stub
+        self.run_id = random.getrandbits(32)
+        self.pending = {}  # sender -> [posted_at, ...] not answered yet
+        self.ack_latencies = []
+        self.end_to_end = []
+        self.statuses = {}
+        self.answered = asyncio.Event()
+        graph.on_message = self.on_delivery
+
+    def on_delivery(self, payload):
+        # Pierwsza wiadomość do nadawcy zamyka wszystkie jego oczekujące pytania (koalescencja / chunki)
+        posted = self.pending.pop(int(payload["to"]), None)
+        if posted:
+            now = time.perf_counter()
+            self.end_to_end.extend(now - posted_at for posted_at in posted)
+            if not self.pending:
+                self.answered.set()
+
+    def sender_for(self, i):
+        if self.args.senders:
+            return 48500000000 + random.randrange(self.args.senders)
+        return 48500000000 + i
+
+    async def post(self, session, url, i):
+        sender = self.sender_for(i)
+        question = QUESTIONS[i % len(QUESTIONS)]
+        if i % self.args.distinct_questions >= len(QUESTIONS):
+            question = f"{question} (wariant {i % self.args.distinct_questions})"
+        payload = webhook_payload(sender, f"wamid.load.{self.run_id}.{i}", question)
+        self.pending.setdefault(sender, []).append(time.perf_counter())
+        self.answered.clear()
+        started = time.perf_counter()
+        try:
+            async with session.post(url, json=payload) as response:
+                await response.read()
+                status = response.status
+        except Exception as e:
+            status = type(e).__name__
+        self.ack_latencies.append(time.perf_counter() - started)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status != 200:
+            # Nieprzyjęta wiadomość nie dostanie odpowiedzi - nie czekamy na nią
+            posted = self.pending.get(sender)
+            if posted:
+                posted.pop()
+                if not posted:
+                    del self.pending[sender]
+
+    async def drive(self, url):
+        import aiohttp
+        total = int(self.args.rps * self.args.duration)
+        loop = asyncio.get_running_loop()
+        connector = aiohttp.TCPConnector(limit=self.args.max_connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            tasks = []
+            next_at = loop.time()
+            for i in range(total):
+                delay = next_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(self.post(session, url, i)))
+                next_at += random.expovariate(self.args.rps) if self.args.poisson else 1 / self.args.rps
+            await asyncio.gather(*tasks)
+        return total
+
+
+def stage_report(metrics):
+    lines = []
+    for (name, labels), histogram in sorted(metrics._histograms.items()):
+        if name != "rag_stage_duration_seconds":
+            continue
+        quantiles = histogram.quantiles()
+        lines.append(f"  {dict(labels)['stage']:>14}: n={histogram.count:<6} p50={quantiles[0.5] * 1000:7.1f}ms  "
+                     f"p95={quantiles[0.95] * 1000:7.1f}ms")
+    return "\n".join(lines)
+
+
+async def run(args):
+    openai_stub = StubOpenAIServer(latency=args.openai_latency_ms / 1000, token_latency=args.token_ms / 1000,
+                                   answer_tokens=args.answer_tokens, embedding_latency=args.embedding_latency_ms / 1000)
+    graph = StubGraphServer(latency=args.graph_latency_ms / 1000)
+    os.environ["OPENAI_BASE_URL"] = await openai_stub.start()
+    os.environ["META_ENDPOINT"] = await graph.start()
+
+    # Konfiguracja czytana jest przy imporcie - aplikację importujemy dopiero, gdy stuby już działają
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    from main import app
+    from src.metrics import metrics
+
+    wire_application(args.documents, cosmos_latency=args.cosmos_latency_ms / 1000,
+                     mysql_latency=args.mysql_latency_ms / 1000)
+
+    port = free_port()
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.accesslog = None
+    stop = asyncio.Event()
+    server = asyncio.create_task(serve(app, config, shutdown_trigger=stop.wait))
+    await asyncio.sleep(0.5)
+    while not server.done():
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            break
+        except OSError:
+            await asyncio.sleep(0.1)
+
+    loadtest = LoadTest(args, graph, openai_stub)
+    sampler = ResourceSampler()
+    sampler_task = asyncio.create_task(sampler.run())
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    sent = await loadtest.drive(f"http://127.0.0.1:{port}/webhook")
+    sending_time = time.perf_counter() - started
+    try:
+        await asyncio.wait_for(loadtest.answered.wait(), timeout=args.drain_timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+    sampler_task.cancel()
+
+    answered = len(loadtest.end_to_end)
+    print(f"sent={sent} in {sending_time:.1f}s (target {args.rps} rps, achieved {sent / sending_time:.1f} rps)  "
+          f"statuses={loadtest.statuses}")
+    print(f"answered={answered} unanswered={sum(len(v) for v in loadtest.pending.values())}  "
+          f"throughput={answered / elapsed:.1f} answers/s over {elapsed:.1f}s")
+    if loadtest.ack_latencies:
+        acks = loadtest.ack_latencies
+        print(f"webhook ack:  p50={percentile(acks, 50) * 1000:7.1f}ms  p95={percentile(acks, 95) * 1000:7.1f}ms  "
+              f"p99={percentile(acks, 99) * 1000:7.1f}ms")
+    if loadtest.end_to_end:
+        e2e = loadtest.end_to_end
+        print(f"end to end:   p50={percentile(e2e, 50) * 1000:7.1f}ms  p95={percentile(e2e, 95) * 1000:7.1f}ms  "
+              f"p99={percentile(e2e, 99) * 1000:7.1f}ms")
+    print(f"stubs: chat_requests={openai_stub.chat_requests} embedding_requests={openai_stub.embedding_requests} "
+          f"graph_messages={graph.received}")
+    print(sampler.report(elapsed, cpu_started))
+    print("stages:")
+    print(stage_report(metrics))
+
+    stop.set()
+    await server
+    await graph.stop()
+    await openai_stub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=50.0)
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of sending")
+    parser.add_argument("--poisson", action="store_true", help="Exponential inter-arrival times instead of fixed")
+    parser.add_argument("--senders", type=int, default=0, help="Distinct senders, 0 = a new sender per message")
+    parser.add_argument("--distinct-questions", type=int, default=1000,
+                        help="Question variants; lower values raise the semantic cache hit rate")
+    parser.add_argument("--documents", type=int, default=500, help="Knowledge base size")
+    parser.add_argument("--openai-latency-ms", type=float, default=300.0, help="Time to the first completion token")
+    parser.add_argument("--token-ms", type=float, default=10.0, help="Time between completion tokens")
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--embedding-latency-ms", type=float, default=50.0)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=10.0)
+    parser.add_argument("--mysql-latency-ms", type=float, default=2.0)
+    parser.add_argument("--graph-latency-ms", type=float, default=50.0)
+    parser.add_argument("--max-connections", type=int, default=100, help="Client connections to the webhook")
+    parser.add_argument("--drain-timeout", type=float, default=60.0, help="Seconds to wait for outstanding answers")
+    parser.add_argument("--stream-mode", choices=("off", "chunks", "typing"), help="Overrides STREAM_MODE")
+    parser.add_argument("--coalesce-window", type=float, help="Overrides COALESCE_WINDOW (seconds)")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.setdefault("OPEN_AI_KEY", "loadtest")
+    os.environ.setdefault("PHONE_NUMBER_ID", "123456789")
+    os.environ.setdefault("ACCESS_TOKEN", "loadtest")
+    os.environ["LOG_LEVEL"] = args.log_level
+    os.environ["LOG_DIR"] = os.path.join(workdir, "logs")
+    os.environ["LOCAL_INDEX_DIR"] = os.path.join(workdir, "local_index")
+    os.environ["LEXICAL_INDEX_DIR"] = os.path.join(workdir, "lexical_index")
+    if args.stream_mode:
+        os.environ["STREAM_MODE"] = args.stream_mode
+    if args.coalesce_window is not None:
+        os.environ["COALESCE_WINDOW"] = str(args.coalesce_window)
+
+    print(f"rps={args.rps} duration={args.duration}s senders={args.senders or 'unique'} "
+          f"openai={args.openai_latency_ms}ms+{args.answer_tokens}x{args.token_ms}ms cpu_count={os.cpu_count()}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,553 @@
+"""Local stand-ins for external services used by the benchmarks."""
+import asyncio
+import base64
+import datetime
+import ipaddress
+import json
+import os
+import random
+import re
+import sqlite3
+import ssl
+import tempfile
+import time
+import zlib
+import numpy as np
+from aiohttp import web
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+def make_self_signed_ssl():
+    """Returns (server_context, client_context) for a throwaway localhost certificate."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"),
+                                                    x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]),
+                       critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    directory = tempfile.mkdtemp(prefix="bench-tls-")
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(cert_path, key_path)
+    client_context = ssl.create_default_context(cafile=cert_path)
+    return server_context, client_context
+
+
+class StubGraphServer:
+    """Fake Meta Graph API: accepts POST /{phone_number_id}/messages and answers after `latency` seconds."""
+
+    def __init__(self, latency=0.02, error_rate=0.0, ssl_context=None, port=0, on_message=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.ssl_context = ssl_context
+        self.port = port
+        self.on_message = on_message
+        self.received = 0
+        self.connections = set()
+        self._runner = None
+
+    async def _messages(self, request):
+        payload = await request.json()
+        self.connections.add(request.transport.get_extra_info("peername"))
+        await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "rate limited"}}, status=429,
+                                     headers={"Retry-After": "0"})
+        self.received += 1
+        if self.on_message is not None:
+            self.on_message(payload)
+        return web.json_response({"messaging_product": "whatsapp", "messages": [{"id": f"wamid.{self.received}"}]})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/{phone_number_id}/messages", self._messages)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port, ssl_context=self.ssl_context)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        scheme = "https" if self.ssl_context else "http"
+        return f"{scheme}://127.0.0.1:{self.port}/"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+def fake_embedding(text, dimensions=1536):
+    """Deterministic unit vector for a text - the same question always gets the same embedding."""
+    rng = np.random.default_rng(zlib.crc32(text.encode()))
+    vector = rng.standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class StubQuota:
+    """Per-model RPM / TPM quota refilled continuously, answering with the x-ratelimit-* headers."""
+
+    def __init__(self, rpm=0, tpm=0):
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self.remaining = {"requests": float(rpm), "tokens": float(tpm)}
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        for kind, limit in self.limits.items():
+            self.remaining[kind] = min(limit, self.remaining[kind] + (now - self._updated) * limit / 60)
+        self._updated = now
+
+    def _reset(self, kind):
+        limit = self.limits[kind]
+        return f"{max(limit - self.remaining[kind], 0) * 60 / limit:.3f}s" if limit else "0s"
+
+    def headers(self):
+        headers = {}
+        for kind, limit in self.limits.items():
+            if limit:
+                headers[f"x-ratelimit-limit-{kind}"] = str(limit)
+                headers[f"x-ratelimit-remaining-{kind}"] = str(max(int(self.remaining[kind]), 0))
+                headers[f"x-ratelimit-reset-{kind}"] = self._reset(kind)
+        return headers
+
+    def admit(self, tokens):
+        """Returns None when the request fits, otherwise the retry-after delay in seconds."""
+        self._refill()
+        wait = 0.0
+        for kind, amount in (("requests", 1), ("tokens", tokens)):
+            limit = self.limits[kind]
+            if limit and self.remaining[kind] < amount:
+                wait = max(wait, (amount - self.remaining[kind]) * 60 / limit)
+        if wait:
+            return wait
+        for kind, amount in (("requests", 1), ("tokens", tokens)):
+            if self.limits[kind]:
+                self.remaining[kind] -= amount
+        return None
+
+
+class StubOpenAIServer:
+    """
+    Fake OpenAI API: POST /v1/embeddings and /v1/chat/completions. Completions wait `latency` seconds
+    before the first token and `token_latency` between tokens; stream=True answers with SSE chunks
+    (plus the usage chunk when stream_options.include_usage is set), like the real API.
+    With `rpm` / `tpm` every model gets that quota and requests over it are answered with 429.
+    """
+
+    ANSWER_WORDS = "Euvic oferuje usługi chmurowe, migracje do Azure i wsparcie wdrożeń. Zespół pomaga 24/7.".split()
+
+    def __init__(self, latency=0.3, token_latency=0.01, answer_tokens=60, embedding_latency=0.05,
+                 dimensions=1536, port=0, rpm=0, tpm=0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.embedding_latency = embedding_latency
+        self.dimensions = dimensions
+        self.port = port
+        self.embedding_requests = 0
+        self.chat_requests = 0
+        self.rate_limited = 0
+        self.rpm = rpm
+        self.tpm = tpm
+        self._quotas = {}
+        self._runner = None
+
+    def _admit(self, model, tokens):
+        """(headers, None) when the request fits the model's quota, otherwise (headers, 429 response)."""
+        if not self.rpm and not self.tpm:
+            return {}, None
+        quota = self._quotas.setdefault(model, StubQuota(self.rpm, self.tpm))
+        wait = quota.admit(tokens)
+        headers = quota.headers()
+        if wait is None:
+            return headers, None
+        self.rate_limited += 1
+        headers["retry-after-ms"] = str(int(wait * 1000) + 1)
+        return headers, web.json_response(
+            {"error": {"message": f"Rate limit reached for {model}", "type": "requests", "code": "rate_limit_exceeded",
+                       "param": None}}, status=429, headers=headers)
+
+    def _answer_tokens(self):
+        return [f"{self.ANSWER_WORDS[i % len(self.ANSWER_WORDS)]} " for i in range(self.answer_tokens)]
+
+    async def _embeddings(self, request):
+        body = await request.json()
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        headers, rejected = self._admit(body.get("model"), sum(len(text) // 4 + 1 for text in inputs))
+        if rejected is not None:
+            return rejected
+        self.embedding_requests += 1
+        await asyncio.sleep(self.embedding_latency)
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text, self.dimensions)
+            # Klient openai domyślnie prosi o base64 (gdy jest numpy) i sam dekoduje float32
+            embedding = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" \
+                else vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(text.split()) for text in inputs)
+        return web.json_response({"object": "list", "data": data, "model": body.get("model"),
+                                  "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}, headers=headers)
+
+    async def _chat_completions(self, request):
+        body = await request.json()
+        model = body.get("model")
+        headers, rejected = self._admit(model, sum(len(str(message.get("content") or "")) // 4 + 1
+                                                   for message in body["messages"]) + self.answer_tokens)
+        if rejected is not None:
+            return rejected
+        self.chat_requests += 1
+        created = int(time.time())
+        prompt_tokens = sum(len(str(message.get("content") or "").split()) for message in body["messages"])
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": self.answer_tokens,
+                 "total_tokens": prompt_tokens + self.answer_tokens}
+        tokens = self._answer_tokens()
+        await asyncio.sleep(self.latency)
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.token_latency * len(tokens))
+            return web.json_response({
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                             "finish_reason": "stop", "logprobs": None}],
+                "usage": usage,
+            }, headers=headers)
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", **headers})
+        await response.prepare(request)
+
+        async def send(choices, **extra):
+            chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": choices, **extra}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+
+        for token in tokens:
+            await send([{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+            await asyncio.sleep(self.token_latency)
+        await send([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            await send([], usage=usage)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v1/embeddings", self._embeddings)
+        app.router.add_post("/v1/chat/completions", self._chat_completions)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+def make_knowledge_base(size=500, dimensions=1536):
+    from src.database.vectors import pack_vector
+
+    topics = ["Azure", "migracje", "cennik", "wsparcie", "bezpieczeństwo", "SLA", "Kubernetes", "licencje"]
+    created_at = datetime.datetime(2024, 1, 1)
+    documents = []
+    for i in range(size):
+        topic = topics[i % len(topics)]
+        content = f"Dokument {i} o temacie {topic}. " + f"Euvic Services opisuje {topic} w punktach. " * 20
+        vector = fake_embedding(content, dimensions)
+        documents.append({"_id": f"doc-{i}", "title": f"{topic} {i // len(topics)}", "pageNumber": i % 40 + 1,
+                          "content": content, "createdAt": created_at + datetime.timedelta(minutes=i),
+                          "wordCount": len(content.split()), "vector": vector.tolist(),
+                          "vectorPacked": pack_vector(vector)})
+    return documents
+
+
+class InMemoryVectorCollection:
+    """
+    pymongo-style collection over a list of documents. Answers the Cosmos `$search` / `$project`
+    pipeline built by MongoDBClient with exact cosine search, so the real client code runs unchanged.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        vectors = np.asarray([document["vector"] for document in documents], dtype=np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.indexes = [{"name": "_id_"}]
+
+    @staticmethod
+    def _project(document, projection, score=None):
+        if not projection:
+            return dict(document)
+        result = {key: document[key] for key, value in projection.items() if value == 1 and key in document}
+        if projection.get("_id", 1):
+            result["_id"] = document["_id"]
+        if "similarityScore" in projection:
+            result["similarityScore"] = score
+        return result
+
+    def _matches(self, document, query):
+        for key, condition in (query or {}).items():
+            if isinstance(condition, dict) and "$gt" in condition:
+                if not document.get(key) or document[key] <= condition["$gt"]:
+                    return False
+            elif isinstance(condition, dict) and "$in" in condition:
+                if document.get(key) not in condition["$in"]:
+                    return False
+            elif document.get(key) != condition:
+                return False
+        return True
+
+    def aggregate(self, pipeline):
+        search = pipeline[0]["$search"]["cosmosSearch"]
+        projection = pipeline[1]["$project"]
+        query = np.asarray(search["vector"], dtype=np.float32)
+        scores = self.vectors @ (query / (np.linalg.norm(query) or 1.0))
+        k = min(int(search["k"]), len(self.documents))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(self.documents) else np.arange(len(self.documents))
+        top = top[np.argsort(-scores[top])]
+        return [self._project(self.documents[i], projection, float(scores[i])) for i in top]
+
+    def find(self, query=None, projection=None):
+        return [self._project(document, projection) for document in self.documents if self._matches(document, query)]
+
+    def find_one(self, query=None, projection=None, sort=None):
+        documents = self.find(query, projection)
+        if sort:
+            key, direction = sort[0]
+            documents.sort(key=lambda document: document.get(key), reverse=direction < 0)
+        return documents[0] if documents else None
+
+    def count_documents(self, query):
+        return len(self.find(query))
+
+    def estimated_document_count(self):
+        return len(self.documents)
+
+    def list_indexes(self):
+        return list(self.indexes)
+
+    def create_index(self, keys, name=None, **options):
+        self.indexes.append({"name": name, "key": dict(keys), **options})
+        return name
+
+
+class _AsyncCursor:
+    def __init__(self, fetch, latency):
+        self._fetch = fetch
+        self._latency = latency
+
+    async def to_list(self, length=None):
+        await asyncio.sleep(self._latency)
+        return self._fetch()
+
+
+class AsyncInMemoryVectorCollection:
+    """Motor-style wrapper of InMemoryVectorCollection; every round trip costs `latency` seconds."""
+
+    def __init__(self, collection, latency=0.0):
+        self.collection = collection
+        self.latency = latency
+
+    def aggregate(self, pipeline):
+        return _AsyncCursor(lambda: self.collection.aggregate(pipeline), self.latency)
+
+    def list_indexes(self):
+        return _AsyncCursor(self.collection.list_indexes, self.latency)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        await asyncio.sleep(self.latency)
+        return self.collection.find_one(query, projection, sort)
+
+    async def estimated_document_count(self):
+        await asyncio.sleep(self.latency)
+        return self.collection.estimated_document_count()
+
+    async def create_index(self, keys, name=None, **options):
+        await asyncio.sleep(self.latency)
+        return self.collection.create_index(keys, name=name, **options)
+
+
+class InMemoryMongoClient:
+    def close(self):
+        pass
+
+
+def attach_in_memory_collection(mongodb_client, documents, latency=0.0):
+    """Points a MongoDBClient at an in-memory collection instead of Cosmos DB (both sync and async paths)."""
+    collection = InMemoryVectorCollection(documents)
+    mongodb_client.client = mongodb_client.async_client = InMemoryMongoClient()
+    mongodb_client.db = mongodb_client.async_db = {}
+    mongodb_client.collection = collection
+    mongodb_client.async_collection = AsyncInMemoryVectorCollection(collection, latency)
+    return collection
+
+
+# Zapytania z mysql_queries przepisane na dialekt SQLite (kolejność ma znaczenie - najpierw %s -> ?)
+MYSQL_TO_SQLITE = [
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"INSERT IGNORE"), "INSERT OR IGNORE"),
+    (re.compile(r"TIMESTAMPDIFF\(SECOND, ([\w.]+), NOW\(\)\)"),
+     r"CAST(strftime('%s', 'now') - strftime('%s', \1) AS INTEGER)"),
+    (re.compile(r"NOW\(\) - INTERVAL \? (SECOND|DAY)"), lambda m: f"datetime('now', '-' || ? || ' {m[1].lower()}s')"),
+    (re.compile(r"ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID\(id\)"),
+     "ON CONFLICT(whatsapp_number_id) DO UPDATE SET id = id RETURNING id"),
+    (re.compile(r",\s*INDEX \w+ \(\w+\)"), ""),
+    (re.compile(r"SELECT INDEX_NAME FROM information_schema\.STATISTICS[\s\S]*'whatsapp_number_id'"),
+     "SELECT il.name FROM pragma_index_list('users') il WHERE il.[unique] = 1 "
+     "AND (SELECT group_concat(name) FROM pragma_index_info(il.name)) = 'whatsapp_number_id'"),
+    (re.compile(r"SELECT COLUMN_NAME FROM information_schema\.COLUMNS[\s\S]*'claimed_by'"),
+     "SELECT name FROM pragma_table_info('processed_messages') WHERE name = 'claimed_by'"),
+]
+SQLITE_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, whatsapp_number_id INTEGER NOT NULL UNIQUE);
+CREATE TABLE queries (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, query TEXT, answer TEXT,
+                      created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP);
+CREATE INDEX idx_queries_user_created ON queries (user_id, created_at);
+"""
+
+
+def mysql_to_sqlite(sql):
+    for pattern, replacement in MYSQL_TO_SQLITE:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class SQLiteCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.lastrowid = None
+        self.rowcount = 0
+        self._cursor = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, sql, args=()):
+        await asyncio.sleep(self.connection.pool.latency)
+        translated = mysql_to_sqlite(sql)
+        self._cursor = self.connection.pool.database.execute(translated, args)
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+        if translated.rstrip().endswith("RETURNING id"):
+            # Odpowiednik LAST_INSERT_ID(id): id istniejącego lub nowego użytkownika
+            self.lastrowid = self._cursor.fetchone()[0]
+
+    async def executemany(self, sql, rows):
+        await asyncio.sleep(self.connection.pool.latency)
+        self._cursor = self.connection.pool.database.executemany(mysql_to_sqlite(sql), rows)
+        self.rowcount = self._cursor.rowcount
+
+    async def fetchall(self):
+        return self._cursor.fetchall()
+
+    async def fetchone(self):
+        return self._cursor.fetchone()
+
+
+class SQLiteConnection:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+class SQLiteMySQLPool:
+    """
+    Stand-in for an asyncmy pool backed by one in-memory SQLite database (autocommit). Every statement
+    costs `latency` seconds and at most `maxsize` connections are handed out, like a real pool.
+    """
+
+    def __init__(self, database, maxsize=5, latency=0.002):
+        self.database = database
+        self.maxsize = maxsize
+        self.latency = latency
+        self.in_use = 0
+        self._available = asyncio.Semaphore(maxsize)
+
+    @property
+    def size(self):
+        return self.maxsize
+
+    @property
+    def freesize(self):
+        return self.maxsize - self.in_use
+
+    async def acquire(self):
+        await self._available.acquire()
+        self.in_use += 1
+        return SQLiteConnection(self)
+
+    async def release(self, conn):
+        self.in_use -= 1
+        self._available.release()
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def create_sqlite_database():
+    sqlite3.register_converter("TIMESTAMP", lambda value: datetime.datetime.fromisoformat(value.decode()))
+    database = sqlite3.connect(":memory:", isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
+    database.executescript(SQLITE_SCHEMA)
+    return database
+
+
+def sqlite_pool_factory(database, maxsize=5, latency=0.002, connect_latency=0.0):
+    """
+    pool_factory for PoolManager: every "host" gets its own pool over the same SQLite database.
+    `connect_latency` emulates opening the pool's initial connections (TCP + TLS + auth).
+    """
+    async def create_pool(host, port):
+        await asyncio.sleep(connect_latency)
+        return SQLiteMySQLPool(database, maxsize=maxsize, latency=latency)
+    return create_pool
+
+
+def wire_application(documents=500, cosmos_latency=0.01, mysql_latency=0.002, mysql_connect_latency=0.0):
+    """
+    Points the imported application (src.api.webhook / src.database.mysql_queries) at the in-memory
+    Cosmos collection and the SQLite MySQL stand-in. Returns the RAGEngine used by the webhook.
+    """
+    from src.api.webhook import get_rag_engine
+    from src.database import mysql_queries
+
+    rag_engine = get_rag_engine()
+    database = create_sqlite_database()
+    for manager in (mysql_queries.read_pools, mysql_queries.write_pools):
+        manager.pool_factory = sqlite_pool_factory(database, maxsize=manager.maxsize, latency=mysql_latency,
+                                                   connect_latency=mysql_connect_latency)
+    attach_in_memory_collection(rag_engine.mongodb_client, make_knowledge_base(documents), latency=cosmos_latency)
+    return rag_engine
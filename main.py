@@ -2,23 +2,37 @@ import asyncio
 from quart import Quart
 from hypercorn.config import Config
 from hypercorn.asyncio import serve
-from src.api.webhook import webhook_bp
+from src.api.webhook import webhook_bp, get_rag_engine, get_message_queue
+from src.api.metrics import metrics_bp
 from src.config import PORT
 from src.logger import main_logger
 from src.database.mysql_queries import initialize_connection_pools, close_connection_pools
+from src.whatsapp.whatsapp_client import WhatsAppClient
 
 app = Quart(__name__)
 app.register_blueprint(webhook_bp)
+app.register_blueprint(metrics_bp)
 
 
 @app.before_serving
 async def before_serving():
-    await initialize_connection_pools()
+    rag_engine = get_rag_engine()
+    # Pule MySQL, MongoDB / indeksy i sesja HTTP do Graph API nie zależą od siebie - startują równolegle
+    await asyncio.gather(
+        initialize_connection_pools(),
+        rag_engine.abootstrap(),
+        WhatsAppClient.start(),
+    )
+    # Kolejka na końcu - odtwarza zadania z dziennika, więc potrzebuje gotowych zależności
+    await get_message_queue().start()
 
 
 @app.after_serving
 async def after_serving():
+    await get_message_queue().stop()
+    await WhatsAppClient.close()
     await close_connection_pools()
+    await get_rag_engine().aclose()
 
 
 async def run_quart():
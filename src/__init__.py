@@ -1,6 +1,11 @@
-from . import database
-from . import ai
-from . import whatsapp
-from . import api
+import importlib
 
-__all__ = ['database', 'ai', 'whatsapp', 'api']
\ No newline at end of file
+__all__ = ['database', 'ai', 'whatsapp', 'api']
+
+
+def __getattr__(name):
+    # Podpakiety ładowane przy pierwszym użyciu - `from src.config import ...` (np. w procesie nadrzędnym
+    # serwera albo w CLI) nie importuje już openai, quart i całej aplikacji
+    if name in __all__:
+        return importlib.import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
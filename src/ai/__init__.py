@@ -1,4 +1,7 @@
 from .openai_client import OpenAIClient
 from .rag_engine import RAGEngine
+from .embedding_cache import EmbeddingCache
+from .semantic_cache import SemanticCache
+from .reranker import Reranker
 
-__all__ = ['OpenAIClient', 'RAGEngine']
\ No newline at end of file
+__all__ = ['OpenAIClient', 'RAGEngine', 'EmbeddingCache', 'SemanticCache', 'Reranker']
\ No newline at end of file
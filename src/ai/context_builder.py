@@ -0,0 +1,138 @@
+import hashlib
+import math
+import re
+from datetime import datetime
+from functools import lru_cache
+from src.config import CHAT_MODEL, CONTEXT_TOKEN_BUDGET, HISTORY_TOKEN_BUDGET, CONTEXT_DEDUP_THRESHOLD
+from src.logger import main_logger
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional, the estimate below is close enough for budgeting
+    tiktoken = None
+
+SHINGLE_SIZE = 5
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_encoding = None
+_encoding_loaded = False
+
+
+def load_tokenizer():
+    """Loads the tiktoken encoding once (may download the BPE file); None means counts are estimated."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+            except Exception as e:
+                # Plik BPE pobierany jest przy pierwszym użyciu - bez sieci liczymy szacunkowo
+                main_logger.warning(f"⚠️ tiktoken encoding unavailable, estimating token counts: {e}")
+    return _encoding
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = load_tokenizer()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = load_tokenizer()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+
+def format_created_at(created_at) -> str:
+    if not created_at:
+        return 'N/A'
+    if isinstance(created_at, datetime):
+        return created_at.strftime("%Y-%m-%d %H:%M:%S")
+    return str(created_at)
+
+
+def format_document(result, content=None) -> str:
+    return "\n".join((
+        f"Title: {result.get('title', 'N/A')}",
+        f"Page: {result.get('pageNumber', 'N/A')}",
+        f"Content: {result.get('content', 'N/A') if content is None else content}",
+        f"Created At: {format_created_at(result.get('createdAt'))}",
+        f"Word Count: {result.get('wordCount', 'N/A')}",
+        "",
+        "",
+    ))
+
+
+def _shingles(text: str) -> set:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {hash(tuple(words[i:i + SHINGLE_SIZE])) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def deduplicate(results, threshold=CONTEXT_DEDUP_THRESHOLD) -> list:
+    """
+    Drops chunks that repeat earlier (more relevant) ones: exact copies and overlapping chunks whose
+    word 5-grams are mostly contained in an already kept chunk.
+    """
+    kept, kept_shingles, seen_hashes = [], [], set()
+    for result in results:
+        content = result.get('content') or ""
+        digest = hashlib.sha1(" ".join(content.split()).lower().encode()).digest()
+        if digest in seen_hashes:
+            continue
+        shingles = _shingles(content)
+        if shingles and any(len(shingles & other) / min(len(shingles), len(other)) >= threshold
+                            for other in kept_shingles if other):
+            continue
+        seen_hashes.add(digest)
+        kept_shingles.append(shingles)
+        kept.append(result)
+    return kept
+
+
+def build_context(results, budget=CONTEXT_TOKEN_BUDGET) -> str:
+    """Greedily fills `budget` tokens with deduplicated documents in relevance order (results come sorted by score)."""
+    unique = deduplicate(results)
+    parts, used = [], 0
+    for result in unique:
+        block = format_document(result)
+        tokens = count_tokens(block)
+        if used + tokens > budget:
+            if not parts:
+                # Najlepszy dokument zawsze trafia do kontekstu, najwyżej przycięty
+                overhead = count_tokens(format_document(result, content=""))
+                block = format_document(result, truncate_to_tokens(result.get('content') or "", budget - overhead))
+                parts.append(block)
+                used += count_tokens(block)
+            # Dłuższy dokument się nie zmieścił - krótszy, mniej trafny jeszcze może
+            continue
+        parts.append(block)
+        used += tokens
+    main_logger.debug(f"Context built from {len(parts)}/{len(results)} results "
+                      f"({len(results) - len(unique)} duplicates dropped, ~{used} tokens)")
+    return "".join(parts)
+
+
+def trim_history(chat_history, budget=HISTORY_TOKEN_BUDGET) -> list:
+    """Keeps the newest turns that fit in `budget` tokens; chat_history is newest-first like get_recent_queries."""
+    if not chat_history:
+        return chat_history
+    kept, used = [], 0
+    for entry in chat_history:
+        tokens = count_tokens(entry["query"]) + count_tokens(entry["answer"])
+        if used + tokens > budget:
+            break
+        kept.append(entry)
+        used += tokens
+    if len(kept) < len(chat_history):
+        main_logger.debug(f"Chat history trimmed to {len(kept)}/{len(chat_history)} entries (~{used} tokens)")
+    return kept
@@ -0,0 +1,164 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from src.config import EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL, EMBEDDING_CACHE_PATH
+from src.database.vectors import as_float32
+from src.logger import openai_logger as logger
+
+TRAILING_PUNCTUATION = " .!?…"
+
+
+def normalize_text(text: str) -> str:
+    # "Hi!", " hi " i "HI" mają dawać ten sam klucz
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return " ".join(text.split()).rstrip(TRAILING_PUNCTUATION)
+
+
+def make_cache_key(model: str, text: str) -> str:
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+def pack_embedding(embedding) -> bytes:
+    return np.asarray(embedding, dtype="<f4").tobytes()
+
+
+def unpack_embedding(blob: bytes) -> np.ndarray:
+    # Tylko do odczytu - ten sam wektor trafia do wielu zapytań z cache
+    return np.frombuffer(blob, dtype="<f4")
+
+
+class SQLiteEmbeddingStore:
+    """Persistent embedding store, survives restarts and can be shared by several worker processes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                cache_key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        logger.info(f"🗄️ SQLite embedding store opened at {path}")
+
+    def get(self, key: str, ttl: float):
+        with self._lock:
+            row = self._conn.execute("SELECT vector, created_at FROM embeddings WHERE cache_key = ?",
+                                     (key,)).fetchone()
+        if row is None:
+            return None
+        vector, created_at = row
+        if ttl and time.time() - created_at > ttl:
+            return None
+        return unpack_embedding(vector)
+
+    def set(self, key: str, embedding):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO embeddings (cache_key, vector, created_at) VALUES (?, ?, ?)",
+                               (key, pack_embedding(embedding), time.time()))
+
+    def purge_expired(self, ttl: float):
+        if not ttl:
+            return 0
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM embeddings WHERE created_at < ?", (time.time() - ttl,))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingCache:
+    """In-process LRU with TTL in front of an optional persistent store."""
+
+    def __init__(self, max_size=EMBEDDING_CACHE_SIZE, ttl=EMBEDDING_CACHE_TTL, store=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def get(self, model: str, text: str):
+        key = make_cache_key(model, text)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                embedding, expires_at = entry
+                if now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return embedding
+                del self._entries[key]
+
+        if self.store is not None:
+            embedding = self.store.get(key, self.ttl)
+            if embedding is not None:
+                self._remember(key, embedding, now)
+                with self._lock:
+                    self.hits += 1
+                    self.store_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, model: str, text: str, embedding):
+        # float32 array: ~6 KB per 1536-d embedding instead of ~50 KB as a list of Python floats
+        embedding = as_float32(embedding)
+        key = make_cache_key(model, text)
+        self._remember(key, embedding, time.monotonic())
+        if self.store is not None:
+            try:
+                self.store.set(key, embedding)
+            except Exception as e:
+                logger.error(f"❌ Failed to persist embedding in cache store: {e}")
+
+    def _remember(self, key, embedding, now):
+        if self.max_size <= 0:
+            return
+        expires_at = now + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            self._entries[key] = (embedding, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "store_hits": self.store_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+
+
+def create_embedding_cache() -> EmbeddingCache:
+    store = None
+    if EMBEDDING_CACHE_PATH:
+        try:
+            store = SQLiteEmbeddingStore(EMBEDDING_CACHE_PATH)
+        except sqlite3.Error as e:
+            logger.error(f"❌ Could not open embedding store {EMBEDDING_CACHE_PATH}, using memory only: {e}")
+    return EmbeddingCache(store=store)
@@ -1,36 +1,222 @@
-from openai import OpenAI
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+import asyncio
+import random
+import time
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
 # import logging
-from src.config import OPENAI_API_KEY
+from src.config import OPENAI_API_KEY, CHAT_MODEL, EMBEDDING_BATCH_SIZE, OPENAI_SCHEDULER_ENABLED, \
+    OPENAI_MAX_ATTEMPTS, OPENAI_CHAT_TIMEOUT, OPENAI_EMBEDDING_TIMEOUT, OPENAI_BACKGROUND_TIMEOUT, \
+    OPENAI_COMPLETION_TOKENS_ESTIMATE
 from src.logger import openai_logger as logger
+from src.ai.embedding_cache import create_embedding_cache
+from src.database.vectors import as_float32
+from src.ai.rate_limiter import OpenAIScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, OUTCOME_OK, \
+    OUTCOME_RATE_LIMITED, OUTCOME_TIMEOUT, OUTCOME_ERROR, retry_after, estimate_tokens, token_batches
+from src.metrics import metrics
+
+EMBEDDING_MODEL = "text-embedding-ada-002"
+CHAT_COMPLETION_ERROR = "An error occurred while generating the response."
+RETRY_BACKOFF_BASE = 0.5  # seconds, doubled per attempt (with jitter) after connection errors / 5xx
+
+
+def record_usage(model, usage):
+    """Adds the token counts reported by the API to openai_tokens_total{model, type}."""
+    if usage is None:
+        return
+    metrics.inc("openai_tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model, type="prompt")
+    metrics.inc("openai_tokens_total", getattr(usage, "completion_tokens", 0) or 0, model=model, type="completion")
 
 
 class OpenAIClient:
-    def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+    def __init__(self, embedding_cache=None):
+        # Klient HTTP (~50 ms, ładowanie certyfikatów) tworzony jest przy pierwszym użyciu / w create_clients
+        self._async_client = None
+        # Osobny harmonogram na model - limity RPM / TPM OpenAI są liczone per model
+        self.schedulers = {} if OPENAI_SCHEDULER_ENABLED else None
+        self.embedding_cache = embedding_cache if embedding_cache is not None else create_embedding_cache()
         logger.info("OpenAI client initialized")
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
-    def generate_embeddings(self, text: str):
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            # Ponowienia (429, błędy połączenia) obsługuje _aopen - wbudowane w SDK ukrywałyby 429 przed harmonogramem
+            retries = {"max_retries": 0} if self.schedulers is not None else {}
+            self._async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, **retries)
+        return self._async_client
+
+    def create_clients(self):
+        return self.async_client
+
+    def scheduler(self, model):
+        if self.schedulers is None:
+            return None
+        scheduler = self.schedulers.get(model)
+        if scheduler is None:
+            scheduler = self.schedulers[model] = OpenAIScheduler(model)
+        return scheduler
+
+    async def _aopen(self, resource, model, tokens, priority, timeout, **kwargs):
+        """
+        Starts one API call through the model's scheduler: waits for a slot, retries 429s and transient
+        errors while the deadline allows. Returns (scheduler, lease, raw response); the caller releases
+        the lease once the response has been consumed.
+        """
+        scheduler = self.scheduler(model)
+        if scheduler is None:
+            return None, None, await resource.with_raw_response.create(model=model, timeout=timeout, **kwargs)
+
+        deadline = time.monotonic() + timeout
+        for attempt in range(1, OPENAI_MAX_ATTEMPTS + 1):
+            lease = await scheduler.acquire(tokens, priority, deadline)
+            try:
+                raw = await resource.with_raw_response.create(
+                    model=model, timeout=max(deadline - time.monotonic(), 1.0), **kwargs)
+                return scheduler, lease, raw
+            except RateLimitError as e:
+                # insufficient_quota to też 429, ale ponawianie nic nie da
+                if e.code == "insufficient_quota":
+                    scheduler.release(lease, OUTCOME_ERROR)
+                    raise
+                scheduler.release(lease, OUTCOME_RATE_LIMITED, e.response.headers,
+                                  retry_delay=retry_after(e.response.headers))
+                error = e
+            except (APIConnectionError, InternalServerError) as e:
+                scheduler.release(lease, OUTCOME_TIMEOUT if isinstance(e, APITimeoutError) else OUTCOME_ERROR)
+                error = e
+                backoff = RETRY_BACKOFF_BASE * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                await asyncio.sleep(min(backoff, max(deadline - time.monotonic(), 0)))
+            except BaseException:
+                scheduler.release(lease, OUTCOME_ERROR)
+                raise
+            if attempt == OPENAI_MAX_ATTEMPTS or time.monotonic() >= deadline:
+                break
+            logger.warning(f"🔁 {model} call failed ({error.__class__.__name__}), "
+                           f"retrying (attempt {attempt + 1}/{OPENAI_MAX_ATTEMPTS})")
+        raise error
+
+    async def _arequest(self, resource, model, tokens, priority, timeout, **kwargs):
+        scheduler, lease, raw = await self._aopen(resource, model, tokens, priority, timeout, **kwargs)
+        try:
+            response = raw.parse()
+        except BaseException:
+            self._release(scheduler, lease, OUTCOME_ERROR, raw.headers)
+            raise
+        usage = getattr(response, "usage", None)
+        self._release(scheduler, lease, OUTCOME_OK, raw.headers, used_tokens=getattr(usage, "total_tokens", None))
+        return response
+
+    @staticmethod
+    def _release(scheduler, lease, *args, **kwargs):
+        if scheduler is not None:
+            scheduler.release(lease, *args, **kwargs)
+
+    async def agenerate_embeddings(self, text: str):
+        cached = self.embedding_cache.get(EMBEDDING_MODEL, text)
+        if cached is not None:
+            logger.info("Embeddings served from cache")
+            return cached
+        embedding = await self._acreate_embedding(text)
+        self.embedding_cache.set(EMBEDDING_MODEL, text, embedding)
+        return embedding
+
+    async def _acreate_embedding(self, text: str):
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
+            response = await self._arequest(
+                self.async_client.embeddings, EMBEDDING_MODEL, estimate_tokens([text]), PRIORITY_INTERACTIVE,
+                OPENAI_EMBEDDING_TIMEOUT,
+                input=text,
+                encoding_format="base64"
             )
             logger.info("Embeddings generated successfully")
-            return response.data[0].embedding
+            record_usage(EMBEDDING_MODEL, response.usage)
+            return as_float32(response.data[0].embedding)
         except Exception as e:
             logger.error(f"Error generating embeddings: {e}")
             raise
 
-    def generate_chat_completion(self, messages):
+    async def agenerate_embeddings_batch(self, texts, batch_size=EMBEDDING_BATCH_SIZE, priority=PRIORITY_BACKGROUND):
+        embeddings = []
+        scheduler = self.scheduler(EMBEDDING_MODEL)
+        # Partie mieszczą się też w limicie tokenów (bez rezerwy dla zapytań użytkowników) - limit może się pojawić
+        # dopiero z nagłówków pierwszej odpowiedzi, więc liczony jest przed każdą partią
+        max_tokens = (lambda: scheduler.max_tokens(priority)) if scheduler is not None else None
+        for batch in token_batches(texts, batch_size, max_tokens):
+            embeddings.extend(await self._acreate_embeddings(batch, priority))
+        return embeddings
+
+    async def _acreate_embeddings(self, texts, priority=PRIORITY_BACKGROUND):
         try:
-            completion = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages
+            response = await self._arequest(
+                self.async_client.embeddings, EMBEDDING_MODEL, estimate_tokens(texts), priority,
+                OPENAI_BACKGROUND_TIMEOUT if priority == PRIORITY_BACKGROUND else OPENAI_EMBEDDING_TIMEOUT,
+                input=texts,
+                encoding_format="base64"
+            )
+            logger.info(f"Embeddings generated successfully for {len(texts)} inputs")
+            record_usage(EMBEDDING_MODEL, response.usage)
+            return [as_float32(item.embedding) for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as e:
+            logger.error(f"Error generating batch embeddings: {e}")
+            raise
+
+    async def agenerate_chat_completion(self, messages, model=CHAT_MODEL, max_tokens=None, timeout=OPENAI_CHAT_TIMEOUT):
+        try:
+            completion = await self._arequest(
+                self.async_client.chat.completions, model, self._chat_tokens(messages, max_tokens),
+                PRIORITY_INTERACTIVE, timeout,
+                messages=messages,
+                **({"max_tokens": max_tokens} if max_tokens else {})
             )
             logger.info("Chat completion generated successfully")
+            record_usage(completion.model, completion.usage)
             return completion.choices[0].message.content
         except Exception as e:
             logger.error(f"Error with OpenAI ChatCompletion: {e}")
-            return "An error occurred while generating the response."
+            return CHAT_COMPLETION_ERROR
+
+    async def astream_chat_completion(self, messages):
+        streamed_anything = False
+        try:
+            scheduler, lease, raw = await self._aopen(
+                self.async_client.chat.completions, CHAT_MODEL, self._chat_tokens(messages), PRIORITY_INTERACTIVE,
+                OPENAI_CHAT_TIMEOUT,
+                messages=messages,
+                stream=True,
+                # Ostatni fragment (bez choices) niesie zużycie tokenów całej odpowiedzi
+                stream_options={"include_usage": True}
+            )
+            # Slot jest zajęty do końca strumienia - tyle trwa wywołanie z punktu widzenia limitu współbieżności
+            outcome, used_tokens = OUTCOME_ERROR, None
+            try:
+                async for chunk in raw.parse():
+                    if not chunk.choices:
+                        record_usage(chunk.model, chunk.usage)
+                        used_tokens = getattr(chunk.usage, "total_tokens", None)
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        streamed_anything = True
+                        yield delta
+                outcome = OUTCOME_OK
+            finally:
+                self._release(scheduler, lease, outcome, raw.headers, used_tokens=used_tokens)
+            logger.info("Chat completion streamed successfully")
+        except Exception as e:
+            logger.error(f"Error with OpenAI ChatCompletion stream: {e}")
+            if streamed_anything:
+                # Część odpowiedzi już poszła - urwany strumień nie może wyglądać na kompletną odpowiedź
+                raise
+            yield CHAT_COMPLETION_ERROR
+
+    @staticmethod
+    def _chat_tokens(messages, max_tokens=None):
+        return estimate_tokens(message.get("content") for message in messages) + \
+            (max_tokens or OPENAI_COMPLETION_TOKENS_ESTIMATE)
+
+    def scheduler_stats(self) -> dict:
+        return {model: scheduler.stats() for model, scheduler in (self.schedulers or {}).items()}
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+        self.embedding_cache.close()
+        logger.info("OpenAI async client closed")
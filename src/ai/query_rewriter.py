@@ -0,0 +1,231 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from src.config import QUERY_REWRITE_MODE, QUERY_REWRITE_MODEL, QUERY_REWRITE_TIMEOUT, QUERY_REWRITE_MAX_TERMS, \
+    QUERY_REWRITE_CACHE_SIZE, FOLLOW_UP_MAX_WORDS
+from src.ai.openai_client import CHAT_COMPLETION_ERROR
+from src.database.lexical_index import fold
+from src.logger import main_logger
+from src.metrics import metrics
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+REWRITE_HISTORY_TURNS = 3
+REWRITE_ANSWER_CHARS = 300
+REWRITE_MAX_TOKENS = 64
+
+# Słowa po złożeniu diakrytyków (fold) - "też" == "tez", "również" == "rowniez". Bez samych "a" / "i" / "to" /
+# "so" / "then" - po angielsku zaczynają zwykłe pytania ("I would like...", "To what extent...")
+FOLLOW_UP_OPENERS = (
+    "and", "also", "what about", "how about", "what else",
+    "oraz", "tez", "takze", "rowniez", "a co", "a jak", "a czy", "a ile", "co z", "jak z", "i ile", "i co",
+)
+# "A wdrożenie?", "A SLA?" - same "a" / "i" tylko w bardzo krótkich pytaniach
+SHORT_FOLLOW_UP_OPENERS = ("a", "i")
+SHORT_FOLLOW_UP_WORDS = 3
+# Odwołania do wcześniejszej odpowiedzi niezależnie od długości pytania - "the second one", "ta pierwsza opcja"
+ANAPHOR_PATTERNS = [re.compile(pattern) for pattern in (
+    r"\b(first|second|third|fourth|fifth|last|previous|other|former|latter) (one|ones|option|options|choice|plan|"
+    r"package|variant|solution)\b",
+    r"\bthe (former|latter)\b",
+    r"\b(you )?mentioned\b",
+    r"\b(pierwsz|drug|trzec|czwart|ostatn|poprzedn)\w* (opcj|wariant|pakiet|propozycj|rozwiazan|z nich)",
+    r"\b(ktory|ktora|ktore) z (nich|tych)\b",
+    r"\bwspomnian\w*",
+)]
+ANAPHORS = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "their", "there", "same", "one", "ones",
+    "tego", "temu", "tym", "ten", "ta", "te", "tej", "tych", "tymi", "ich", "go", "jego", "jej", "nim", "niej",
+    "nich", "tam", "tamten", "tamta", "taki", "takie", "taka", "wtedy", "on", "ona", "ono", "oni", "one",
+}
+STOPWORDS = ANAPHORS | {
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did", "can", "could", "would", "should",
+    "will", "have", "has", "had", "i", "you", "we", "me", "my", "your", "our", "us", "of", "to", "in", "on",
+    "for", "with", "at", "by", "from", "about", "and", "or", "but", "so", "then", "also", "too", "not", "no",
+    "yes", "please", "what", "which", "who", "whom", "how", "when", "where", "why", "much", "many", "more",
+    "tell", "know", "else", "any", "some", "there", "if", "than", "just", "very",
+    "i", "oraz", "lub", "albo", "ale", "czy", "to", "jest", "sa", "byc", "jak", "co", "ile", "ktory", "ktora",
+    "ktore", "gdzie", "kiedy", "dlaczego", "czemu", "po", "w", "we", "z", "ze", "na", "do", "od", "dla", "o",
+    "u", "przy", "za", "sie", "nie", "tak", "juz", "jeszcze", "tez", "takze", "rowniez", "mi", "mnie", "ja", "ty",
+    "wy", "my", "nas", "was", "moge", "mozna", "prosze", "a", "jaki", "jaka", "jakie", "jakich", "wiecej",
+    "bardzo", "tylko", "sobie", "moj", "twoj", "wasz", "nasz", "oferujecie", "macie",
+    # Orzeczenia bez tematu - "ile kosztuje?" / "how long does it take?" nie mówią, o co pytamy
+    "kosztuje", "kosztowac", "koszt", "koszty", "cena", "trwa", "dlugo", "dziala", "potrzebuje",
+    "cost", "costs", "price", "long", "take", "takes", "offer", "work", "works", "need",
+}
+
+
+def content_terms(text: str) -> list:
+    """Words that carry the topic: not stopwords / pronouns, at least 3 characters (or a number), original spelling."""
+    terms = []
+    seen = set()
+    for word in _WORD_RE.findall(text or ""):
+        folded = fold(word)
+        if folded in STOPWORDS or folded in seen or len(folded) < (2 if folded.isdigit() else 3):
+            continue
+        seen.add(folded)
+        terms.append(word)
+    return terms
+
+
+def _is_name(term, first_word) -> bool:
+    # Nazwa własna / skrót / kod ("Azure", "AKS", "24") sam w sobie określa temat pytania
+    return (len(term) > 1 and term.isupper()) or any(char.isdigit() for char in term) \
+        or (term[:1].isupper() and term != first_word)
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    Cheap PL / EN check whether a question leans on the previous turns: it opens with a connector
+    ("and how much...", "a co z..."), refers back with a pronoun while naming little else ("does it
+    support...", "ile to kosztuje") or has at most one common topic word ("how much?", "ile trwa wdrożenie?").
+    """
+    words = _WORD_RE.findall(question or "")
+    if not words:
+        return False
+    folded = " ".join(fold(word) for word in words)
+    if any(folded == opener or folded.startswith(opener + " ") for opener in FOLLOW_UP_OPENERS):
+        return True
+    if len(words) <= SHORT_FOLLOW_UP_WORDS and fold(words[0]) in SHORT_FOLLOW_UP_OPENERS:
+        return True
+    if any(pattern.search(folded) for pattern in ANAPHOR_PATTERNS):
+        return True
+    if len(words) > FOLLOW_UP_MAX_WORDS:
+        return False
+    terms = content_terms(question)
+    if len(terms) > 2:
+        return False
+    if ANAPHORS.intersection(folded.split()):
+        return True
+    return len(terms) <= 1 and not any(_is_name(term, words[0]) for term in terms)
+
+
+class QueryRewriter:
+    """
+    Turns a follow-up into a standalone search query before it is embedded. The heuristic mode appends
+    the key terms of the latest turns; the model mode asks a small chat model and falls back to the
+    heuristic on error / timeout. Rewrites are memoized per (conversation turn, question).
+
+    rewrite() / arewrite() return (search query, standalone). standalone=True means the search query can be
+    answered without the conversation - RAGEngine then prompts with it alone and may cache the answer;
+    standalone=False means the original question is answered with the chat history and never cached.
+    """
+
+    def __init__(self, openai_client=None, mode=QUERY_REWRITE_MODE, model=QUERY_REWRITE_MODEL,
+                 timeout=QUERY_REWRITE_TIMEOUT, max_terms=QUERY_REWRITE_MAX_TERMS, cache_size=QUERY_REWRITE_CACHE_SIZE):
+        self.openai_client = openai_client
+        self.mode = mode if mode in ("off", "heuristic", "model") else "heuristic"
+        self.model = model
+        self.timeout = timeout
+        self.max_terms = max_terms
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    @staticmethod
+    def _key(question, chat_history):
+        # Tura rozmowy = ostatnia para pytanie / odpowiedź; historia jest od najnowszych
+        latest = chat_history[0]
+        digest = hashlib.sha1()
+        for part in (question, latest.get("query"), latest.get("answer")):
+            digest.update(str(part or "").encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _cached(self, key):
+        if not self.cache_size:
+            return None
+        with self._lock:
+            rewrite = self._cache.get(key)
+            if rewrite is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return rewrite
+
+    def _remember(self, key, rewrite):
+        if not self.cache_size:
+            return
+        with self._lock:
+            self._cache[key] = rewrite
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def heuristic_rewrite(self, question, chat_history) -> str:
+        present = {fold(term) for term in content_terms(question)}
+        carried = []
+        for entry in chat_history[:2]:
+            for term in content_terms(entry.get("query")):
+                if fold(term) not in present and len(carried) < self.max_terms:
+                    present.add(fold(term))
+                    carried.append(term)
+        return f"{question} {' '.join(carried)}" if carried else question
+
+    def _rewrite_messages(self, question, chat_history):
+        turns = []
+        for entry in reversed(chat_history[:REWRITE_HISTORY_TURNS]):
+            turns.append(f"User: {entry.get('query', '')}")
+            turns.append(f"Assistant: {str(entry.get('answer', ''))[:REWRITE_ANSWER_CHARS]}")
+        return [
+            {"role": "system", "content": "Rewrite the user's last question as a standalone search query, using "
+                                          "the conversation to resolve pronouns and omitted subjects. Keep the "
+                                          "question's language. Reply with the query only."},
+            {"role": "user", "content": "\n".join(turns) + f"\n\nLast question: {question}"},
+        ]
+
+    @staticmethod
+    def _accept_model_rewrite(rewritten):
+        rewritten = (rewritten or "").strip().strip('"')
+        return rewritten if rewritten and rewritten != CHAT_COMPLETION_ERROR else None
+
+    def _prepare(self, question, chat_history):
+        """(result, key): result is set when no rewrite is needed or it was memoized."""
+        if not chat_history:
+            return (question, True), None
+        if not self.enabled:
+            return (question, False), None
+        if not is_follow_up(question):
+            metrics.inc("query_rewrites_total", method="standalone")
+            return (question, True), None
+        key = self._key(question, chat_history)
+        return self._cached(key), key
+
+    async def arewrite(self, question, chat_history=None):
+        result, key = self._prepare(question, chat_history)
+        if result is not None:
+            return result
+        rewritten = None
+        if self.mode == "model" and self.openai_client is not None:
+            with metrics.span("query_rewrite"):
+                rewritten = self._accept_model_rewrite(await self.openai_client.agenerate_chat_completion(
+                    self._rewrite_messages(question, chat_history), model=self.model,
+                    max_tokens=REWRITE_MAX_TOKENS, timeout=self.timeout))
+        return self._store(key, question, chat_history, rewritten)
+
+    def _store(self, key, question, chat_history, rewritten):
+        # Przepisanie przez model jest samodzielnym pytaniem; doklejone słowa kluczowe tylko pomagają w wyszukiwaniu
+        if rewritten is not None:
+            result, method = (rewritten, True), "model"
+        else:
+            result, method = (self.heuristic_rewrite(question, chat_history), False), "heuristic"
+        metrics.inc("query_rewrites_total", method=method)
+        main_logger.info(f"✏️ Follow-up rewritten ({method}): {result[0]}")
+        self._remember(key, result)
+        return result
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -1,26 +1,30 @@
 from src.database.mongodb_client import MongoDBClient
-from src.ai.openai_client import OpenAIClient
-from datetime import datetime
+from src.database.retrievers import create_retriever, create_lexical_retriever
+from src.database.lexical_index import tokenize
+from src.ai.openai_client import OpenAIClient, CHAT_COMPLETION_ERROR
+from src.ai.semantic_cache import create_semantic_cache, context_fingerprint
+from src.ai.context_builder import build_context, trim_history, load_tokenizer
+from src.ai.reranker import Reranker, reciprocal_rank_fusion
+from src.ai.query_rewriter import QueryRewriter
+from src.config import KNOWLEDGE_BASE_CHECK_INTERVAL, LEXICAL_ONLY_MAX_TERMS
+from src.metrics import metrics
+import asyncio
+import logging
+import time
 from src.logger import main_logger, cosmosdb_logger, openai_logger
 import json
 
 
+class AnswerInterrupted(Exception):
+    """The completion stream broke off after part of the answer had already been yielded."""
+
+    def __init__(self, partial, cause):
+        super().__init__(f"Answer stream broke off after {len(partial)} characters: {cause}")
+        self.partial = partial
+
+
 def prepare_context(results):
-    context = ""
-    for result in results:
-        context += f"Title: {result.get('title', 'N/A')}\n"
-        context += f"Page: {result.get('pageNumber', 'N/A')}\n"
-        context += f"Content: {result.get('content', 'N/A')}\n"
-        created_at = result.get('createdAt')
-        if created_at:
-            if isinstance(created_at, datetime):
-                created_at_str = created_at.strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                created_at_str = str(created_at)
-        else:
-            created_at_str = 'N/A'
-        context += f"Created At: {created_at_str}\n"
-        context += f"Word Count: {result.get('wordCount', 'N/A')}\n\n"
+    context = build_context(results)
     main_logger.debug(f"Context prepared with {len(results)} results")
     return context
 
@@ -41,6 +45,7 @@ def prepare_messages(context, question, chat_history=None):
         {"role": "system", "content": system_prompt + context},
     ]
 
+    chat_history = trim_history(chat_history)
     if chat_history:
         messages.append({"role": "system", "content": "Recent chat history:"})
         for entry in reversed(chat_history):  # Odwracamy kolejność, aby najstarsze były pierwsze
@@ -54,45 +59,205 @@ def prepare_messages(context, question, chat_history=None):
     return messages
 
 
-class RAGEngine:
-    def __init__(self):
-        self.mongodb_client = MongoDBClient()
-        self.mongodb_client.connect()  # Jawnie nawiązujemy połączenie
-        self.openai_client = OpenAIClient()
-        main_logger.info("RAGEngine initialized")
-
-    def process_query(self, question, num_results=10, chat_history=None):
-        main_logger.info(f"🔄 Processing query: {question}")
-
-        if chat_history:
-            main_logger.info(f"📜 Chat history provided with {len(chat_history)} entries")
+def log_chat_history(chat_history):
+    if chat_history:
+        main_logger.info(f"📜 Chat history provided with {len(chat_history)} entries")
+        if main_logger.isEnabledFor(logging.DEBUG):
             main_logger.debug("🔍 Full chat history:")
             for i, entry in enumerate(chat_history, 1):
                 main_logger.debug(f"  {i}. Query: {entry['query'][:50]}...")
                 main_logger.debug(f"     Answer: {entry['answer'][:50]}...")
-        else:
-            main_logger.info("⚠️ No chat history provided")
+    else:
+        main_logger.info("⚠️ No chat history provided")
+
+
+def log_messages(messages):
+    main_logger.info(f"💬 Prepared {len(messages)} messages for OpenAI")
+    if not main_logger.isEnabledFor(logging.DEBUG):
+        return
+    main_logger.debug("📄 Messages content:")
+    for i, msg in enumerate(messages, 1):
+        main_logger.debug(f"  {i}. Role: {msg['role']}, Content: {msg['content'][:50]}...")
+
 
+class RAGEngine:
+    def __init__(self, mongodb_client=None, openai_client=None, semantic_cache=None, retriever=None, reranker=None,
+                 lexical_retriever=None, query_rewriter=None):
+        # Połączenia z MongoDB nawiązywane są leniwie (connect / aconnect), więc import modułu nie blokuje
+        self.mongodb_client = mongodb_client or MongoDBClient()
+        self.openai_client = openai_client or OpenAIClient()
+        self.retriever = retriever or create_retriever(self.mongodb_client)
+        self.semantic_cache = semantic_cache if semantic_cache is not None else create_semantic_cache()
+        self.reranker = reranker or Reranker()
+        self.lexical_retriever = lexical_retriever if lexical_retriever is not None \
+            else create_lexical_retriever(self.mongodb_client)
+        self.query_rewriter = query_rewriter or QueryRewriter(self.openai_client)
+        self._knowledge_base_checked_at = 0.0
+        main_logger.info("RAGEngine initialized")
+
+    async def aconnect(self):
+        await self.mongodb_client.aconnect()
+
+    async def _aensure_index(self):
+        # Sprawdzenie / utworzenie indeksu raz przy starcie - potem tylko cache w MongoDBClient.index_state
+        await self.mongodb_client.aensure_vector_search_index(force=True)
+        main_logger.info(f"🗂️ Vector search index ready: {self.mongodb_client.index_state.describe()}")
+
+    async def abootstrap(self):
+        await self.aconnect()
+        # Niezależne kroki startu idą równolegle - start workera trwa tyle, co najdłuższy z nich
+        steps = [
+            self._aensure_index(),
+            self.retriever.astart(),
+            self._arefresh_knowledge_base_version(),
+            # Tokenizer i klienci OpenAI poza pętlą zdarzeń - pierwsze użycie może pobierać plik BPE
+            asyncio.to_thread(load_tokenizer),
+            asyncio.to_thread(self.openai_client.create_clients),
+        ]
+        if self.lexical_retriever:
+            steps.append(self.lexical_retriever.astart())
+        await asyncio.gather(*steps)
+
+    def _knowledge_base_check_due(self):
+        return time.monotonic() - self._knowledge_base_checked_at >= KNOWLEDGE_BASE_CHECK_INTERVAL
+
+    async def _arefresh_knowledge_base_version(self):
+        if not self.semantic_cache.enabled or not self._knowledge_base_check_due():
+            return
+        self._knowledge_base_checked_at = time.monotonic()
         try:
-            self.mongodb_client.ensure_vector_search_index()
+            self.semantic_cache.set_knowledge_base_version(await self.mongodb_client.aget_knowledge_base_version())
+        except Exception as e:
+            cosmosdb_logger.warning(f"⚠️ Could not check knowledge base version, dropping cached answers: {e}")
+            self.semantic_cache.invalidate()
 
-            query_embedding = self.openai_client.generate_embeddings(question)
-            main_logger.debug("📊 Query embedding generated")
+    def _lexical_search(self, question, num_results):
+        if not self.lexical_retriever:
+            return []
+        with metrics.span("lexical_search"):
+            return self.lexical_retriever.search_text(question, num_results)
 
-            results = self.mongodb_client.vector_search(query_embedding, num_results=num_results)
-            cosmosdb_logger.info(f"🔎 Vector search completed with {len(results)} results")
+    @staticmethod
+    def _is_keyword_query(question, lexical_results):
+        # Krótkie zapytanie typu "cennik Azure" / kod produktu, w całości znalezione w indeksie BM25
+        terms = set(tokenize(question))
+        return (0 < len(terms) <= LEXICAL_ONLY_MAX_TERMS and "?" not in question and bool(lexical_results)
+                and lexical_results[0]["matchedTerms"] == len(terms))
 
+    def _fuse(self, vector_results, lexical_results, num_results):
+        if not lexical_results:
+            return vector_results
+        return reciprocal_rank_fusion([vector_results, lexical_results], limit=self.reranker.final_k(num_results))
+
+    def _rerank(self, question, query_embedding, results, lexical_results, num_results):
+        with metrics.span("rerank"):
+            return self._fuse(self.reranker.rerank(question, query_embedding, results, num_results),
+                              lexical_results, num_results)
+
+    @staticmethod
+    def _build_messages(question, results, chat_history):
+        with metrics.span("context_build"):
             context = prepare_context(results)
             main_logger.debug(f"📝 Context prepared (length: {len(context)} characters)")
-
             messages = prepare_messages(context, question, chat_history)
-            main_logger.info(f"💬 Prepared {len(messages)} messages for OpenAI")
-            main_logger.debug("📄 Messages content:")
-            for i, msg in enumerate(messages, 1):
-                main_logger.debug(f"  {i}. Role: {msg['role']}, Content: {msg['content'][:50]}...")
+        log_messages(messages)
+        return messages
 
-            response = self.openai_client.generate_chat_completion(messages)
+    def _is_cacheable(self, query_embedding, standalone):
+        # Odpowiedź z cache tylko dla pytań samodzielnych - w pytaniu uzupełniającym sens zależy od rozmowy
+        return standalone and query_embedding is not None and self.semantic_cache.enabled
+
+    @staticmethod
+    def _prompt_input(question, search_query, cacheable, chat_history):
+        """(question, chat_history) the model is asked with."""
+        # Odpowiedź trafiająca do wspólnego semantic cache powstaje bez historii rozmowy - inaczej treść rozmowy
+        # jednego użytkownika mogłaby trafić do odpowiedzi dla innego. Poza cache historia zostaje: ocena
+        # "pytanie samodzielne" jest heurystyką i bywa błędna
+        if cacheable:
+            return search_query, None
+        return question, chat_history
+
+    def _lookup_cached_answer(self, query_embedding, cacheable, results):
+        if not cacheable or not results:
+            return None
+        hit = self.semantic_cache.lookup(query_embedding, context_fingerprint(results))
+        if hit is None:
+            return None
+        answer, score, fingerprint = hit
+        metrics.inc("rag_queries_total", path="semantic_cache")
+        main_logger.info(f"⚡ Semantic cache hit (similarity: {score:.3f}, context: {fingerprint})")
+        return answer
+
+    def _store_cached_answer(self, query_embedding, cacheable, results, response):
+        if not cacheable or not results or response == CHAT_COMPLETION_ERROR:
+            return
+        self.semantic_cache.store(query_embedding, response, context_fingerprint(results))
+
+    async def aclose(self):
+        await self.retriever.aclose()
+        if self.lexical_retriever:
+            await self.lexical_retriever.aclose()
+        self.mongodb_client.close()
+        await self.openai_client.aclose()
+
+    async def _aprepare(self, question, num_results, chat_history):
+        """
+        Runs everything up to the completion.
+        Returns (cached_answer, messages, query_embedding, results, cacheable).
+        """
+        # Pytanie uzupełniające ("a ile to kosztuje?") wyszukujemy jako samodzielne zapytanie; model dostaje oryginał
+        # z historią, chyba że odpowiedź idzie do semantic cache (patrz _prompt_input)
+        search_query, standalone = await self.query_rewriter.arewrite(question, chat_history)
+        lexical_results = self._lexical_search(search_query, num_results)
+        if self._is_keyword_query(search_query, lexical_results):
+            main_logger.info("🔤 Keyword query served from the lexical index, embedding skipped")
+            metrics.inc("rag_queries_total", path="lexical")
+            query_embedding = None
+            cacheable = False
+            results = lexical_results[:self.reranker.final_k(num_results)]
+        else:
+            # No-op unless the cached index state is stale or a previous search failed
+            with metrics.span("index_check"):
+                await self.mongodb_client.aensure_vector_search_index()
+
+            with metrics.span("embedding"):
+                query_embedding = await self.openai_client.agenerate_embeddings(search_query)
+            main_logger.debug("📊 Query embedding generated")
+
+            with metrics.span("vector_search"):
+                results = await self.retriever.asearch(query_embedding,
+                                                       num_results=self.reranker.candidates(num_results),
+                                                       include_vectors=self.reranker.enabled)
+            cosmosdb_logger.info(f"🔎 Vector search completed with {len(results)} results")
+            results = self._rerank(search_query, query_embedding, results, lexical_results, num_results)
+
+            # Cache dopiero po wyszukiwaniu - trafienie musi mieć ten sam kontekst co odpowiedź w cache
+            cacheable = self._is_cacheable(query_embedding, standalone)
+            if cacheable:
+                await self._arefresh_knowledge_base_version()
+            cached_answer = self._lookup_cached_answer(query_embedding, cacheable, results)
+            if cached_answer is not None:
+                return cached_answer, None, query_embedding, results, cacheable
+            metrics.inc("rag_queries_total", path="vector")
+
+        prompt_question, prompt_history = self._prompt_input(question, search_query, cacheable, chat_history)
+        messages = self._build_messages(prompt_question, results, prompt_history)
+        return None, messages, query_embedding, results, cacheable
+
+    async def aprocess_query(self, question, num_results=10, chat_history=None):
+        main_logger.info(f"🔄 Processing query (async): {question}")
+        log_chat_history(chat_history)
+
+        try:
+            cached_answer, messages, query_embedding, results, cacheable = await self._aprepare(
+                question, num_results, chat_history)
+            if cached_answer is not None:
+                return cached_answer
+
+            with metrics.span("completion"):
+                response = await self.openai_client.agenerate_chat_completion(messages)
             openai_logger.info("✅ Chat completion generated")
+            self._store_cached_answer(query_embedding, cacheable, results, response)
 
             main_logger.info("✅ Query processed successfully")
             main_logger.debug(f"🗨️ AI Response: {response[:100]}...")
@@ -101,5 +266,41 @@ class RAGEngine:
         except Exception as e:
             main_logger.error(f"❌ Error processing query: {e}", exc_info=True)
             return f"Kurza twarz! Wystąpił niezidentyfikowany błąd: 🐞 ERROR: [{e}]."
-        # finally:
-        #     self.mongodb_client.close()
+
+    async def astream_query(self, question, num_results=10, chat_history=None):
+        """
+        Same pipeline as aprocess_query, but yields the answer in pieces as the completion streams in.
+        Raises AnswerInterrupted (with the text yielded so far) when the stream fails after the first piece.
+        """
+        main_logger.info(f"🔄 Processing query (stream): {question}")
+        log_chat_history(chat_history)
+        parts = []
+
+        try:
+            cached_answer, messages, query_embedding, results, cacheable = await self._aprepare(
+                question, num_results, chat_history)
+            if cached_answer is not None:
+                yield cached_answer
+                return
+
+            started = time.perf_counter()
+            async for delta in self.openai_client.astream_chat_completion(messages):
+                if not parts:
+                    # Przy streamingu liczy się głównie czas do pierwszego fragmentu
+                    metrics.observe("rag_stage_duration_seconds", time.perf_counter() - started, stage="first_token")
+                parts.append(delta)
+                yield delta
+            metrics.observe("rag_stage_duration_seconds", time.perf_counter() - started, stage="completion")
+            response = "".join(parts)
+            openai_logger.info("✅ Chat completion streamed")
+            self._store_cached_answer(query_embedding, cacheable, results, response)
+
+            main_logger.info("✅ Query processed successfully")
+            main_logger.debug(f"🗨️ AI Response: {response[:100]}...")
+        except Exception as e:
+            main_logger.error(f"❌ Error processing query: {e}", exc_info=True)
+            if parts:
+                # Część odpowiedzi już poszła - komunikat o błędzie nie może udawać jej dalszego ciągu
+                main_logger.warning(f"✂️ Answer stream broke off after {len(parts)} pieces, not caching it")
+                raise AnswerInterrupted("".join(parts), e) from e
+            yield f"Kurza twarz! Wystąpił niezidentyfikowany błąd: 🐞 ERROR: [{e}]."
@@ -0,0 +1,317 @@
+import asyncio
+import heapq
+import itertools
+import re
+import time
+from src.config import OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT, OPENAI_CONCURRENCY_INITIAL, OPENAI_CONCURRENCY_MIN, \
+    OPENAI_CONCURRENCY_MAX, OPENAI_BACKGROUND_RESERVE
+from src.logger import openai_logger as logger
+from src.metrics import metrics
+
+PRIORITY_INTERACTIVE = 0  # chat completions and query embeddings - a user is waiting
+PRIORITY_BACKGROUND = 1  # ingestion batches
+
+OUTCOME_OK = "ok"
+OUTCOME_RATE_LIMITED = "rate_limited"
+OUTCOME_TIMEOUT = "timeout"
+OUTCOME_ERROR = "error"
+
+AIMD_BACKOFF = 0.5
+AIMD_COOLDOWN = 1.0  # seconds; a burst of 429s from one overload halves the limit once
+MESSAGE_OVERHEAD_TOKENS = 4
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)?")
+
+
+class DeadlineExceeded(TimeoutError):
+    """The call could not get a slot (or finish its retries) before its deadline."""
+
+
+class BudgetExceeded(ValueError):
+    """A background call needs more tokens than its share of the quota - it has to be split."""
+
+
+def parse_duration(value) -> float:
+    """OpenAI reset / retry headers -> seconds: '1m30s', '20ms', '0.5s', '2' (plain number = seconds)."""
+    if value is None:
+        return None
+    seconds = 0.0
+    matched = False
+    for number, unit in _DURATION_RE.findall(str(value)):
+        matched = True
+        seconds += float(number) * {"ms": 0.001, "h": 3600, "m": 60}.get(unit, 1)
+    return seconds if matched else None
+
+
+def retry_after(headers) -> float:
+    if headers is None:
+        return None
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+def estimate_tokens(texts) -> int:
+    """Same rough rule the API uses when it admits a request: ~4 characters per token."""
+    return sum(len(text or "") // 4 + MESSAGE_OVERHEAD_TOKENS for text in texts)
+
+
+def token_batches(texts, batch_size, max_tokens=None):
+    """
+    Consecutive batches of at most `batch_size` texts and (when known) max_tokens() estimated tokens.
+    `max_tokens` is a callable, asked before every batch; it returning 0 means no token limit.
+    """
+    start = 0
+    while start < len(texts):
+        limit = max_tokens() if max_tokens is not None else 0
+        end = start + 1
+        tokens = estimate_tokens(texts[start:end])
+        while end < len(texts) and end - start < batch_size:
+            tokens += estimate_tokens(texts[end:end + 1])
+            if limit and tokens > limit:
+                break
+            end += 1
+        yield texts[start:end]
+        start = end
+
+
+class RateBudget:
+    """
+    Per-minute quota of one resource (requests or tokens). Refilled continuously, corrected with the
+    x-ratelimit-* headers of every response. limit == 0 means unknown - nothing is held back until the
+    first response tells us the limit.
+    """
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self.remaining = float(limit)
+        self.rate = limit / 60
+        self._updated = time.monotonic()
+
+    def _refill(self, now):
+        if self.limit:
+            self.remaining = min(self.limit, self.remaining + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def capacity(self, reserve=0.0) -> float:
+        """Largest amount that can ever be taken while leaving `reserve` untouched; 0 = limit unknown."""
+        return self.limit * (1 - reserve)
+
+    def wait_time(self, amount, reserve=0.0, now=None) -> float:
+        """
+        Seconds until `amount` can be taken while leaving `reserve` (share of the limit) untouched.
+        With a reserve the amount must fit in capacity(reserve) - see OpenAIScheduler._dispatch.
+        """
+        if not self.limit:
+            return 0.0
+        now = now if now is not None else time.monotonic()
+        self._refill(now)
+        held_back = reserve * self.limit
+        if not reserve:
+            # Pojedyncze zapytanie użytkownika większe niż cały limit i tak przejdzie - nie czekamy w nieskończoność
+            amount = min(amount, self.limit)
+        missing = amount + held_back - self.remaining
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def take(self, amount):
+        if self.limit:
+            self.remaining -= amount
+
+    def give_back(self, amount):
+        if self.limit:
+            self.remaining = min(self.limit, self.remaining + amount)
+
+    def update(self, limit=None, remaining=None, reset=None):
+        if limit:
+            self.limit = limit
+        if not self.limit:
+            return
+        if remaining is not None:
+            self.remaining = min(self.limit, remaining)
+            self._updated = time.monotonic()
+        # Tempo odnawiania z nagłówka "reset" (czas do pełnego limitu), bez niego - limit na minutę
+        missing = self.limit - self.remaining
+        self.rate = missing / reset if reset and missing > 0 else self.limit / 60
+
+
+class AIMDLimit:
+    """Concurrency limit: +1 per `limit` successful calls, halved on congestion (429 / timeout)."""
+
+    def __init__(self, initial=OPENAI_CONCURRENCY_INITIAL, minimum=OPENAI_CONCURRENCY_MIN,
+                 maximum=OPENAI_CONCURRENCY_MAX):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decreases = 0
+        self._decreased_at = float("-inf")
+
+    @property
+    def value(self) -> int:
+        return int(self.limit)
+
+    def increase(self):
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def decrease(self):
+        now = time.monotonic()
+        if now - self._decreased_at < AIMD_COOLDOWN:
+            return
+        self._decreased_at = now
+        self.decreases += 1
+        self.limit = max(self.minimum, self.limit * AIMD_BACKOFF)
+
+
+class Lease:
+    __slots__ = ("priority", "tokens", "granted_at")
+
+    def __init__(self, priority, tokens):
+        self.priority = priority
+        self.tokens = tokens
+        self.granted_at = None
+
+
+class OpenAIScheduler:
+    """
+    Admission control for one model's calls: a call starts only when the AIMD concurrency limit and the
+    RPM / TPM budgets allow it. Waiting calls are served by priority, then in arrival order, and give up
+    at their deadline. Background calls leave OPENAI_BACKGROUND_RESERVE of each quota to interactive ones.
+
+    Every process has its own scheduler - the budgets are shared between workers (and the ingestion CLI)
+    only through the x-ratelimit-remaining-* headers, which report the organisation-wide state.
+    """
+
+    def __init__(self, model, rpm=OPENAI_RPM_LIMIT, tpm=OPENAI_TPM_LIMIT, concurrency=None,
+                 background_reserve=OPENAI_BACKGROUND_RESERVE):
+        self.model = model
+        self.requests = RateBudget(rpm)
+        self.tokens = RateBudget(tpm)
+        self.concurrency = concurrency or AIMDLimit()
+        self.background_reserve = background_reserve
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._timer = None
+        self.granted = 0
+        self.rate_limited = 0
+        self.deadline_exceeded = 0
+
+    async def acquire(self, tokens, priority=PRIORITY_INTERACTIVE, deadline=None) -> Lease:
+        loop = asyncio.get_running_loop()
+        lease = Lease(priority, tokens)
+        future = loop.create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future, lease))
+        self._dispatch()
+        expiry = None
+        if deadline is not None and not future.done():
+            expiry = loop.call_later(max(0.0, deadline - time.monotonic()), self._expire, future)
+        started = time.monotonic()
+        try:
+            await future
+        except BaseException:
+            # Anulowanie w chwili, gdy slot był już przyznany - oddajemy go, inaczej by przepadł
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self.release(lease, OUTCOME_ERROR)
+            else:
+                self._dispatch()
+            raise
+        finally:
+            if expiry is not None:
+                expiry.cancel()
+        metrics.observe("openai_queue_wait_seconds", time.monotonic() - started, model=self.model)
+        return lease
+
+    def _expire(self, future):
+        if not future.done():
+            self.deadline_exceeded += 1
+            future.set_exception(DeadlineExceeded(f"No {self.model} slot before the deadline "
+                                                  f"({self.in_flight} in flight, {self.queued} queued)"))
+            self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            priority, _, future, lease = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if self.in_flight >= self.concurrency.value:
+                return  # release() dispatches again
+            reserve = self.background_reserve if priority > PRIORITY_INTERACTIVE else 0.0
+            if reserve and self.tokens.limit and lease.tokens > self.tokens.capacity(reserve):
+                # Przyznanie wyczerpałoby rezerwę interaktywnych wywołań (i zeszło poniżej zera) - nigdy się nie zmieści
+                heapq.heappop(self._waiters)
+                future.set_exception(BudgetExceeded(
+                    f"{lease.tokens} tokens exceed the {self.tokens.capacity(reserve):.0f} background tokens "
+                    f"per minute of {self.model}, split the batch"))
+                continue
+            wait = max(self.paused_until - now,
+                       self.requests.wait_time(1, reserve, now),
+                       self.tokens.wait_time(lease.tokens, reserve, now))
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._waiters)
+            self.in_flight += 1
+            self.granted += 1
+            self.requests.take(1)
+            self.tokens.take(lease.tokens)
+            lease.granted_at = now
+            future.set_result(None)
+
+    def max_tokens(self, priority=PRIORITY_INTERACTIVE) -> int:
+        """Token size of the largest call `priority` can be granted; 0 = no limit known yet."""
+        reserve = self.background_reserve if priority > PRIORITY_INTERACTIVE else 0.0
+        return int(self.tokens.capacity(reserve))
+
+    def release(self, lease, outcome=OUTCOME_OK, headers=None, used_tokens=None, retry_delay=None):
+        self.in_flight -= 1
+        if used_tokens is not None:
+            self.tokens.give_back(lease.tokens - used_tokens)
+        if headers is not None:
+            self.update_from_headers(headers)
+        if outcome == OUTCOME_OK:
+            self.concurrency.increase()
+        elif outcome in (OUTCOME_RATE_LIMITED, OUTCOME_TIMEOUT):
+            self.concurrency.decrease()
+        if outcome == OUTCOME_RATE_LIMITED:
+            self.rate_limited += 1
+            # Wszystkie wywołania tego modelu czekają - kolejne 429 tylko przedłużyłyby blokadę
+            self.paused_until = max(self.paused_until, time.monotonic() + (retry_delay or 1.0))
+            logger.warning(f"⏳ {self.model} rate limited, pausing for {retry_delay or 1.0:.2f}s "
+                           f"(concurrency limit now {self.concurrency.value})")
+        self._dispatch()
+
+    def update_from_headers(self, headers):
+        def number(name):
+            value = headers.get(name)
+            try:
+                return int(value) if value is not None else None
+            except ValueError:
+                return None
+
+        self.requests.update(number("x-ratelimit-limit-requests"), number("x-ratelimit-remaining-requests"),
+                             parse_duration(headers.get("x-ratelimit-reset-requests")))
+        self.tokens.update(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"),
+                           parse_duration(headers.get("x-ratelimit-reset-tokens")))
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future, _ in self._waiters if not future.done())
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "concurrency_limit": self.concurrency.value,
+            "concurrency_decreases": self.concurrency.decreases,
+            "granted": self.granted,
+            "rate_limited": self.rate_limited,
+            "deadline_exceeded": self.deadline_exceeded,
+            "rpm_limit": self.requests.limit,
+            "rpm_remaining": round(self.requests.remaining, 1),
+            "tpm_limit": self.tokens.limit,
+            "tpm_remaining": round(self.tokens.remaining, 1),
+        }
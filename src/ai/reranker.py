@@ -0,0 +1,105 @@
+import numpy as np
+from src.config import RERANK_ENABLED, RERANK_FETCH_MULTIPLIER, RERANK_TOP_K, RERANK_MMR_LAMBDA, RERANK_BM25_WEIGHT, \
+    RRF_K
+from src.database.lexical_index import bm25_scores
+from src.logger import main_logger
+
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    spread = values.max() - values.min()
+    return (values - values.min()) / spread if spread > 0 else np.ones_like(values)
+
+
+def mmr(vectors, relevance, k, lambda_=RERANK_MMR_LAMBDA) -> list:
+    """
+    Maximal marginal relevance: repeatedly picks the candidate maximizing
+    lambda * relevance - (1 - lambda) * max similarity to the already picked ones.
+    Similarities to picked candidates are kept in one running max vector, so each step is a single mat-vec.
+    """
+    n = len(vectors)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    relevance = np.asarray(relevance, dtype=np.float32)
+
+    selected = []
+    max_similarity = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(k):
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        scores = lambda_ * relevance - (1 - lambda_) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, vectors @ vectors[best], out=max_similarity)
+    return selected
+
+
+def reciprocal_rank_fusion(result_lists, limit, k=RRF_K) -> list:
+    """
+    Merges ranked lists by summing 1 / (k + rank) per document, so only positions matter and the
+    incomparable vector and BM25 scores never have to be normalized against each other.
+    """
+    fused, documents = {}, {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            key = str(result.get("_id"))
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            # Pierwsza lista (wektorowa) ma pierwszeństwo - jej wpis zawiera similarityScore
+            documents.setdefault(key, result)
+    ranked = sorted(fused, key=fused.get, reverse=True)[:limit]
+    return [{**documents[key], "fusedScore": fused[key]} for key in ranked]
+
+
+class Reranker:
+    """
+    Post-processing of retrieval results: the retriever over-fetches `fetch_multiplier` times more
+    candidates, which are optionally re-scored with BM25 and then diversified with MMR down to `top_k`.
+    """
+
+    def __init__(self, enabled=RERANK_ENABLED, fetch_multiplier=RERANK_FETCH_MULTIPLIER, top_k=RERANK_TOP_K,
+                 lambda_=RERANK_MMR_LAMBDA, bm25_weight=RERANK_BM25_WEIGHT):
+        self.enabled = enabled
+        self.fetch_multiplier = max(fetch_multiplier, 1)
+        self.top_k = top_k
+        self.lambda_ = lambda_
+        self.bm25_weight = bm25_weight
+
+    def candidates(self, num_results: int) -> int:
+        return num_results * self.fetch_multiplier if self.enabled else num_results
+
+    def final_k(self, num_results: int) -> int:
+        return min(num_results, self.top_k) if self.enabled and self.top_k else num_results
+
+    def rerank(self, question, query_embedding, results, num_results=10) -> list:
+        k = self.final_k(num_results)
+        if not self.enabled or len(results) <= 1:
+            return [self._strip(result) for result in results[:k]]
+
+        relevance = np.array([result.get("similarityScore", 0.0) for result in results], dtype=np.float32)
+        if self.bm25_weight > 0:
+            lexical = bm25_scores(question, [result.get("content", "") for result in results])
+            blended = (1 - self.bm25_weight) * _min_max(relevance) + self.bm25_weight * _min_max(lexical)
+            # Z powrotem w skali cosinusa, żeby kara za podobieństwo w MMR miała tę samą wagę co bez BM25
+            relevance = relevance.min() + blended * (relevance.max() - relevance.min())
+
+        if all(result.get("vector") is not None for result in results):
+            order = mmr([result["vector"] for result in results], relevance, k, self.lambda_)
+        else:
+            # Bez wektorów (np. stary backend) zostaje samo sortowanie po trafności
+            order = [int(i) for i in np.argsort(-relevance, kind="stable")[:k]]
+
+        reranked = [self._strip(results[i]) for i in order]
+        main_logger.debug(f"🔀 Reranked {len(results)} candidates down to {len(reranked)}")
+        return reranked
+
+    @staticmethod
+    def _strip(result):
+        # Wektor potrzebny był tylko do MMR - nie trzymamy go dalej w pamięci ani w cache
+        if "vector" in result:
+            result = {key: value for key, value in result.items() if key != "vector"}
+        return result
@@ -0,0 +1,138 @@
+import hashlib
+import threading
+import time
+import numpy as np
+from src.config import SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL
+from src.logger import main_logger
+
+# Powyżej tej liczby wpisów skanujemy najpierw tanią projekcję, a dokładny cosinus liczymy tylko dla kandydatów
+EXACT_SCAN_LIMIT = 4096
+PROJECTION_DIM = 128
+PROJECTION_CANDIDATES = 32
+
+
+def context_fingerprint(results) -> str:
+    digest = hashlib.sha1()
+    for result in results:
+        digest.update(str(result.get("_id")).encode())
+        digest.update(str(result.get("createdAt")).encode())
+    return digest.hexdigest()[:16]
+
+
+class SemanticCache:
+    """
+    Stores (query embedding, context fingerprint, answer) and returns a cached answer for questions
+    whose embedding is within `threshold` cosine similarity of an earlier one and whose retrieved
+    context (fingerprint) is still the same as when the answer was generated.
+    Entries live in a preallocated float32 matrix used as a ring buffer (oldest entry is overwritten first).
+    """
+
+    def __init__(self, capacity=SEMANTIC_CACHE_SIZE, threshold=SEMANTIC_CACHE_THRESHOLD, ttl=SEMANTIC_CACHE_TTL):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.knowledge_base_version = None
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._projected = None
+        self._projection = None
+        self._answers = [None] * capacity
+        self._fingerprints = [None] * capacity
+        self._expires_at = np.zeros(capacity, dtype=np.float64)
+        self._size = 0
+        self._next = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def _allocate(self, dim):
+        rng = np.random.default_rng(0)
+        self._vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+        self._projection = (rng.standard_normal((dim, PROJECTION_DIM)) / np.sqrt(PROJECTION_DIM)).astype(np.float32)
+        self._projected = np.zeros((self.capacity, PROJECTION_DIM), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, fingerprint=None):
+        if not self.enabled:
+            return None
+        query = self._normalize(embedding)
+        with self._lock:
+            if self._size == 0 or self._vectors is None or self._vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            if self._size <= EXACT_SCAN_LIMIT:
+                candidates = np.arange(self._size)
+            else:
+                approx = self._projected[:self._size] @ (query @ self._projection)
+                candidates = np.argpartition(approx, -PROJECTION_CANDIDATES)[-PROJECTION_CANDIDATES:]
+
+            scores = self._vectors[candidates] @ query
+            scores[self._expires_at[candidates] < time.monotonic()] = -1.0
+            # Najbliższy wpis, którego kontekst zgadza się z obecnym wynikiem wyszukiwania - odpowiedź sprzed
+            # zmiany dokumentów (inny fingerprint) nie może zostać zwrócona
+            above = np.flatnonzero(scores >= self.threshold)
+            for best in above[np.argsort(-scores[above])]:
+                slot = int(candidates[best])
+                if fingerprint is None or self._fingerprints[slot] == fingerprint:
+                    self.hits += 1
+                    return self._answers[slot], float(scores[best]), self._fingerprints[slot]
+            self.misses += 1
+            return None
+
+    def store(self, embedding, answer, fingerprint):
+        if not self.enabled:
+            return
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._allocate(vector.shape[0])
+                self._size = 0
+                self._next = 0
+            slot = self._next
+            self._vectors[slot] = vector
+            self._projected[slot] = vector @ self._projection
+            self._answers[slot] = answer
+            self._fingerprints[slot] = fingerprint
+            self._expires_at[slot] = time.monotonic() + self.ttl if self.ttl else np.inf
+            self._next = (slot + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def invalidate(self):
+        with self._lock:
+            self._size = 0
+            self._next = 0
+            self._answers = [None] * self.capacity
+            self._fingerprints = [None] * self.capacity
+        main_logger.info("🧹 Semantic answer cache invalidated")
+
+    def set_knowledge_base_version(self, version):
+        # Każda zmiana bazy wiedzy unieważnia wszystkie zapamiętane odpowiedzi
+        if version == self.knowledge_base_version:
+            return
+        if self.knowledge_base_version is not None:
+            main_logger.info(f"📚 Knowledge base changed ({self.knowledge_base_version} -> {version})")
+            self.invalidate()
+        self.knowledge_base_version = version
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def create_semantic_cache() -> SemanticCache:
+    return SemanticCache(capacity=SEMANTIC_CACHE_SIZE if SEMANTIC_CACHE_ENABLED else 0)
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+from src.config import DEDUP_TTL, DEDUP_MAX_SIZE, DEDUP_USE_MYSQL
+from src.database.mysql_queries import claim_message_ids
+from src.logger import whatsapp_logger
+
+
+class MessageDeduplicator:
+    """
+    Drops webhook redeliveries of the same WhatsApp message ID. The in-memory TTL set catches
+    replays hitting this instance in O(1); the MySQL claim (unique key) catches replays that
+    were delivered to another instance.
+    """
+
+    def __init__(self, ttl=DEDUP_TTL, max_size=DEDUP_MAX_SIZE, use_mysql=DEDUP_USE_MYSQL):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.use_mysql = use_mysql
+        self._seen = OrderedDict()
+        self.unique = 0
+        self.suppressed_memory = 0
+        self.suppressed_mysql = 0
+
+    def _evict(self, now):
+        # Stały TTL => kolejność wstawiania jest kolejnością wygasania, więc wystarczy patrzeć na początek
+        while self._seen and (next(iter(self._seen.values())) <= now or len(self._seen) > self.max_size):
+            self._seen.popitem(last=False)
+
+    def seen(self, message_id) -> bool:
+        """Returns True for a replay; otherwise remembers the ID and returns False."""
+        if not message_id:
+            return False
+        now = time.monotonic()
+        self._evict(now)
+        expires_at = self._seen.get(message_id)
+        if expires_at is not None and expires_at > now:
+            self.suppressed_memory += 1
+            whatsapp_logger.info(f"♊ Duplicate delivery of message {message_id} suppressed")
+            return True
+        self._seen[message_id] = now + self.ttl
+        self._evict(now)
+        self.unique += 1
+        return False
+
+    def forget(self, message_id):
+        # Wiadomość nie została przyjęta (np. kolejka pełna) - ponowna dostawa od Meta ma zostać przetworzona
+        if message_id and self._seen.pop(message_id, None) is not None:
+            self.unique -= 1
+
+    async def aclaim_messages(self, messages, checkpoint=None) -> list:
+        """
+        Claims every message of a job (one MySQL statement) and returns the ones this instance should answer.
+        Each message is first marked as claimed and `checkpoint()` persists the mark (the job journal), only
+        then MySQL is asked - a job replayed after a crash skips messages it had already claimed instead of
+        mistaking its own claim for another instance's.
+        """
+        fresh = [message for message in messages if not message.get('claimed')]
+        if not fresh or not self.use_mysql:
+            return list(messages)
+        for message in fresh:
+            message['claimed'] = True
+        if checkpoint is not None:
+            checkpoint()
+        message_ids = list(dict.fromkeys(message['id'] for message in fresh if message.get('id')))
+        claimed = await claim_message_ids(message_ids) if message_ids else set()
+        if claimed is None:
+            # Błąd bazy; wolimy ewentualny duplikat niż zgubioną wiadomość
+            return list(messages)
+        rejected = set(message_ids) - claimed
+        for message_id in rejected:
+            self.suppressed_mysql += 1
+            whatsapp_logger.info(f"♊ Message {message_id} already processed by another instance")
+        return [message for message in messages if message.get('id') not in rejected]
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._seen),
+            "unique": self.unique,
+            "suppressed_memory": self.suppressed_memory,
+            "suppressed_mysql": self.suppressed_mysql,
+        }
@@ -0,0 +1,204 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from src.config import QUEUE_WORKERS, QUEUE_MAXSIZE, QUEUE_JOURNAL_PATH, QUEUE_DRAIN_TIMEOUT, COALESCE_WINDOW, \
+    COALESCE_MAX_WAIT
+from src.api.sessions import SessionManager
+from src.logger import main_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows - no cross-process lock, single worker only
+    fcntl = None
+
+JOURNAL_MAX_SLOTS = 64
+
+
+class SQLiteJobJournal:
+    """Keeps accepted jobs on disk until they are processed, so a crash or restart doesn't lose them."""
+
+    def __init__(self, path: str, slot_lock=None):
+        self.path = path
+        self.slot_lock = slot_lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+
+    def add(self, job: dict) -> int:
+        with self._lock:
+            cursor = self._conn.execute("INSERT INTO jobs (payload, created_at) VALUES (?, ?)",
+                                        (json.dumps(job), time.time()))
+        return cursor.lastrowid
+
+    def update(self, job_id: int, job: dict):
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET payload = ? WHERE id = ?", (json.dumps(job), job_id))
+
+    def remove(self, job_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def pending(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, payload FROM jobs ORDER BY id").fetchall()
+        return [(job_id, json.loads(payload)) for job_id, payload in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        if self.slot_lock is not None:
+            self.slot_lock.close()
+
+
+def claim_journal_slot(path: str, max_slots=JOURNAL_MAX_SLOTS):
+    """
+    Every server worker process gets its own journal: slot 0 is `path` itself, the next ones `path.1`,
+    `path.2`... A slot is held with an exclusive flock for the life of the process, so after a restart
+    each journal is replayed by exactly one worker. Returns (journal path, open lock file).
+    """
+    if fcntl is None:
+        return path, None
+    for slot in range(max_slots):
+        slot_path = path if slot == 0 else f"{path}.{slot}"
+        lock_file = open(f"{slot_path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        return slot_path, lock_file
+    raise RuntimeError(f"All {max_slots} journal slots of {path} are taken")
+
+
+class MessageQueue:
+    """
+    Bounded intake for incoming messages. Every sender's jobs go to that sender's session actor
+    (src.api.sessions), so messages from one user are processed in arrival order with up-to-date
+    history, while different users are processed concurrently - a slow conversation only holds up
+    itself. When `maxsize` jobs are waiting, or one sender has a full mailbox, submit() refuses the
+    job and the webhook answers 503, which makes Meta redeliver it later (admission control).
+
+    Every message is journaled as its own job the moment it is accepted; quick successive messages of
+    one sender are merged only when the session takes them out of its mailbox (coalesce_window), and
+    their journal entries are removed together once the merged job is done.
+    """
+
+    def __init__(self, handler, workers=QUEUE_WORKERS, maxsize=QUEUE_MAXSIZE, journal=None,
+                 coalesce_window=COALESCE_WINDOW, coalesce_max_wait=COALESCE_MAX_WAIT):
+        self.handler = handler
+        self.maxsize = max(1, maxsize)
+        self.journal = journal
+        self.sessions = SessionManager(self._process, workers=workers, coalesce_window=coalesce_window,
+                                       coalesce_max_wait=coalesce_max_wait)
+        self._running = {}
+        self.coalesced = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def start(self):
+        self.sessions.start()
+        main_logger.info(f"📥 Message queue started ({self.sessions.workers} workers, {self.maxsize} queued jobs, "
+                         f"{self.sessions.mailbox_size} per sender, coalescing {self.sessions.coalesce_window}s)")
+
+        if self.journal is not None:
+            pending = self.journal.pending()
+            if pending:
+                main_logger.info(f"♻️ Replaying {len(pending)} unfinished jobs from the journal")
+            for job_id, job in pending:
+                # Zadania już potwierdzone wobec Meta - przyjmujemy je ponad limit zamiast czekać
+                self.sessions.deliver(job["sender"], (job_id, job))
+
+    def has_capacity(self, sender) -> bool:
+        return self.pending() < self.maxsize and self.sessions.has_capacity(sender)
+
+    def submit(self, job: dict) -> bool:
+        if not self.has_capacity(job["sender"]):
+            self.rejected += 1
+            main_logger.warning(f"🚦 Message queue full, rejecting message from {job['sender']}")
+            return False
+        job_id = self.journal.add(job) if self.journal is not None else None
+        self.sessions.deliver(job["sender"], (job_id, job))
+        self.accepted += 1
+        return True
+
+    def checkpoint(self, job: dict):
+        """Persists changes the handler made to a running job (e.g. dedup claims) in its journal entries."""
+        for job_id, original in self._running.get(id(job), ()):
+            if job_id is not None:
+                # Scalone zadanie dzieli słowniki wiadomości z oryginałami - zapisujemy każdy wpis osobno
+                self.journal.update(job_id, original)
+
+    def _merge(self, items) -> dict:
+        if len(items) == 1:
+            return items[0][1]
+        job = {"sender": items[0][1]["sender"], "messages": [message for _, job in items for message in job["messages"]]}
+        self.coalesced += len(items) - 1
+        main_logger.info(f"🧩 Coalesced {len(job['messages'])} messages from {job['sender']} into one query")
+        return job
+
+    async def _process(self, items):
+        job = self._merge(items)
+        self._running[id(job)] = items
+        finished = True
+        try:
+            await self.handler(job)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            main_logger.error(f"❌ Job for {job.get('sender')} failed: {e}", exc_info=True)
+        except asyncio.CancelledError:
+            # Przerwane przy zamykaniu - zadanie zostaje w dzienniku i zostanie powtórzone po restarcie
+            finished = False
+            raise
+        finally:
+            del self._running[id(job)]
+            if finished and self.journal is not None:
+                for job_id, _ in items:
+                    self.journal.remove(job_id)
+
+    async def stop(self, timeout=QUEUE_DRAIN_TIMEOUT):
+        if not await self.sessions.drain(timeout):
+            # Niedokończone zadania zostają w dzienniku i zostaną powtórzone po restarcie
+            main_logger.warning(f"⏱️ Message queue not drained within {timeout}s, "
+                                f"{self.pending()} jobs left")
+        await self.sessions.close()
+        if self.journal is not None:
+            self.journal.close()
+        main_logger.info("🚪 Message queue stopped")
+
+    def pending(self) -> int:
+        return self.sessions.queued
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+        }
+
+
+def create_job_journal():
+    if not QUEUE_JOURNAL_PATH:
+        return None
+    try:
+        path, slot_lock = claim_journal_slot(QUEUE_JOURNAL_PATH)
+        main_logger.info(f"📒 Job journal: {path}")
+        return SQLiteJobJournal(path, slot_lock)
+    except (sqlite3.Error, OSError, RuntimeError) as e:
+        main_logger.error(f"❌ Could not open job journal {QUEUE_JOURNAL_PATH}, running without it: {e}")
+        return None
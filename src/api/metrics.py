@@ -0,0 +1,57 @@
+from quart import Blueprint, Response
+from src.metrics import metrics, stats_samples
+from src.api.webhook import get_rag_engine, get_message_queue, get_deduplicator, get_single_flight
+from src.database.mysql_queries import history_cache, get_pool_stats
+from src.database.pool_manager import ACQUIRE_BUCKETS_MS
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def collect_caches():
+    rag_engine = get_rag_engine()
+    return [
+        *stats_samples("semantic_cache", rag_engine.semantic_cache.stats()),
+        *stats_samples("embedding_cache", rag_engine.openai_client.embedding_cache.stats()),
+        *stats_samples("history_cache", history_cache.stats()),
+        *stats_samples("query_rewrite_cache", rag_engine.query_rewriter.stats()),
+    ]
+
+
+def collect_pipeline():
+    message_queue = get_message_queue()
+    return [
+        *stats_samples("message_queue", message_queue.stats()),
+        *stats_samples("sessions", message_queue.sessions.stats()),
+        *stats_samples("single_flight", get_single_flight().stats()),
+        *stats_samples("dedup", get_deduplicator().stats()),
+    ]
+
+
+def collect_openai():
+    samples = []
+    for model, stats in get_rag_engine().openai_client.scheduler_stats().items():
+        samples.extend(stats_samples("openai_scheduler", stats, model=model))
+    return samples
+
+
+def collect_pools():
+    samples = []
+    for kind, pools in get_pool_stats().items():
+        for name, stats in pools.items():
+            labels = {"kind": kind, "pool": name, "host": stats["host"]}
+            samples.extend(stats_samples("mysql_pool", stats, **labels))
+            # Histogram czasu oczekiwania na połączenie jako skumulowane kubełki, jak w Prometheusie
+            cumulative = 0
+            for bound, key in zip([*ACQUIRE_BUCKETS_MS, "+Inf"], stats["acquire_histogram_ms"]):
+                cumulative += stats["acquire_histogram_ms"][key]
+                samples.append(("mysql_pool_acquire_wait_ms", {**labels, "le": bound}, cumulative))
+    return samples
+
+
+for collector in (collect_caches, collect_pipeline, collect_openai, collect_pools):
+    metrics.register_collector(collector)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+async def prometheus_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
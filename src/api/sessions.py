@@ -0,0 +1,197 @@
+import asyncio
+import time
+from collections import deque
+from src.config import QUEUE_WORKERS, SESSION_MAILBOX_SIZE, SESSION_IDLE_TIMEOUT, COALESCE_WINDOW, COALESCE_MAX_WAIT
+from src.logger import main_logger
+
+
+class SenderSession:
+    """
+    One sender's actor: a mailbox drained by its own task, one job at a time, so a user's messages are
+    answered in arrival order and every answer is written (to the history cache) before the next job
+    reads the history.
+    """
+
+    __slots__ = ("sender", "mailbox", "task", "evict_timer", "first_arrival", "last_arrival")
+
+    def __init__(self, sender):
+        self.sender = sender
+        self.mailbox = deque()
+        self.task = None
+        self.evict_timer = None
+        self.first_arrival = 0.0  # monotonic time of the oldest item in the mailbox
+        self.last_arrival = 0.0
+
+    @property
+    def busy(self) -> bool:
+        return self.task is not None or bool(self.mailbox)
+
+
+class SessionManager:
+    """
+    Routes every sender to its own SenderSession. Sessions of different senders run concurrently, at most
+    `workers` jobs at a time; a sender with nothing to do costs one idle object, dropped after
+    `idle_timeout` seconds.
+
+    The handler gets a list of items. With coalesce_window > 0 a session first waits until its sender has
+    been quiet for that long (at most coalesce_max_wait after the oldest queued item) and then hands over
+    everything in the mailbox at once; otherwise items go one by one.
+    """
+
+    def __init__(self, handler, workers=QUEUE_WORKERS, mailbox_size=SESSION_MAILBOX_SIZE,
+                 idle_timeout=SESSION_IDLE_TIMEOUT, coalesce_window=COALESCE_WINDOW,
+                 coalesce_max_wait=COALESCE_MAX_WAIT):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.mailbox_size = max(1, mailbox_size)
+        self.idle_timeout = idle_timeout
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_wait = coalesce_max_wait
+        self._sessions = {}
+        self._slots = None
+        self.queued = 0
+        self.running = 0
+        self.created = 0
+        self.evicted = 0
+
+    def start(self):
+        self._slots = asyncio.Semaphore(self.workers)
+
+    def has_capacity(self, sender) -> bool:
+        session = self._sessions.get(sender)
+        return session is None or len(session.mailbox) < self.mailbox_size
+
+    def deliver(self, sender, item):
+        session = self._sessions.get(sender)
+        if session is None:
+            session = self._sessions[sender] = SenderSession(sender)
+            self.created += 1
+        if session.evict_timer is not None:
+            session.evict_timer.cancel()
+            session.evict_timer = None
+        session.last_arrival = time.monotonic()
+        if not session.mailbox:
+            session.first_arrival = session.last_arrival
+        session.mailbox.append(item)
+        self.queued += 1
+        if session.task is None:
+            session.task = asyncio.create_task(self._run(session))
+
+    async def _run(self, session):
+        try:
+            while session.mailbox:
+                if self.coalesce_window > 0:
+                    await self._wait_for_quiet(session)
+                async with self._slots:
+                    items = self._take(session)
+                    self.running += 1
+                    try:
+                        await self.handler(items)
+                    finally:
+                        self.running -= 1
+        finally:
+            session.task = None
+        # Pusta skrzynka - sesja czeka na kolejne wiadomości do idle_timeout, potem znika
+        if self.idle_timeout > 0:
+            session.evict_timer = asyncio.get_running_loop().call_later(self.idle_timeout, self._evict, session.sender)
+        else:
+            self._evict(session.sender)
+
+    async def _wait_for_quiet(self, session):
+        # Użytkownicy często dzielą pytanie na 2-3 szybkie wiadomości - czekamy, aż skończą pisać
+        while True:
+            delay = min(session.last_arrival + self.coalesce_window,
+                        session.first_arrival + self.coalesce_max_wait) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def _take(self, session):
+        if self.coalesce_window > 0:
+            items = list(session.mailbox)
+            session.mailbox.clear()
+        else:
+            items = [session.mailbox.popleft()]
+        self.queued -= len(items)
+        return items
+
+    def _evict(self, sender):
+        session = self._sessions.get(sender)
+        if session is None or session.busy:
+            return
+        del self._sessions[sender]
+        self.evicted += 1
+
+    def tasks(self):
+        return [session.task for session in self._sessions.values() if session.task is not None]
+
+    async def drain(self, timeout) -> bool:
+        """Waits until every mailbox is empty. Returns False when `timeout` ran out first."""
+        deadline = time.monotonic() + timeout
+        while True:
+            tasks = self.tasks()
+            if not tasks:
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.wait(tasks, timeout=remaining)
+
+    async def close(self):
+        tasks = self.tasks()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for session in self._sessions.values():
+            if session.evict_timer is not None:
+                session.evict_timer.cancel()
+        self._sessions.clear()
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._sessions),
+            "busy": sum(1 for session in self._sessions.values() if session.busy),
+            "queued": self.queued,
+            "running": self.running,
+            "created": self.created,
+            "evicted": self.evicted,
+        }
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one execution: the first caller starts it, the others await
+    the same task and get the same result (or exception). A caller that is cancelled doesn't cancel the
+    shared work for the rest. Only for calls whose result doesn't depend on the caller.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        self.shared = 0
+
+    async def run(self, key, factory):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+            self.executions += 1
+        else:
+            self.shared += 1
+            main_logger.info("🪢 Identical query already in flight, sharing its answer")
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Wszyscy oczekujący mogli zostać anulowani - wyjątek i tak uznajemy za odebrany
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "shared": self.shared,
+        }
@@ -1,60 +1,174 @@
 from quart import Blueprint, request, current_app
 from src.logger import whatsapp_logger, main_logger
-from src.config import WEBHOOK_VERIFY_TOKEN
+from src.config import WEBHOOK_VERIFY_TOKEN, STREAM_MODE
 from src.ai import RAGEngine
+from src.ai.rag_engine import AnswerInterrupted
 from src.whatsapp.whatsapp_client import WhatsAppClient
+from src.whatsapp.message_chunker import MessageChunker
 from src.database.mysql_queries import insert_data_mysql, get_recent_queries
+from src.api.message_queue import MessageQueue, create_job_journal
+from src.api.dedup import MessageDeduplicator
+from src.api.sessions import SingleFlight
+from src.ai.embedding_cache import normalize_text
+from src.metrics import metrics
 import traceback
+import functools
 import asyncio
 import json
+import time
 
 webhook_bp = Blueprint('webhook', __name__)
-rag_engine = RAGEngine()
+STREAM_INTERRUPTED_MESSAGE = "Przepraszam, odpowiedź została przerwana 🐞 Spróbuj zadać pytanie jeszcze raz."
+INCOMPLETE_ANSWER_MARK = " [odpowiedź przerwana]"
 
 
-@webhook_bp.route('/webhook', methods=['POST'])
-async def webhook():
-    try:
-        data = await request.get_json()
-        main_request_body = data['entry'][0]['changes'][0]['value']
+# Obiekty współdzielone przez handlery powstają przy pierwszym użyciu (before_serving), nie przy imporcie modułu -
+# import nie otwiera plików cache / dziennika i nie zależy od konfiguracji środowiska
+@functools.cache
+def get_rag_engine() -> RAGEngine:
+    return RAGEngine()
 
-        errors = main_request_body.get('errors')
-        statuses = main_request_body.get('statuses')
-        messages = main_request_body.get('messages')
 
-        if errors:
-            whatsapp_logger.warn(f"⚙️ Request contained an errors field: \tErrors: {errors}")
-        if statuses:
-            whatsapp_logger.info(f'⚙️ Message status: {statuses[0].get("status")}')
-        if messages:
-            incoming_message = messages[0]
-            sender_phone_number = int(incoming_message.get("from"))
+@functools.cache
+def get_deduplicator() -> MessageDeduplicator:
+    return MessageDeduplicator()
 
-            if incoming_message.get('type') == 'text':
-                user_query = incoming_message['text'].get('body')
-                whatsapp_logger.info(f'✅ Received message: {user_query} from {sender_phone_number}')
 
-                # Pobierz historię zapytań
-                chat_history = await get_recent_queries(sender_phone_number)
+@functools.cache
+def get_single_flight() -> SingleFlight:
+    return SingleFlight()
 
-                # Przetwórz zapytanie z uwzględnieniem historii
-                main_logger.info(f'🔄 Processing query: {user_query}')
 
-                ai_answer = await asyncio.to_thread(rag_engine.process_query, user_query, chat_history=chat_history)
-                whatsapp_logger.info('🤖 RAGEngine processed query with chat history')
+@functools.cache
+def get_message_queue() -> MessageQueue:
+    return MessageQueue(process_text_message, journal=create_job_journal())
 
-                # Use asyncio to run these potentially blocking operations concurrently
-                # -> TODO change to asyncio.task_group
-                await asyncio.gather(
-                    WhatsAppClient.send_message(ai_answer, sender_phone_number),
-                    insert_data_mysql(sender_phone_number, user_query, ai_answer)
-                )
 
-                whatsapp_logger.info('✅ AI answer sent and data inserted into MySQL')
+async def stream_answer(user_query, chat_history, sender_phone_number):
+    # Każdy gotowy fragment (akapit / zdania) idzie od razu jako osobna wiadomość, całość wraca do zapisu w MySQL
+    chunker = MessageChunker()
+    parts = []
+    sent_messages = 0
+    interrupted = False
+    try:
+        async for delta in get_rag_engine().astream_query(user_query, chat_history=chat_history):
+            parts.append(delta)
+            for chunk in chunker.feed(delta):
+                await WhatsAppClient.send_message(chunk, sender_phone_number)
+                sent_messages += 1
+    except AnswerInterrupted:
+        interrupted = True
+    tail = chunker.flush()
+    if tail:
+        await WhatsAppClient.send_message(tail, sender_phone_number)
+        sent_messages += 1
+    if interrupted:
+        # Przeprosiny jako osobna wiadomość; w historii zostaje tylko to, co model faktycznie wygenerował
+        await WhatsAppClient.send_message(STREAM_INTERRUPTED_MESSAGE, sender_phone_number)
+        whatsapp_logger.warning(f'✂️ Streamed answer broke off after {sent_messages} messages')
+        return "".join(parts) + INCOMPLETE_ANSWER_MARK
+    whatsapp_logger.info(f'📨 Streamed answer delivered in {sent_messages} messages')
+    return "".join(parts)
+
+
+async def answer_query(user_query, chat_history):
+    # To samo pytanie od kilku osób naraz (np. po kampanii) liczymy raz - tylko bez historii rozmowy, wtedy odpowiedź
+    # zależy wyłącznie od pytania i klucz to samo pytanie
+    rag_engine = get_rag_engine()
+    if chat_history:
+        return await rag_engine.aprocess_query(user_query, chat_history=chat_history)
+    return await get_single_flight().run(normalize_text(user_query),
+                                         lambda: rag_engine.aprocess_query(user_query, chat_history=None))
+
+
+async def process_text_message(job):
+    sender_phone_number = job['sender']
+    # Zadanie może zawierać kilka szybko wysłanych wiadomości - odrzucamy te obsłużone już przez inną instancję
+    messages = await get_deduplicator().aclaim_messages(job['messages'], lambda: get_message_queue().checkpoint(job))
+    if not messages:
+        return
+    user_query = "\n".join(message['text'] for message in messages)
+
+    # Jedno źródło historii: cache historii (wypełniany przez insert_data_mysql), a przy jego braku MySQL
+    with metrics.span("history_fetch"):
+        chat_history = await get_recent_queries(sender_phone_number)
+
+    # Przetwórz zapytanie z uwzględnieniem historii
+    main_logger.info(f'🔄 Processing query: {user_query}')
+
+    if STREAM_MODE == 'chunks':
+        ai_answer = await stream_answer(user_query, chat_history, sender_phone_number)
+        whatsapp_logger.info('🤖 RAGEngine streamed query with chat history')
+        await insert_data_mysql(sender_phone_number, user_query, ai_answer)
+    else:
+        if STREAM_MODE == 'typing':
+            await WhatsAppClient.send_typing_indicator(messages[-1]['id'])
+
+        ai_answer = await answer_query(user_query, chat_history)
+        whatsapp_logger.info('🤖 RAGEngine processed query with chat history')
+
+        # Use asyncio to run these potentially blocking operations concurrently
+        # -> TODO change to asyncio.task_group
+        await asyncio.gather(
+            WhatsAppClient.send_message(ai_answer, sender_phone_number),
+            insert_data_mysql(sender_phone_number, user_query, ai_answer)
+        )
+
+    whatsapp_logger.info('✅ AI answer sent and data inserted into MySQL')
+    # Od odebrania pierwszej wiadomości przez webhook - razem z oknem koalescencji i czekaniem w kolejce
+    received_at = min(message.get('received_at', time.time()) for message in messages)
+    metrics.observe("rag_stage_duration_seconds", time.time() - received_at, stage="end_to_end")
+
+
+def accept_message(incoming_message) -> bool:
+    """Returns False only when the message couldn't be queued and Meta should redeliver it."""
+    sender_phone_number = int(incoming_message.get("from"))
+    message_id = incoming_message.get('id')
+    deduplicator = get_deduplicator()
+
+    if deduplicator.seen(message_id):
+        return True
+
+    if incoming_message.get('type') != 'text':
+        whatsapp_logger.warn(f"⚠️ Received non-text message type: {incoming_message.get('type')}")
+        return True
+
+    user_query = incoming_message['text'].get('body')
+    whatsapp_logger.info(f'✅ Received message: {user_query} from {sender_phone_number}')
+
+    # Odpowiadamy od razu - wiadomość jest już w dzienniku, właściwe przetwarzanie dzieje się w sesji nadawcy
+    message = {'id': message_id, 'text': user_query, 'received_at': time.time()}
+    if not get_message_queue().submit({'sender': sender_phone_number, 'messages': [message]}):
+        deduplicator.forget(message_id)
+        return False
+    return True
 
-            else:
-                whatsapp_logger.warn(f"⚠️ Received non-text message type: {incoming_message.get('type')}")
 
+@webhook_bp.route('/webhook', methods=['POST'])
+async def webhook():
+    try:
+        data = await request.get_json()
+        all_accepted = True
+
+        # Meta potrafi wysłać kilka wpisów / zmian / wiadomości w jednym żądaniu - obsługujemy wszystkie
+        for entry in data['entry']:
+            for change in entry.get('changes', []):
+                main_request_body = change.get('value', {})
+
+                errors = main_request_body.get('errors')
+                statuses = main_request_body.get('statuses') or []
+                messages = main_request_body.get('messages') or []
+
+                if errors:
+                    whatsapp_logger.warn(f"⚙️ Request contained an errors field: \tErrors: {errors}")
+                for status in statuses:
+                    whatsapp_logger.info(f'⚙️ Message status: {status.get("status")}')
+                for incoming_message in messages:
+                    all_accepted = accept_message(incoming_message) and all_accepted
+
+        if not all_accepted:
+            # Przyjęte wiadomości zostaną przy ponownej dostawie odrzucone jako duplikaty
+            return '⏳', 503
         return '✅', 200
 
     except Exception as e:
@@ -8,14 +8,131 @@ COSMOSDB_CONNECTION_STRING = os.getenv("COSMOSDB_CONNECTION_STRING")
 DB_NAME = os.getenv("DB_NAME")
 COSMOS_COLLECTION_NAME = os.getenv("COSMOS_COLLECTION_NAME")
 
+# Vector Search Index Configuration
+VECTOR_INDEX_NAME = os.getenv("VECTOR_INDEX_NAME", "vectorSearchIndex")
+VECTOR_INDEX_KIND = os.getenv("VECTOR_INDEX_KIND", "vector-ivf")  # vector-ivf | vector-hnsw
+VECTOR_INDEX_SIMILARITY = os.getenv("VECTOR_INDEX_SIMILARITY", "COS")
+VECTOR_INDEX_DIMENSIONS = int(os.getenv("VECTOR_INDEX_DIMENSIONS", 1536))
+VECTOR_INDEX_NUM_LISTS = int(os.getenv("VECTOR_INDEX_NUM_LISTS", 1))  # IVF only
+VECTOR_INDEX_M = int(os.getenv("VECTOR_INDEX_M", 16))  # HNSW only
+VECTOR_INDEX_EF_CONSTRUCTION = int(os.getenv("VECTOR_INDEX_EF_CONSTRUCTION", 64))  # HNSW only
+VECTOR_SEARCH_EF_SEARCH = int(os.getenv("VECTOR_SEARCH_EF_SEARCH", 0))  # HNSW only, 0 = server default
+VECTOR_INDEX_RECHECK_INTERVAL = int(os.getenv("VECTOR_INDEX_RECHECK_INTERVAL", 3600))  # seconds, 0 = never
+# Ingestion also stores vectorPacked (float32 BSON binary); bulk reads use it instead of the array of doubles
+VECTOR_STORE_PACKED = os.getenv("VECTOR_STORE_PACKED", "true").lower() == "true"
+
+# Retrieval Backend Configuration
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "cosmos")  # cosmos | local
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "data/local_index")
+LOCAL_INDEX_REFRESH_INTERVAL = int(os.getenv("LOCAL_INDEX_REFRESH_INTERVAL", 300))  # seconds, 0 = only at startup
+LOCAL_INDEX_IVF_LISTS = int(os.getenv("LOCAL_INDEX_IVF_LISTS", 0))  # 0 = exact (brute force) search
+LOCAL_INDEX_IVF_PROBES = int(os.getenv("LOCAL_INDEX_IVF_PROBES", 8))
+LOCAL_INDEX_VECTOR_DTYPE = os.getenv("LOCAL_INDEX_VECTOR_DTYPE", "float32")  # float32 | float16 | int8
+LOCAL_INDEX_PCA_DIMENSIONS = int(os.getenv("LOCAL_INDEX_PCA_DIMENSIONS", 0))  # 0 = keep all dimensions
+
+# Lexical (BM25) Retrieval Configuration
+LEXICAL_ENABLED = os.getenv("LEXICAL_ENABLED", "true").lower() == "true"
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", "data/lexical_index")
+LEXICAL_REFRESH_INTERVAL = int(os.getenv("LEXICAL_REFRESH_INTERVAL", 300))  # seconds, 0 = only at startup
+LEXICAL_STEM_LENGTH = 6  # alphabetic tokens are cut to this many characters, 0 = no stemming
+LEXICAL_ONLY_MAX_TERMS = int(os.getenv("LEXICAL_ONLY_MAX_TERMS", 3))  # keyword queries up to this long skip embeddings
+RRF_K = 60  # reciprocal rank fusion constant
+
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPEN_AI_KEY")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o")  # answers; its tokenizer also counts the prompt budgets
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 256))  # inputs per request, the API accepts up to 2048
+
+# OpenAI Rate Limiting Configuration
+OPENAI_SCHEDULER_ENABLED = os.getenv("OPENAI_SCHEDULER_ENABLED", "true").lower() == "true"
+OPENAI_RPM_LIMIT = int(os.getenv("OPENAI_RPM_LIMIT", 0))  # requests per minute per model, 0 = learned from headers
+OPENAI_TPM_LIMIT = int(os.getenv("OPENAI_TPM_LIMIT", 0))  # tokens per minute per model, 0 = learned from headers
+OPENAI_CONCURRENCY_INITIAL = int(os.getenv("OPENAI_CONCURRENCY_INITIAL", 16))  # calls in flight per model (AIMD start)
+OPENAI_CONCURRENCY_MIN = int(os.getenv("OPENAI_CONCURRENCY_MIN", 2))
+OPENAI_CONCURRENCY_MAX = int(os.getenv("OPENAI_CONCURRENCY_MAX", 128))
+OPENAI_BACKGROUND_RESERVE = float(os.getenv("OPENAI_BACKGROUND_RESERVE", 0.2))  # quota share background work leaves free
+OPENAI_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("OPENAI_COMPLETION_TOKENS_ESTIMATE", 400))  # reserved per chat call
+OPENAI_CHAT_TIMEOUT = float(os.getenv("OPENAI_CHAT_TIMEOUT", 30))  # seconds, deadline incl. queueing and retries
+OPENAI_EMBEDDING_TIMEOUT = float(os.getenv("OPENAI_EMBEDDING_TIMEOUT", 10))  # query embeddings
+OPENAI_BACKGROUND_TIMEOUT = float(os.getenv("OPENAI_BACKGROUND_TIMEOUT", 300))  # ingestion batches
+OPENAI_MAX_ATTEMPTS = max(int(os.getenv("OPENAI_MAX_ATTEMPTS", 4)), 1)  # tries per call; 0 would mean no call at all
+
+# Embedding Cache Configuration
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))  # entries kept in memory, 0 = disabled
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", 7 * 24 * 3600))  # seconds, 0 = no expiry
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")  # SQLite file, unset = memory only
+
+# Semantic Answer Cache Configuration
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", 20000))
+# Cosine similarity; ada-002 scores different questions on one topic ("Azure migration price" vs "... timeline")
+# around 0.95-0.97, only rewordings of the same question (case, punctuation, typos, word order) reliably exceed 0.98
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.98))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", 24 * 3600))  # seconds, 0 = no expiry
+KNOWLEDGE_BASE_CHECK_INTERVAL = int(os.getenv("KNOWLEDGE_BASE_CHECK_INTERVAL", 300))  # seconds
+
+# Context Assembly Configuration
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))  # tokens of retrieved documents in the prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1500))  # tokens of chat history, oldest dropped first
+CONTEXT_DEDUP_THRESHOLD = 0.8  # share of a chunk's 5-grams already in a kept chunk to treat it as a duplicate
+
+# Knowledge Base Ingestion Configuration
+INGEST_CHUNK_WORDS = int(os.getenv("INGEST_CHUNK_WORDS", 300))
+INGEST_CHUNK_OVERLAP_WORDS = int(os.getenv("INGEST_CHUNK_OVERLAP_WORDS", 50))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 4))  # embedding batches in flight
+
+# Query Rewriting Configuration
+QUERY_REWRITE_MODE = os.getenv("QUERY_REWRITE_MODE", "heuristic")  # off | heuristic | model
+QUERY_REWRITE_MODEL = os.getenv("QUERY_REWRITE_MODEL", "gpt-4o-mini")  # used by the "model" mode
+QUERY_REWRITE_TIMEOUT = float(os.getenv("QUERY_REWRITE_TIMEOUT", 3))  # seconds, then the heuristic rewrite is used
+QUERY_REWRITE_MAX_TERMS = int(os.getenv("QUERY_REWRITE_MAX_TERMS", 6))  # key terms carried over from earlier turns
+QUERY_REWRITE_CACHE_SIZE = int(os.getenv("QUERY_REWRITE_CACHE_SIZE", 4096))  # memoized rewrites, 0 = disabled
+FOLLOW_UP_MAX_WORDS = 12  # longer questions count as follow-ups only when they open with a connector ("and", "a co")
+
+# Reranking Configuration
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "true").lower() == "true"
+RERANK_FETCH_MULTIPLIER = int(os.getenv("RERANK_FETCH_MULTIPLIER", 3))  # candidates fetched per returned result
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", 6))  # documents left for the prompt, 0 = as many as requested
+RERANK_MMR_LAMBDA = float(os.getenv("RERANK_MMR_LAMBDA", 0.7))  # 1 = relevance only, 0 = diversity only
+RERANK_BM25_WEIGHT = float(os.getenv("RERANK_BM25_WEIGHT", 0.0))  # share of BM25 in relevance, 0 = off
 
 # WhatsApp API Configuration
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
 META_ENDPOINT = os.getenv("META_ENDPOINT")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
 WEBHOOK_VERIFY_TOKEN = os.getenv("WEBHOOK_VERIFY_TOKEN")
+WHATSAPP_MAX_MESSAGE_CHARS = 4096
+WHATSAPP_POOL_LIMIT = int(os.getenv("WHATSAPP_POOL_LIMIT", 100))  # max open connections to the Graph API
+WHATSAPP_DNS_CACHE_TTL = 300  # seconds
+WHATSAPP_KEEPALIVE_TIMEOUT = 60  # seconds an idle connection is kept open
+WHATSAPP_REQUEST_TIMEOUT = float(os.getenv("WHATSAPP_REQUEST_TIMEOUT", 10))  # seconds per request
+WHATSAPP_CONNECT_TIMEOUT = 5
+WHATSAPP_MAX_RETRIES = int(os.getenv("WHATSAPP_MAX_RETRIES", 3))  # on 429 / 5xx / network errors
+WHATSAPP_BACKOFF_BASE = 0.5  # seconds, doubled with every attempt
+WHATSAPP_BACKOFF_MAX = 30
+
+# Response Streaming Configuration
+STREAM_MODE = os.getenv("STREAM_MODE", "off")  # off | chunks (several messages) | typing (typing indicator)
+STREAM_MIN_CHUNK_CHARS = int(os.getenv("STREAM_MIN_CHUNK_CHARS", 300))
+
+# Incoming Message Queue Configuration
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", 32))  # messages processed concurrently
+QUEUE_MAXSIZE = int(os.getenv("QUEUE_MAXSIZE", 1000))  # accepted but unprocessed messages before we answer 503
+QUEUE_JOURNAL_PATH = os.getenv("QUEUE_JOURNAL_PATH")  # SQLite file for crash safety, unset = memory only
+QUEUE_DRAIN_TIMEOUT = 30  # seconds to finish queued work on shutdown
+SESSION_MAILBOX_SIZE = int(os.getenv("SESSION_MAILBOX_SIZE", 20))  # queued jobs per sender before we answer 503
+SESSION_IDLE_TIMEOUT = int(os.getenv("SESSION_IDLE_TIMEOUT", 900))  # seconds an idle sender's session is kept
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", 0.3))  # seconds of silence before a sender's messages run, 0 = off
+COALESCE_MAX_WAIT = float(os.getenv("COALESCE_MAX_WAIT", 2))  # seconds, upper bound on the added delay
+
+# Webhook Deduplication Configuration
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", 24 * 3600))  # seconds a message ID is remembered in memory
+DEDUP_MAX_SIZE = int(os.getenv("DEDUP_MAX_SIZE", 100000))
+APP_INSTANCES = int(os.getenv("APP_INSTANCES", 1))  # service instances (replicas) sharing the MySQL database
+# Wspólna tabela processed_messages potrzebna tylko, gdy wiadomość może trafić do innego procesu;
+# src.server ustawia ją dla WEB_WORKERS > 1
+DEDUP_USE_MYSQL = os.getenv("DEDUP_USE_MYSQL", str(APP_INSTANCES > 1)).lower() == "true"
+DEDUP_MYSQL_RETENTION_DAYS = 7  # Meta retries failed deliveries for up to 7 days
 
 # Flask Configuration
 SECRET_KEY = os.getenv("SECRET_KEY")
@@ -26,11 +143,42 @@ MYSQL_PORT = os.getenv("MYSQL_PORT")
 MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
+MYSQL_READ_HOSTS = os.getenv("MYSQL_READ_HOSTS", "")  # comma separated host[:port] replicas, empty = MYSQL_HOST
+MYSQL_READ_POOLS = int(os.getenv("MYSQL_READ_POOLS", 3))
+MYSQL_WRITE_POOLS = int(os.getenv("MYSQL_WRITE_POOLS", 3))
 POOL_CONNECT_TIMEOUT = 10
-POOL_MIN_SIZE = 3
-POOL_MAX_SIZE = 5
+POOL_MIN_SIZE = int(os.getenv("POOL_MIN_SIZE", 3))
+POOL_MAX_SIZE = int(os.getenv("POOL_MAX_SIZE", 5))
 ACQUIRE_CONN_TIMEOUT = 5
+POOL_EJECT_AFTER = 3  # consecutive connection errors before a pool is taken out of rotation
+POOL_RECONNECT_INTERVAL = 5  # seconds, doubled after every failed reconnect
+POOL_RECONNECT_MAX_INTERVAL = 60
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 50))  # rows that trigger an immediate flush
+WRITE_FLUSH_INTERVAL_MS = int(os.getenv("WRITE_FLUSH_INTERVAL_MS", 200))
+WRITE_BUFFER_MAX_ROWS = 10000  # kept in memory while MySQL is unavailable
+
+# Chat History Configuration
+HISTORY_MAX_TURNS = 5  # query/answer pairs passed to the model
+HISTORY_TTL = 2 * 3600  # seconds, older turns are not part of the conversation anymore
+HISTORY_CACHE_ENABLED = os.getenv("HISTORY_CACHE_ENABLED", "true").lower() == "true"
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Metrics Configuration
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", 1024))  # recent samples per histogram used for p50 / p95 / p99
+OTEL_ENABLED = os.getenv("OTEL_ENABLED", "false").lower() == "true"  # needs opentelemetry-sdk + OTLP exporter
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "whatsapp-rag")
+
+# Logging Configuration
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json (one JSON object per line)
+LOG_QUEUE_ENABLED = os.getenv("LOG_QUEUE_ENABLED", "true").lower() == "true"  # handlers run on a background thread
 
 
 # Server Configuration
 PORT = int(os.getenv("PORT", 8080))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))  # worker processes for `python -m src.server`, 0 = one per CPU core;
+# more than 1 only behind a router that sends each sender to the same worker (per-sender state is per process)
+WEB_GRACEFUL_TIMEOUT = int(os.getenv("WEB_GRACEFUL_TIMEOUT", 40))  # seconds a worker gets to drain on shutdown
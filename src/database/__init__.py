@@ -1,3 +1,8 @@
 from .mongodb_client import MongoDBClient
+from .local_index import LocalVectorIndex
+from .lexical_index import LexicalIndex
+from .history_cache import ChatHistoryCache
+from .pool_manager import PoolManager
+from .retrievers import Retriever, CosmosRetriever, LocalRetriever, LexicalRetriever, create_retriever
 
-__all__ = ['MongoDBClient']
\ No newline at end of file
+__all__ = ['MongoDBClient', 'LocalVectorIndex', 'LexicalIndex', 'ChatHistoryCache', 'PoolManager', 'Retriever', 'CosmosRetriever', 'LocalRetriever', 'LexicalRetriever', 'create_retriever']
\ No newline at end of file
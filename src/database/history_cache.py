@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from src.config import HISTORY_MAX_TURNS, HISTORY_TTL, HISTORY_CACHE_MAX_BYTES
+
+
+def _turn_size(turn):
+    return len(turn["query"]) + len(turn["answer"]) + 64
+
+
+class ChatHistoryCache:
+    """
+    Per-sender ring buffer of the last `max_turns` query/answer pairs, filled when answers are
+    written and consulted before MySQL. An entry is only trusted (`complete`) after it has been
+    loaded from the database once; users are evicted least-recently-used first once the cached
+    text exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_turns=HISTORY_MAX_TURNS, ttl=HISTORY_TTL, max_bytes=HISTORY_CACHE_MAX_BYTES):
+        self.max_turns = max_turns
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, sender):
+        entry = self._users.pop(sender)
+        self.total_bytes -= entry["bytes"]
+
+    def _evict(self):
+        while self._users and self.total_bytes > self.max_bytes:
+            self._drop(next(iter(self._users)))
+
+    def _entry(self, sender, complete):
+        entry = self._users.get(sender)
+        if entry is None:
+            entry = {"turns": deque(), "complete": complete, "bytes": 0}
+            self._users[sender] = entry
+        self._users.move_to_end(sender)
+        return entry
+
+    def _push(self, entry, turn):
+        entry["turns"].appendleft(turn)
+        entry["bytes"] += _turn_size(turn)
+        self.total_bytes += _turn_size(turn)
+        while len(entry["turns"]) > self.max_turns:
+            removed = entry["turns"].pop()
+            entry["bytes"] -= _turn_size(removed)
+            self.total_bytes -= _turn_size(removed)
+
+    def get(self, sender):
+        """Newest-first history like get_recent_queries, or None when MySQL has to be asked."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(sender)
+            if entry is None or not entry["complete"]:
+                self.misses += 1
+                return None
+            self._users.move_to_end(sender)
+            history = [{"query": turn["query"], "answer": turn["answer"], "created_at": turn["created_at"]}
+                       for turn in entry["turns"] if turn["expires_at"] > now]
+            if not history:
+                # Rozmowa wygasła - nie trzymamy pustego wpisu, kolejna wiadomość zacznie od zera
+                entry["turns"].clear()
+                self.total_bytes -= entry["bytes"]
+                entry["bytes"] = 0
+            self.hits += 1
+            return history
+
+    def load(self, sender, history):
+        """Replaces the sender's turns with newest-first rows from the database."""
+        now = time.monotonic()
+        with self._lock:
+            if sender in self._users:
+                self._drop(sender)
+            entry = self._entry(sender, complete=True)
+            for row in reversed(history[:self.max_turns]):
+                age = row.get("age_seconds") or 0
+                self._push(entry, {"query": row["query"], "answer": row["answer"], "created_at": row["created_at"],
+                                   "expires_at": now + self.ttl - age})
+            self._evict()
+
+    def append(self, sender, query, answer):
+        with self._lock:
+            entry = self._entry(sender, complete=False)
+            self._push(entry, {"query": query, "answer": answer, "created_at": datetime.now().isoformat(),
+                               "expires_at": time.monotonic() + self.ttl})
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self._users),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
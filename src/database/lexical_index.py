@@ -0,0 +1,218 @@
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+import numpy as np
+from src.config import LEXICAL_INDEX_DIR, LEXICAL_STEM_LENGTH
+from src.database.local_index import SnapshotDirectory, document_metadata, decode_documents, encode_documents, \
+    latest_created_at, _encode_value, _decode_value
+from src.logger import cosmosdb_logger as logger
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Litery, których NFKD nie rozkłada na literę bazową + znak diakrytyczny
+_FOLD = str.maketrans({"ł": "l", "ø": "o", "ß": "ss", "đ": "d"})
+
+
+def fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower().translate(_FOLD))
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def tokenize(text: str, stem_length=LEXICAL_STEM_LENGTH) -> list:
+    """
+    Lowercased, diacritics folded ("Łódź" == "lodz"), purely alphabetic words cut to `stem_length`
+    characters - a crude stemmer that still matches Polish inflections ("Gliwice" / "Gliwicach").
+    Codes with digits are kept whole.
+    """
+    tokens = _TOKEN_RE.findall(fold(text or ""))
+    if stem_length:
+        tokens = [token[:stem_length] if token.isalpha() else token for token in tokens]
+    return tokens
+
+
+def bm25(freqs, lengths, average_length, document_frequency, document_count):
+    """BM25 weight of one term for documents with term frequencies `freqs` and token counts `lengths`."""
+    idf = math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+    norm = freqs + BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+    return idf * freqs * (BM25_K1 + 1) / norm
+
+
+def bm25_scores(question: str, documents: list) -> np.ndarray:
+    """
+    BM25 of the question against a handful of texts (rerank candidates) without an index; idf is taken
+    from those texts, enough to reorder them. Same tokenizer and weights as LexicalIndex.search.
+    """
+    scores = np.zeros(len(documents), dtype=np.float32)
+    query_terms = dict.fromkeys(tokenize(question))
+    if not query_terms or not documents:
+        return scores
+    counts = [Counter(tokenize(document)) for document in documents]
+    lengths = np.array([sum(count.values()) for count in counts], dtype=np.float32)
+    average_length = float(lengths.mean()) or 1.0
+    for term in query_terms:
+        freqs = np.array([count[term] for count in counts], dtype=np.float32)
+        document_frequency = np.count_nonzero(freqs)
+        if document_frequency:
+            scores += bm25(freqs, lengths, average_length, document_frequency, len(documents))
+    return scores
+
+
+def build_postings(tokenized_documents, vocabulary, first_doc_id=0):
+    """(term_ids, doc_ids, freqs) triples for the documents; new terms are added to `vocabulary`."""
+    term_ids, doc_ids, freqs = [], [], []
+    for offset, tokens in enumerate(tokenized_documents):
+        counts = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token, count in counts.items():
+            term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+            doc_ids.append(first_doc_id + offset)
+            freqs.append(count)
+    return (np.asarray(term_ids, dtype=np.int32), np.asarray(doc_ids, dtype=np.int32),
+            np.asarray(freqs, dtype=np.int32))
+
+
+def to_csr(term_ids, doc_ids, freqs, vocabulary_size):
+    """Sorts the triples by term and returns CSR postings: offsets[t]:offsets[t + 1] slices doc_ids / freqs."""
+    order = np.lexsort((doc_ids, term_ids))
+    offsets = np.searchsorted(term_ids[order], np.arange(vocabulary_size + 1)).astype(np.int64)
+    return offsets, doc_ids[order], np.minimum(freqs[order], np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+class LexicalIndex(SnapshotDirectory):
+    """
+    BM25 inverted index over the same collection as the vector index. Postings are flat numpy arrays
+    (CSR layout: offsets / doc ids / term frequencies) saved as .npy and memory-mapped by every worker.
+    Refreshes tokenize only documents newer than the watermark and merge them into the existing arrays.
+    """
+
+    def __init__(self, directory=LEXICAL_INDEX_DIR):
+        super().__init__(directory)
+        self.watermark = None
+        self.documents = []
+        self.vocabulary = {}
+        self.offsets = None
+        self.doc_ids = None
+        self.freqs = None
+        self.lengths = None
+        self.average_length = 1.0
+
+    @property
+    def size(self):
+        return len(self.documents)
+
+    def load(self):
+        """Maps the newest snapshot from disk. Returns True when a new generation was loaded."""
+        manifest = self._read_manifest()
+        if manifest is None or manifest["generation"] == self.generation:
+            return False
+        generation = manifest["generation"]
+        with open(self._path(f"documents-{generation}.json"), encoding="utf-8") as f:
+            documents = decode_documents(json.load(f))
+        with open(self._path(f"vocabulary-{generation}.json"), encoding="utf-8") as f:
+            vocabulary = json.load(f)
+        self.offsets = np.load(self._path(f"offsets-{generation}.npy"), mmap_mode="r")
+        self.doc_ids = np.load(self._path(f"postings-{generation}.npy"), mmap_mode="r")
+        self.freqs = np.load(self._path(f"freqs-{generation}.npy"), mmap_mode="r")
+        self.lengths = np.load(self._path(f"lengths-{generation}.npy"))
+        self.average_length = float(self.lengths.mean()) if len(self.lengths) else 1.0
+        self.documents = documents
+        self.vocabulary = vocabulary
+        self.watermark = _decode_value(manifest.get("watermark"))
+        self.generation = generation
+        logger.info(f"🔤 Lexical index generation {generation} loaded ({len(documents)} documents, "
+                    f"{len(vocabulary)} terms)")
+        return True
+
+    def _write_snapshot(self, metadata, vocabulary, triples, lengths, watermark):
+        generation = self._next_generation()
+        offsets, doc_ids, freqs = to_csr(*triples, len(vocabulary))
+        np.save(self._path(f"offsets-{generation}.npy"), offsets)
+        np.save(self._path(f"postings-{generation}.npy"), doc_ids)
+        np.save(self._path(f"freqs-{generation}.npy"), freqs)
+        np.save(self._path(f"lengths-{generation}.npy"), lengths)
+        with open(self._path(f"documents-{generation}.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        with open(self._path(f"vocabulary-{generation}.json"), "w", encoding="utf-8") as f:
+            json.dump(vocabulary, f, ensure_ascii=False)
+        self._write_manifest({"generation": generation, "size": len(metadata), "terms": len(vocabulary),
+                              "watermark": _encode_value(watermark)})
+
+    @staticmethod
+    def _tokenize_documents(documents):
+        tokenized = [tokenize(f"{document.get('title') or ''} {document.get('content') or ''}")
+                     for document in documents]
+        return tokenized, np.asarray([len(tokens) for tokens in tokenized], dtype=np.int32)
+
+    def _build(self, documents):
+        vocabulary = {}
+        tokenized, lengths = self._tokenize_documents(documents)
+        return document_metadata(documents), vocabulary, build_postings(tokenized, vocabulary), lengths
+
+    def _existing_triples(self):
+        term_ids = np.repeat(np.arange(len(self.vocabulary), dtype=np.int32), np.diff(self.offsets))
+        return term_ids, np.asarray(self.doc_ids, dtype=np.int32), np.asarray(self.freqs, dtype=np.int32)
+
+    def refresh(self, mongodb_client):
+        """Indexes documents newer than the snapshot watermark; rebuilds from scratch when counts disagree."""
+        with self._locked():
+            self.load()
+            if self.generation is None:
+                documents = mongodb_client.fetch_documents(include_vectors=False)
+                metadata, vocabulary, triples, lengths = self._build(documents)
+                watermark = latest_created_at(documents)
+            else:
+                documents = mongodb_client.fetch_documents(since=self.watermark, include_vectors=False)
+                total = mongodb_client.count_documents()
+                if not documents and total == self.size:
+                    return False
+                if total == self.size + len(documents):
+                    # Stare dokumenty nie są ponownie tokenizowane - dokładamy tylko nowe postingi
+                    vocabulary = dict(self.vocabulary)
+                    tokenized, new_lengths = self._tokenize_documents(documents)
+                    new_triples = build_postings(tokenized, vocabulary, first_doc_id=self.size)
+                    triples = tuple(np.concatenate(pair) for pair in zip(self._existing_triples(), new_triples))
+                    metadata = encode_documents(self.documents) + document_metadata(documents)
+                    lengths = np.concatenate([self.lengths, new_lengths])
+                    watermark = latest_created_at(documents, self.watermark)
+                else:
+                    logger.info(f"🔤 Lexical index out of sync ({self.size} + {len(documents)} != {total}), "
+                                f"rebuilding")
+                    documents = mongodb_client.fetch_documents(include_vectors=False)
+                    metadata, vocabulary, triples, lengths = self._build(documents)
+                    watermark = latest_created_at(documents)
+            self._write_snapshot(metadata, vocabulary, triples, lengths, watermark)
+        return self.load()
+
+    def query_terms(self, question):
+        return [self.vocabulary[token] for token in dict.fromkeys(tokenize(question)) if token in self.vocabulary]
+
+    def search(self, question, num_results=10):
+        if self.size == 0:
+            return []
+        terms = self.query_terms(question)
+        if not terms:
+            return []
+        scores = np.zeros(self.size, dtype=np.float32)
+        matched = np.zeros(self.size, dtype=np.int16)
+        for term in terms:
+            start, end = int(self.offsets[term]), int(self.offsets[term + 1])
+            doc_ids = np.asarray(self.doc_ids[start:end])
+            freqs = np.asarray(self.freqs[start:end], dtype=np.float32)
+            scores[doc_ids] += bm25(freqs, self.lengths[doc_ids], self.average_length, len(doc_ids), self.size)
+            matched[doc_ids] += 1
+
+        hits = np.flatnonzero(scores)
+        k = min(num_results, len(hits))
+        top = hits[np.argpartition(-scores[hits], k - 1)[:k]] if k < len(hits) else hits
+        top = top[np.argsort(-scores[top], kind="stable")]
+        results = []
+        for doc_id in top:
+            document = dict(self.documents[int(doc_id)])
+            document["lexicalScore"] = float(scores[doc_id])
+            document["matchedTerms"] = int(matched[doc_id])
+            results.append(document)
+        return results
@@ -0,0 +1,324 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+from src.config import LOCAL_INDEX_DIR, LOCAL_INDEX_IVF_LISTS, LOCAL_INDEX_IVF_PROBES, LOCAL_INDEX_VECTOR_DTYPE, \
+    LOCAL_INDEX_PCA_DIMENSIONS
+from src.database.vectors import VectorCodec, as_float32, normalize_rows
+from src.logger import cosmosdb_logger as logger
+
+try:
+    import fcntl
+except ImportError:  # Windows - no cross-process lock, single worker only
+    fcntl = None
+
+MANIFEST_FILE = "manifest.json"
+LOCK_FILE = ".lock"
+KMEANS_ITERATIONS = 10
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def split_documents(documents):
+    """Separates the raw Mongo documents into a normalized float32 matrix and JSON-safe metadata."""
+    if not documents:
+        return np.zeros((0, 0), dtype=np.float32), []
+    vectors = np.stack([as_float32(document["vector"]) for document in documents])
+    return normalize_rows(vectors)[0], document_metadata(documents)
+
+
+def document_metadata(documents):
+    """JSON-safe copies of the fields that end up in the prompt."""
+    metadata = []
+    for document in documents:
+        content = document.get("content", "")
+        metadata.append({
+            "_id": _encode_value(document.get("_id")),
+            "title": document.get("title"),
+            "pageNumber": document.get("pageNumber"),
+            "content": content,
+            "createdAt": _encode_value(document.get("createdAt")),
+            "wordCount": document.get("wordCount", len(content.split(" "))),
+        })
+    return metadata
+
+
+def decode_documents(documents):
+    return [{key: _decode_value(value) for key, value in document.items()} for document in documents]
+
+
+def encode_documents(documents):
+    return [{key: _encode_value(value) for key, value in document.items()} for document in documents]
+
+
+def latest_created_at(documents, current=None):
+    dates = [document["createdAt"] for document in documents if isinstance(document.get("createdAt"), datetime)]
+    if current is not None:
+        dates.append(current)
+    return max(dates, default=None)
+
+
+def build_ivf(vectors, num_lists):
+    # Prosty k-means na znormalizowanych wektorach (cosinus) - wystarczy dla kilkudziesięciu tysięcy chunków
+    rng = np.random.default_rng(0)
+    centroids = vectors[rng.choice(len(vectors), num_lists, replace=False)].copy()
+    assignments = np.zeros(len(vectors), dtype=np.int32)
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(vectors @ centroids.T, axis=1).astype(np.int32)
+        for list_id in range(num_lists):
+            members = vectors[assignments == list_id]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[list_id] = centroid / (np.linalg.norm(centroid) or 1)
+    order = np.argsort(assignments, kind="stable").astype(np.int32)
+    offsets = np.searchsorted(assignments[order], np.arange(num_lists + 1)).astype(np.int32)
+    return centroids, order, offsets
+
+
+class SnapshotDirectory:
+    """
+    Generation-numbered snapshot files plus a manifest that is swapped atomically. Readers map the
+    generation named in the manifest; writers take a cross-process lock, so one worker rebuilds at a time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.generation = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self):
+        with open(self._path(LOCK_FILE), "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_manifest(self):
+        try:
+            with open(self._path(MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _next_generation(self):
+        return max(int(time.time() * 1000), (self.generation or 0) + 1)
+
+    def _write_manifest(self, manifest):
+        tmp_path = self._path(MANIFEST_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path(MANIFEST_FILE))
+        self._remove_old_generations(manifest["generation"])
+
+    def _remove_old_generations(self, current):
+        # Inne procesy mogą mieć stare pliki zmapowane - na Linuksie usunięcie ich nie unieważnia
+        for name in os.listdir(self.directory):
+            stem = name.rsplit(".", 1)[0]
+            generation = stem.rsplit("-", 1)[-1]
+            if generation.isdigit() and int(generation) != current:
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+
+class LocalVectorIndex(SnapshotDirectory):
+    """
+    In-memory copy of the Cosmos collection used for vector search without a network hop.
+    Vectors are stored as a .npy snapshot (float32, float16 or int8 codes, optionally PCA-reduced -
+    see VectorCodec) and memory-mapped, so several workers reading the same directory share one copy
+    in the page cache. Cosmos stays the source of truth.
+    """
+
+    def __init__(self, directory=LOCAL_INDEX_DIR, ivf_lists=LOCAL_INDEX_IVF_LISTS, ivf_probes=LOCAL_INDEX_IVF_PROBES,
+                 dtype=LOCAL_INDEX_VECTOR_DTYPE, pca_dimensions=LOCAL_INDEX_PCA_DIMENSIONS):
+        super().__init__(directory)
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.dtype = dtype
+        self.pca_dimensions = pca_dimensions
+        self.watermark = None
+        self.codec = None
+        self.vectors = None
+        self.factors = None
+        self.documents = []
+        self.centroids = None
+        self.ivf_order = None
+        self.ivf_offsets = None
+
+    @property
+    def size(self):
+        return len(self.documents)
+
+    @property
+    def memory_bytes(self):
+        """Size of the vector codes and per-row factors (what the workers share through the page cache)."""
+        if self.vectors is None:
+            return 0
+        return self.vectors.nbytes + self.factors.nbytes
+
+    def load(self):
+        """Maps the newest snapshot from disk. Returns True when a new generation was loaded."""
+        manifest = self._read_manifest()
+        if manifest is None or manifest["generation"] == self.generation:
+            return False
+        generation = manifest["generation"]
+        vectors = np.load(self._path(f"vectors-{generation}.npy"), mmap_mode="r")
+        if "dtype" in manifest:
+            factors = np.load(self._path(f"factors-{generation}.npy"))
+        else:
+            # Snapshot sprzed kodeka: znormalizowane wektory float32
+            factors = np.ones(len(vectors), dtype=np.float32)
+        codec = VectorCodec(manifest.get("dtype", "float32"))
+        if manifest.get("pca_dimensions"):
+            codec.components = np.load(self._path(f"pca-components-{generation}.npy"))
+            codec.mean = np.load(self._path(f"pca-mean-{generation}.npy"))
+        with open(self._path(f"documents-{generation}.json"), encoding="utf-8") as f:
+            documents = decode_documents(json.load(f))
+        if manifest.get("ivf_lists"):
+            self.centroids = np.load(self._path(f"centroids-{generation}.npy"))
+            self.ivf_order = np.load(self._path(f"ivf-order-{generation}.npy"), mmap_mode="r")
+            self.ivf_offsets = np.load(self._path(f"ivf-offsets-{generation}.npy"))
+        else:
+            self.centroids = self.ivf_order = self.ivf_offsets = None
+        self.codec = codec
+        self.vectors = vectors
+        self.factors = factors
+        self.documents = documents
+        self.watermark = _decode_value(manifest.get("watermark"))
+        self.generation = generation
+        logger.info(f"🧭 Local vector index generation {generation} loaded ({len(documents)} documents, "
+                    f"{codec.dtype}, {self.memory_bytes / 2 ** 20:.1f} MiB)")
+        return True
+
+    def _codec_matches(self):
+        return self.codec is not None and self.codec.dtype == self.dtype \
+            and (self.codec.dimensions or 0) == (self.pca_dimensions or 0)
+
+    def _write_snapshot(self, codec, codes, factors, documents, watermark):
+        generation = self._next_generation()
+        np.save(self._path(f"vectors-{generation}.npy"), codes)
+        np.save(self._path(f"factors-{generation}.npy"), factors)
+        if codec.components is not None:
+            np.save(self._path(f"pca-components-{generation}.npy"), codec.components)
+            np.save(self._path(f"pca-mean-{generation}.npy"), codec.mean)
+        with open(self._path(f"documents-{generation}.json"), "w", encoding="utf-8") as f:
+            json.dump(documents, f, ensure_ascii=False)
+        ivf_lists = self.ivf_lists if 0 < self.ivf_lists < len(codes) else 0
+        if ivf_lists:
+            # Centroidy liczone na zdekodowanych wektorach - w tej samej przestrzeni, co zapytania po project()
+            centroids, order, offsets = build_ivf(codec.decode(codes, factors), ivf_lists)
+            np.save(self._path(f"centroids-{generation}.npy"), centroids)
+            np.save(self._path(f"ivf-order-{generation}.npy"), order)
+            np.save(self._path(f"ivf-offsets-{generation}.npy"), offsets)
+
+        self._write_manifest({"generation": generation, "size": len(documents),
+                              "watermark": _encode_value(watermark), "ivf_lists": ivf_lists,
+                              "dtype": codec.dtype, "pca_dimensions": codec.dimensions or 0})
+
+    def _encode_snapshot(self, documents):
+        """Full rebuild: fits a fresh codec (PCA basis) on the whole collection."""
+        vectors, metadata = split_documents(documents)
+        codec = VectorCodec.fit(vectors, self.dtype, self.pca_dimensions) if len(vectors) \
+            else VectorCodec(self.dtype)
+        codes, factors = codec.encode(codec.project(vectors)) if len(vectors) \
+            else (vectors, np.zeros(0, dtype=np.float32))
+        return codec, codes, factors, metadata
+
+    def refresh(self, mongodb_client):
+        """Pulls documents newer than the snapshot watermark and writes a new generation if anything changed."""
+        with self._locked():
+            # Inny worker mógł już odświeżyć snapshot - zaczynamy od najnowszej generacji z dysku
+            self.load()
+            if self.generation is None or not self._codec_matches():
+                # Brak snapshotu albo zmieniony LOCAL_INDEX_VECTOR_DTYPE / LOCAL_INDEX_PCA_DIMENSIONS
+                documents = mongodb_client.fetch_documents()
+                codec, codes, factors, metadata = self._encode_snapshot(documents)
+                watermark = latest_created_at(documents)
+            else:
+                documents = mongodb_client.fetch_documents(since=self.watermark)
+                total = mongodb_client.count_documents()
+                if not documents and total == self.size:
+                    return False
+                if self.size and total == self.size + len(documents):
+                    # Nowe dokumenty kodujemy istniejącym kodekiem (ta sama baza PCA), stare kody zostają bez zmian
+                    codec = self.codec
+                    new_vectors, new_metadata = split_documents(documents)
+                    new_codes, new_factors = codec.encode(codec.project(new_vectors))
+                    codes = np.concatenate([np.asarray(self.vectors), new_codes])
+                    factors = np.concatenate([self.factors, new_factors])
+                    metadata = encode_documents(self.documents) + new_metadata
+                    watermark = latest_created_at(documents, self.watermark)
+                else:
+                    # Coś zostało usunięte albo nie ma createdAt - tylko pełny snapshot da spójny stan
+                    logger.info(f"🧭 Local index out of sync ({self.size} + {len(documents)} != {total}), "
+                                f"rebuilding")
+                    documents = mongodb_client.fetch_documents()
+                    codec, codes, factors, metadata = self._encode_snapshot(documents)
+                    watermark = latest_created_at(documents)
+            self._write_snapshot(codec, codes, factors, metadata, watermark)
+        return self.load()
+
+    def _candidates(self, query):
+        if self.centroids is None:
+            return None
+        probes = min(self.ivf_probes, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+        return np.concatenate([self.ivf_order[self.ivf_offsets[i]:self.ivf_offsets[i + 1]] for i in lists])
+
+    def _top_k(self, scores, indices, num_results, include_vectors=False):
+        k = min(num_results, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for position in top:
+            row = int(indices[position]) if indices is not None else int(position)
+            document = dict(self.documents[row])
+            document["similarityScore"] = float(scores[position])
+            if include_vectors:
+                document["vector"] = self.codec.decode(self.vectors[row:row + 1], self.factors[row:row + 1])[0]
+            results.append(document)
+        return results
+
+    def search_batch(self, query_embeddings, num_results=10, include_vectors=False):
+        if self.vectors is None or self.size == 0:
+            return [[] for _ in query_embeddings]
+        queries = self.codec.project(np.stack([as_float32(query) for query in query_embeddings]))
+
+        if self.centroids is None:
+            # (q, n) - jedno mnożenie macierzy dla całej paczki zapytań, normy wierszy policzone przy zapisie
+            scores = self.codec.scores(self.vectors, self.factors, queries)
+            return [self._top_k(row, None, num_results, include_vectors) for row in scores]
+
+        results = []
+        for query in queries:
+            candidates = self._candidates(query)
+            scores = self.codec.scores(self.vectors[candidates], self.factors[candidates], query[None, :])[0]
+            results.append(self._top_k(scores, candidates, num_results, include_vectors))
+        return results
+
+    def search(self, query_embedding, num_results=10, include_vectors=False):
+        return self.search_batch([query_embedding], num_results, include_vectors)[0]
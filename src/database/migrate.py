@@ -0,0 +1,43 @@
+import argparse
+import asyncio
+import json
+from src.config import DEDUP_USE_MYSQL
+from src.database import mysql_queries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply the schema changes the application expects to MySQL. "
+                                                 "Run it once per database before deploying; the server only "
+                                                 "checks the schema at startup.")
+    parser.add_argument("--check", action="store_true", help="only report what is missing")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    if not await mysql_queries.write_pools.start():
+        raise SystemExit("❌ No healthy write pool - check the MySQL settings.")
+    try:
+        if args.check:
+            stats = {"users_unique_key": await mysql_queries.check_users_unique_key()}
+            if DEDUP_USE_MYSQL:
+                await mysql_queries.create_processed_messages_table()
+                stats["processed_messages_claimed_by"] = mysql_queries.claim_tokens
+        else:
+            migrations = {"users_unique_key": mysql_queries.add_users_unique_key}
+            if DEDUP_USE_MYSQL:
+                migrations["processed_messages_claimed_by"] = mysql_queries.add_claim_token_column
+                await mysql_queries.create_processed_messages_table()
+            stats = {}
+            for name, migration in migrations.items():
+                added = await migration()
+                if added is None:
+                    raise SystemExit(f"❌ Migration {name} failed, see the log above.")
+                stats[name] = "added" if added else "present"
+    finally:
+        await mysql_queries.write_pools.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
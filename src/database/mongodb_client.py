@@ -1,7 +1,132 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from pymongo.errors import ConnectionFailure
+from motor.motor_asyncio import AsyncIOMotorClient
+import hashlib
+import json
 import logging
-from src.config import COSMOSDB_CONNECTION_STRING, DB_NAME, COSMOS_COLLECTION_NAME
+import threading
+import time
+from src.config import COSMOSDB_CONNECTION_STRING, DB_NAME, COSMOS_COLLECTION_NAME, VECTOR_INDEX_NAME, \
+    VECTOR_INDEX_KIND, VECTOR_INDEX_SIMILARITY, VECTOR_INDEX_DIMENSIONS, VECTOR_INDEX_NUM_LISTS, VECTOR_INDEX_M, \
+    VECTOR_INDEX_EF_CONSTRUCTION, VECTOR_SEARCH_EF_SEARCH, VECTOR_INDEX_RECHECK_INTERVAL, VECTOR_STORE_PACKED
+from src.database.vectors import as_float32, pack_vector, unpack_vector
+
+PACKED_VECTOR_FIELD = "vectorPacked"
+
+
+def build_vector_index_options():
+    options = {
+        "kind": VECTOR_INDEX_KIND,
+        "similarity": VECTOR_INDEX_SIMILARITY,
+        "dimensions": VECTOR_INDEX_DIMENSIONS
+    }
+    if VECTOR_INDEX_KIND == "vector-hnsw":
+        options["m"] = VECTOR_INDEX_M
+        options["efConstruction"] = VECTOR_INDEX_EF_CONSTRUCTION
+    else:
+        options["numLists"] = VECTOR_INDEX_NUM_LISTS
+    return options
+
+
+def build_vector_search_pipeline(query_embedding, num_results=10, include_vectors=False):
+    k = int(num_results)
+    cosmos_search = {
+        "vector": as_float32(query_embedding).tolist(),
+        "path": "vector",
+        "k": k
+    }
+    if VECTOR_INDEX_KIND == "vector-hnsw" and VECTOR_SEARCH_EF_SEARCH:
+        cosmos_search["efSearch"] = VECTOR_SEARCH_EF_SEARCH
+    projection = {
+        "similarityScore": {"$meta": "searchScore"},
+        "content": 1,
+        "_id": 1,
+        "title": 1,
+        "pageNumber": 1,
+        "createdAt": 1,
+        "wordCount": 1
+    }
+    if include_vectors:
+        # Wektory potrzebne tylko do reorderingu (MMR) - domyślnie ich nie przesyłamy
+        projection[PACKED_VECTOR_FIELD if VECTOR_STORE_PACKED else "vector"] = 1
+    return [
+        {
+            "$search": {
+                "cosmosSearch": cosmos_search
+            }
+        },
+        {
+            "$project": projection
+        }
+    ]
+
+
+def fill_word_counts(results):
+    # wordCount liczony jest przy ingestii - dla starszych dokumentów bez tego pola liczymy go tutaj
+    for result in results:
+        if result.get("wordCount") is None:
+            result["wordCount"] = len((result.get("content") or "").split(" "))
+    return results
+
+
+def vector_fields(vector) -> dict:
+    """Fields stored for one embedding: the double array Cosmos indexes and, optionally, its packed copy."""
+    vector = as_float32(vector)
+    fields = {"vector": vector.tolist()}
+    if VECTOR_STORE_PACKED:
+        fields[PACKED_VECTOR_FIELD] = pack_vector(vector)
+    return fields
+
+
+def unpack_vectors(results):
+    """vectorPacked (BSON binary) -> float32 array under "vector", the field the rest of the code reads."""
+    for result in results:
+        packed = result.pop(PACKED_VECTOR_FIELD, None)
+        if packed is not None:
+            result["vector"] = unpack_vector(packed)
+    return results
+
+
+class VectorIndexState:
+    """Cached knowledge about the vector search index, so the hot path doesn't have to ask Cosmos every time."""
+
+    def __init__(self, name, options, recheck_interval=VECTOR_INDEX_RECHECK_INTERVAL):
+        self.name = name
+        self.options = options
+        self.fingerprint = hashlib.sha1(json.dumps(options, sort_keys=True).encode()).hexdigest()[:12]
+        self.recheck_interval = recheck_interval
+        self.version = 0
+        self.ready = False
+        self.checked_at = 0.0
+
+    def is_stale(self):
+        if not self.ready:
+            return True
+        return self.recheck_interval > 0 and time.monotonic() - self.checked_at >= self.recheck_interval
+
+    def mark_ready(self, created=False):
+        if created or self.version == 0:
+            self.version += 1
+        self.ready = True
+        self.checked_at = time.monotonic()
+
+    def invalidate(self):
+        self.ready = False
+
+    def check_existing(self, existing_indexes):
+        for index in existing_indexes:
+            if index["name"] != self.name:
+                continue
+            existing_options = index.get("cosmosSearchOptions")
+            if existing_options and dict(existing_options) != self.options:
+                logging.warning(f"Vector search index {self.name} exists with different options "
+                                f"{dict(existing_options)}; configured options {self.options} are not applied "
+                                f"until the index is dropped")
+            return True
+        return False
+
+    def describe(self):
+        return f"{self.name} v{self.version} ({self.options['kind']}, {self.fingerprint})"
 
 
 class MongoDBClient:
@@ -19,9 +144,19 @@ class MongoDBClient:
         self.client = None
         self.db = None
         self.collection = None
+        self.async_client = None
+        self.async_db = None
+        self.async_collection = None
+        self.index_state = VectorIndexState(VECTOR_INDEX_NAME, build_vector_index_options())
+        # Przy starcie indeksy lokalne odświeżane są równolegle w wątkach - jedno połączenie dla wszystkich
+        self._connect_lock = threading.Lock()
         self.__initialized = True
 
     def connect(self):
+        with self._connect_lock:
+            self._connect()
+
+    def _connect(self):
         if self.client is None:
             try:
                 self.client = MongoClient(COSMOSDB_CONNECTION_STRING)
@@ -33,66 +168,142 @@ class MongoDBClient:
                 logging.error(f"Could not connect to MongoDB due to: {e}")
                 raise ConnectionError("Failed to connect to MongoDB.") from e
 
+    async def aconnect(self):
+        if self.async_client is None:
+            try:
+                self.async_client = AsyncIOMotorClient(COSMOSDB_CONNECTION_STRING)
+                await self.async_client.admin.command("ismaster")
+                self.async_db = self.async_client[DB_NAME]
+                self.async_collection = self.async_db[COSMOS_COLLECTION_NAME]
+                logging.info("Async MongoDB connection established successfully.")
+            except ConnectionFailure as e:
+                self.async_client = None
+                logging.error(f"Could not connect to MongoDB (async) due to: {e}")
+                raise ConnectionError("Failed to connect to MongoDB.") from e
+
     def ensure_connection(self):
         if self.client is None or self.db is None or self.collection is None:
             self.connect()
 
-    def ensure_vector_search_index(self):
-        self.ensure_connection()
+    async def aensure_connection(self):
+        if self.async_client is None or self.async_db is None or self.async_collection is None:
+            await self.aconnect()
+
+    async def aensure_vector_search_index(self, force=False):
+        if not force and not self.index_state.is_stale():
+            return
+        await self.aensure_connection()
         try:
-            index_name = "vectorSearchIndex"
-            existing_indexes = list(self.collection.list_indexes())
-            if any(index["name"] == index_name for index in existing_indexes):
-                logging.info(f"Vector search index {index_name} already exists")
+            index_name = self.index_state.name
+            existing_indexes = await self.async_collection.list_indexes().to_list(length=None)
+            if self.index_state.check_existing(existing_indexes):
+                self.index_state.mark_ready()
+                logging.info(f"Vector search index {self.index_state.describe()} already exists")
                 return
 
-            self.collection.create_index(
+            await self.async_collection.create_index(
                 [("vector", "cosmosSearch")],
                 name=index_name,
-                cosmosSearchOptions={
-                    "kind": "vector-ivf",
-                    "numLists": 1,
-                    "similarity": "COS",
-                    "dimensions": 1536
-                }
+                cosmosSearchOptions=self.index_state.options
             )
-            logging.info(f"Index {index_name} created successfully")
+            self.index_state.mark_ready(created=True)
+            logging.info(f"Index {self.index_state.describe()} created successfully")
         except Exception as e:
+            self.index_state.invalidate()
             logging.error(f"Error creating vector search index: {e}", exc_info=True)
             raise
 
-    def vector_search(self, query_embedding, num_results=10):
-        self.ensure_connection()
+    async def avector_search(self, query_embedding, num_results=10, include_vectors=False):
+        await self.aensure_connection()
         try:
-            k = int(num_results)
-            results = self.collection.aggregate([
-                {
-                    "$search": {
-                        "cosmosSearch": {
-                            "vector": query_embedding,
-                            "path": "vector",
-                            "k": k
-                        }
-                    }
-                },
-                {
-                    "$project": {
-                        "similarityScore": {"$meta": "searchScore"},
-                        "content": 1,
-                        "_id": 1,
-                        "title": 1,
-                        "pageNumber": 1,
-                        "createdAt": 1,
-                        "wordCount": {"$size": {"$split": ["$content", " "]}}
-                    }
-                }
-            ])
-
-            return list(results)
+            cursor = self.async_collection.aggregate(build_vector_search_pipeline(query_embedding, num_results,
+                                                                                  include_vectors))
+            return unpack_vectors(fill_word_counts(await cursor.to_list(length=None)))
         except Exception as e:
+            # Index could have been dropped or never created - verify it again on the next query
+            self.index_state.invalidate()
             logging.error(f"Vector search operation failed: {e}", exc_info=True)
             return []
 
+    def fetch_documents(self, since=None, include_vectors=True):
+        self.ensure_connection()
+        query = {"createdAt": {"$gt": since}} if since is not None else {}
+        projection = {"content": 1, "title": 1, "pageNumber": 1, "createdAt": 1, "wordCount": 1}
+        if not include_vectors:
+            return list(self.collection.find(query, projection))
+        if not VECTOR_STORE_PACKED:
+            return list(self.collection.find(query, {**projection, "vector": 1}))
+
+        # ~6 KB zamiast ~21 KB tablicy double na wektor; dokumenty sprzed vectorPacked doczytujemy osobno
+        documents = list(self.collection.find(query, {**projection, PACKED_VECTOR_FIELD: 1}))
+        missing = [document["_id"] for document in documents if PACKED_VECTOR_FIELD not in document]
+        if missing:
+            vectors = {document["_id"]: document["vector"]
+                       for document in self.collection.find({"_id": {"$in": missing}}, {"vector": 1})}
+            for document in documents:
+                if document["_id"] in vectors:
+                    document["vector"] = vectors[document["_id"]]
+        return unpack_vectors(documents)
+
+    async def abackfill_packed_vectors(self, batch_size=500):
+        """Adds vectorPacked to documents ingested before it existed. Returns the number of updated documents."""
+        await self.aensure_connection()
+        updated = 0
+        operations = []
+        async for document in self.async_collection.find({PACKED_VECTOR_FIELD: {"$exists": False}}, {"vector": 1}):
+            if document.get("vector") is None:
+                continue
+            operations.append(UpdateOne({"_id": document["_id"]},
+                                        {"$set": {PACKED_VECTOR_FIELD: pack_vector(document["vector"])}}))
+            if len(operations) >= batch_size:
+                updated += (await self.async_collection.bulk_write(operations, ordered=False)).modified_count
+                operations = []
+        if operations:
+            updated += (await self.async_collection.bulk_write(operations, ordered=False)).modified_count
+        return updated
+
+    async def aensure_content_hash_index(self):
+        await self.aensure_connection()
+        await self.async_collection.create_index("contentHash", name="contentHash_1")
+
+    async def afind_content_hashes(self, hashes):
+        await self.aensure_connection()
+        cursor = self.async_collection.find({"contentHash": {"$in": list(hashes)}}, {"contentHash": 1, "_id": 0})
+        return {document["contentHash"] async for document in cursor}
+
+    async def abulk_upsert_documents(self, documents):
+        """Inserts documents keyed by contentHash; ones that already exist are left untouched."""
+        await self.aensure_connection()
+        operations = [UpdateOne({"contentHash": document["contentHash"]}, {"$setOnInsert": document}, upsert=True)
+                      for document in documents]
+        if not operations:
+            return 0
+        result = await self.async_collection.bulk_write(operations, ordered=False)
+        return result.upserted_count
+
+    async def adelete_stale_documents(self, sources, keep_hashes):
+        """Removes chunks of re-ingested sources whose content no longer exists in the source file."""
+        await self.aensure_connection()
+        stale_ids = []
+        for source in sources:
+            async for document in self.async_collection.find({"source": source}, {"contentHash": 1}):
+                if document.get("contentHash") not in keep_hashes:
+                    stale_ids.append(document["_id"])
+        if not stale_ids:
+            return 0
+        result = await self.async_collection.delete_many({"_id": {"$in": stale_ids}})
+        return result.deleted_count
+
+    def count_documents(self):
+        self.ensure_connection()
+        return self.collection.count_documents({})
+
+    async def aget_knowledge_base_version(self):
+        await self.aensure_connection()
+        count = await self.async_collection.estimated_document_count()
+        latest = await self.async_collection.find_one({}, {"createdAt": 1}, sort=[("createdAt", -1)])
+        return f"{count}:{latest.get('createdAt') if latest else None}"
+
     def close(self):
         if self.client:
             self.client.close()
@@ -100,3 +311,9 @@ class MongoDBClient:
             self.db = None
             self.collection = None
             logging.info(" 🚪 MongoDB connection closed.")
+        if self.async_client:
+            self.async_client.close()
+            self.async_client = None
+            self.async_db = None
+            self.async_collection = None
+            logging.info(" 🚪 Async MongoDB connection closed.")
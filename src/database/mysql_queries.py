@@ -1,52 +1,50 @@
 import json
+import logging
+import uuid
 from typing import Union, List
 from functools import wraps
-import asyncmy
-from asyncmy import Pool
 from src.logger import mysql_logger
-from src.config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, POOL_CONNECT_TIMEOUT, \
-    POOL_MIN_SIZE, POOL_MAX_SIZE, ACQUIRE_CONN_TIMEOUT
+from src.config import MYSQL_HOST, MYSQL_PORT, MYSQL_READ_HOSTS, MYSQL_READ_POOLS, MYSQL_WRITE_POOLS, \
+    DEDUP_USE_MYSQL, DEDUP_MYSQL_RETENTION_DAYS, \
+    WRITE_BEHIND_ENABLED, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL_MS, WRITE_BUFFER_MAX_ROWS, HISTORY_CACHE_ENABLED, \
+    HISTORY_MAX_TURNS, HISTORY_TTL
+from src.database.history_cache import ChatHistoryCache
+from src.database.pool_manager import PoolManager, parse_hosts, is_connection_error
+from src.metrics import metrics
+from datetime import datetime
 import asyncio
-import random
 
-# Multiple pools for read and write operations
-read_pools: List[Pool] = []
-write_pools: List[Pool] = []
+# Multiple pools for read and write operations - reads can be spread over replicas (MYSQL_READ_HOSTS)
+read_pools = PoolManager("read", parse_hosts(MYSQL_READ_HOSTS, MYSQL_HOST, MYSQL_PORT or 3306), MYSQL_READ_POOLS)
+write_pools = PoolManager("write", parse_hosts("", MYSQL_HOST, MYSQL_PORT or 3306), MYSQL_WRITE_POOLS)
+
+# Write-behind buffer: (whatsapp_number_id, query, answer, buffered_at) rows waiting for the next batch insert
+write_buffer: List[tuple] = []
+flushing_rows: List[tuple] = []
+flush_lock = asyncio.Lock()
+flush_stop = asyncio.Event()
+flush_task = None
+user_id_cache = {}
+USER_ID_CACHE_MAX = 10000
+users_unique_key = False  # set at startup by check_users_unique_key(); enables the single-statement upsert
+claim_tokens = False  # set at startup by create_processed_messages_table(); enables the single-statement claim
+
+# Ostatnie tury rozmów trzymane w pamięci - MySQL pytany tylko przy braku wpisu (np. po restarcie)
+history_cache = ChatHistoryCache()
 
 
 async def initialize_connection_pools():
-    global read_pools, write_pools, pool
     try:
-        # Initialize multiple read pools
-        for i in range(3):  # You can choose the number of read pools you need
-            pool = await asyncmy.create_pool(
-                minsize=POOL_MIN_SIZE,
-                maxsize=POOL_MAX_SIZE,
-                host=MYSQL_HOST,
-                port=int(MYSQL_PORT),
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                db=MYSQL_DATABASE
-            )
-            read_pools.append(pool)
-            mysql_logger.info(f"✅ Read pool {i + 1} initialized.")
-
-        # Initialize multiple write pools
-        for i in range(3):  # You can choose the number of write pools you need
-            pool = await asyncmy.create_pool(
-                minsize=POOL_MIN_SIZE,
-                maxsize=POOL_MAX_SIZE,
-                host=MYSQL_HOST,
-                port=int(MYSQL_PORT),
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                db=MYSQL_DATABASE
-            )
-            write_pools.append(pool)
-            mysql_logger.info(f"✅ Write pool {i + 1} initialized.")
-
-        await create_test_connection(random.choice(read_pools))
-        await create_test_connection(random.choice(write_pools))
+        healthy_read, healthy_write = await asyncio.gather(read_pools.start(), write_pools.start())
+        if not healthy_read or not healthy_write:
+            raise RuntimeError(f"{healthy_read} read / {healthy_write} write pools are healthy")
+
+        await create_test_connection()
+        await check_users_unique_key()
+        if DEDUP_USE_MYSQL:
+            await create_processed_messages_table()
+            await purge_processed_messages(DEDUP_MYSQL_RETENTION_DAYS)
+        start_write_behind()
         return read_pools, write_pools
 
     except Exception as e:
@@ -56,58 +54,55 @@ async def initialize_connection_pools():
 
 
 async def close_connection_pools():
-    global read_pools, write_pools
+    # Najpierw zapisujemy wszystko, co czeka w buforze - potem zamykamy pule
+    await stop_write_behind()
     try:
-        # Close read pools
-        for i, pool in enumerate(read_pools):
-            pool.close()
-            await pool.wait_closed()
-            mysql_logger.info(f"🚪️ Read pool {i + 1} closed.")
-
-        # Close write pools
-        for i, pool in enumerate(write_pools):
-            pool.close()
-            await pool.wait_closed()
-            mysql_logger.info(f"🚪️ Write pool {i + 1} closed.")
+        await asyncio.gather(read_pools.close(), write_pools.close())
 
     except Exception as e:
         mysql_logger.error("🚪️ ❌ An error occurred during closing the connection pools.")
         mysql_logger.error(f"Error message: {e}")
 
 
-async def get_pool(pool_type: str):
+def get_pool_manager(pool_type: str) -> PoolManager:
     if pool_type == 'read':
-        if not read_pools:
-            raise RuntimeError("❌ No read pools initialized")
-        return random.choice(read_pools)  # Select a random read pool
+        return read_pools
     elif pool_type == 'write':
-        if not write_pools:
-            raise RuntimeError("❌ No write pools initialized")
-        return random.choice(write_pools)  # Select a random write pool
+        return write_pools
     else:
         raise ValueError(f"Unknown pool type: {pool_type}")
 
 
+def get_pool_stats() -> dict:
+    return {"read": read_pools.stats(), "write": write_pools.stats()}
+
+
 def with_connection(pool_type="read", error_message="❌ A database error occurred."):
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
+            manager = get_pool_manager(pool_type)
+            managed = None
             pool = None
             conn = None
             try:
-                pool = await get_pool(pool_type)
-                conn = await asyncio.wait_for(pool.acquire(), timeout=ACQUIRE_CONN_TIMEOUT)
+                managed = manager.pick()
+                conn, pool = await manager.acquire(managed)
                 async with conn.cursor() as cur:
-                    return await func(cur, conn, *args, **kwargs)
+                    result = await func(cur, conn, *args, **kwargs)
+                manager.report_success(managed)
+                return result
             except asyncio.TimeoutError:
                 mysql_logger.error("⏱️ Timed out while waiting to acquire a connection from the pool.")
             except Exception as e:
+                if conn and managed:
+                    manager.report_failure(managed, e)
                 mysql_logger.error(error_message)
                 mysql_logger.error(f"Error message: {e}")
             finally:
                 if conn:
                     try:
-                        await pool.release(conn)
+                        await manager.release(managed, conn, pool)
                         mysql_logger.info(f"🔓 Connection released back to the pool.")
                     except Exception as e:
                         mysql_logger.error(f"❌ Error releasing connection: {e}")
@@ -129,26 +124,153 @@ async def create_test_connection(cur, conn, *args, **kwargs):
         raise RuntimeError("result[0] != 1")
 
 
-@with_connection(pool_type="write", error_message="❌ Failed to insert or retrieve a user.")
-async def insert_or_get_user(cur, conn, whatsapp_number_id: int) -> int | None:
-    # First, try to get the existing user
-    await cur.execute("SELECT id FROM users WHERE whatsapp_number_id = %s", (whatsapp_number_id,))
-    result = await cur.fetchone()
+CLAIM_TOKEN_COLUMN_QUERY = """
+    SELECT COLUMN_NAME FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'processed_messages' AND COLUMN_NAME = 'claimed_by'
+"""
 
-    if result:
-        mysql_logger.info("➡️ Existing user retrieved successfully.")
-        return result[0]
 
-    # If user doesn't exist, insert a new one
-    await cur.execute("INSERT INTO users (whatsapp_number_id) VALUES (%s)", (whatsapp_number_id,))
+@with_connection(pool_type="write", error_message="❌ Failed to create the processed_messages table.")
+async def create_processed_messages_table(cur, conn):
+    global claim_tokens
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            message_id VARCHAR(191) NOT NULL PRIMARY KEY,
+            claimed_by CHAR(32) NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_processed_messages_created_at (created_at)
+        )
+    """)
     await conn.commit()
+    # Tabela sprzed kolumny claimed_by - działa dalej, ale każde id jest zajmowane osobnym INSERT
+    await cur.execute(CLAIM_TOKEN_COLUMN_QUERY)
+    claim_tokens = await cur.fetchone() is not None
+    if claim_tokens:
+        mysql_logger.info("✅ processed_messages table ready.")
+    else:
+        mysql_logger.warning("⚠️ processed_messages has no claimed_by column - message IDs are claimed one by one. "
+                             "Run `python -m src.database.migrate` to add it.")
 
-    # Check if the insert was successful
-    if cur.rowcount > 0:
-        mysql_logger.info("➡️ New user inserted successfully.")
-        return cur.lastrowid
+
+@with_connection(pool_type="write", error_message="❌ Failed to purge old processed message IDs.")
+async def purge_processed_messages(cur, conn, retention_days: int):
+    await cur.execute("DELETE FROM processed_messages WHERE created_at < NOW() - INTERVAL %s DAY",
+                      (retention_days,))
+    await conn.commit()
+    mysql_logger.info(f"🧹 Purged {cur.rowcount} processed message IDs older than {retention_days} days.")
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to claim message IDs.")
+async def claim_message_ids(cur, conn, message_ids: list) -> set:
+    """Claims the IDs and returns the ones this call inserted; the others were already processed elsewhere."""
+    # Unikalny klucz rozstrzyga, która instancja przetwarza wiadomość
+    if not claim_tokens:
+        claimed = set()
+        for message_id in message_ids:
+            await cur.execute("INSERT IGNORE INTO processed_messages (message_id) VALUES (%s)", (message_id,))
+            if cur.rowcount > 0:
+                claimed.add(message_id)
+        await conn.commit()
+        return claimed
+
+    # Jeden INSERT na całe zadanie; własne wiersze rozpoznajemy po tokenie tylko wtedy, gdy część id była zajęta
+    token = uuid.uuid4().hex
+    await cur.execute("INSERT IGNORE INTO processed_messages (message_id, claimed_by) VALUES "
+                      + ", ".join(["(%s, %s)"] * len(message_ids)),
+                      [value for message_id in message_ids for value in (message_id, token)])
+    await conn.commit()
+    if cur.rowcount == len(message_ids):
+        return set(message_ids)
+    if cur.rowcount == 0:
+        return set()
+    await cur.execute("SELECT message_id FROM processed_messages WHERE claimed_by = %s AND message_id IN ("
+                      + ", ".join(["%s"] * len(message_ids)) + ")", (token, *message_ids))
+    return {row[0] for row in await cur.fetchall()}
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to add the claimed_by column to processed_messages.")
+async def add_claim_token_column(cur, conn) -> bool:
+    await cur.execute(CLAIM_TOKEN_COLUMN_QUERY)
+    if await cur.fetchone():
+        mysql_logger.info("✅ processed_messages already has the claimed_by column.")
+        return False
+    await cur.execute("ALTER TABLE processed_messages ADD COLUMN claimed_by CHAR(32) NULL")
+    await conn.commit()
+    mysql_logger.info("✅ Added the claimed_by column to processed_messages.")
+    return True
+
+
+USERS_UNIQUE_KEY_QUERY = """
+    SELECT INDEX_NAME FROM information_schema.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'users' AND NON_UNIQUE = 0
+    GROUP BY INDEX_NAME
+    HAVING COUNT(*) = 1 AND MAX(COLUMN_NAME) = 'whatsapp_number_id'
+"""
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to check the unique key on users.whatsapp_number_id.")
+async def check_users_unique_key(cur, conn) -> bool:
+    global users_unique_key
+    # Tylko sprawdzenie - ALTER TABLE przy starcie blokowałby tabelę; klucz dodaje `python -m src.database.migrate`
+    await cur.execute(USERS_UNIQUE_KEY_QUERY)
+    users_unique_key = await cur.fetchone() is not None
+    if users_unique_key:
+        mysql_logger.info("✅ users.whatsapp_number_id unique key found.")
+    else:
+        mysql_logger.warning("⚠️ users.whatsapp_number_id has no unique key - users are resolved with SELECT + INSERT. "
+                             "Run `python -m src.database.migrate` to add it.")
+    return users_unique_key
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to add the unique key on users.whatsapp_number_id "
+                                                  "(duplicate numbers in the users table?).")
+async def add_users_unique_key(cur, conn) -> bool:
+    await cur.execute(USERS_UNIQUE_KEY_QUERY)
+    if await cur.fetchone():
+        mysql_logger.info("✅ users.whatsapp_number_id already has a unique key.")
+        return False
+    # Bez tego klucza upsert w resolve_user_id tworzyłby duplikaty użytkowników
+    await cur.execute("ALTER TABLE users ADD UNIQUE KEY uq_users_whatsapp_number_id (whatsapp_number_id)")
+    await conn.commit()
+    mysql_logger.info("✅ Added the unique key on users.whatsapp_number_id.")
+    return True
+
+
+async def resolve_user_id(cur, whatsapp_number_id: int) -> int:
+    user_id = user_id_cache.get(whatsapp_number_id)
+    if user_id is not None:
+        return user_id
+    if users_unique_key:
+        # Jedno zapytanie zamiast SELECT + INSERT; LAST_INSERT_ID(id) zwraca id także dla istniejącego użytkownika
+        await cur.execute("INSERT INTO users (whatsapp_number_id) VALUES (%s) "
+                          "ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)", (whatsapp_number_id,))
+        user_id = cur.lastrowid
     else:
-        raise RuntimeError("Failed to insert new user")
+        await cur.execute("SELECT id FROM users WHERE whatsapp_number_id = %s", (whatsapp_number_id,))
+        result = await cur.fetchone()
+        if result:
+            return result[0]
+        await cur.execute("INSERT INTO users (whatsapp_number_id) VALUES (%s)", (whatsapp_number_id,))
+        user_id = cur.lastrowid
+    if not user_id:
+        raise RuntimeError("Failed to insert or retrieve user")
+    return user_id
+
+
+def cache_user_ids(user_ids: dict):
+    # Tylko po udanym commit - id z wycofanej transakcji mogłoby nie istnieć w bazie
+    if len(user_id_cache) + len(user_ids) > USER_ID_CACHE_MAX:
+        user_id_cache.clear()
+    user_id_cache.update(user_ids)
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to insert or retrieve a user.")
+async def insert_or_get_user(cur, conn, whatsapp_number_id: int) -> int | None:
+    user_id = await resolve_user_id(cur, whatsapp_number_id)
+    await conn.commit()
+    cache_user_ids({whatsapp_number_id: user_id})
+    mysql_logger.info("➡️ User resolved successfully.")
+    return user_id
 
 
 @with_connection(pool_type="write", error_message="❌ Failed to insert an answer-query pair.")
@@ -164,33 +286,139 @@ async def insert_query(cur, conn, user_id: int, query: str, answer: str):
         raise RuntimeError("cur.rowcount == 0")
 
 
+@with_connection(pool_type="write", error_message="❌ Failed to write a batch of answer-query pairs.")
+async def insert_query_batch(cur, conn, rows: list) -> bool:
+    """
+    Writes the rows in one transaction. Returns True when committed, False when MySQL rejected the data
+    (the batch is rolled back) and None - via with_connection - when the connection or the pools failed.
+    """
+    try:
+        user_ids = {}
+        for whatsapp_number_id in dict.fromkeys(row[0] for row in rows):
+            user_ids[whatsapp_number_id] = await resolve_user_id(cur, whatsapp_number_id)
+        await cur.executemany("INSERT INTO queries (user_id, query, answer) VALUES (%s, %s, %s)",
+                              [(user_ids[number], query, answer) for number, query, answer, _ in rows])
+        await conn.commit()
+    except Exception as e:
+        await conn.rollback()
+        if is_connection_error(e):
+            raise
+        mysql_logger.warning(f"⚠️ MySQL rejected a batch of {len(rows)} answer-query pairs: {e}")
+        return False
+    cache_user_ids(user_ids)
+    mysql_logger.info(f"➡️ {len(rows)} answer-query pairs inserted in one transaction.")
+    return True
+
+
+async def flush_write_buffer():
+    global write_buffer, flushing_rows
+    async with flush_lock:
+        if not write_buffer:
+            return
+        flushing_rows, write_buffer = write_buffer, []
+        try:
+            with metrics.span("mysql_write", rows=len(flushing_rows)):
+                written = await insert_query_batch(flushing_rows)
+            unwritten = flushing_rows if written is None else []
+            if written is False:
+                # Błąd danych, nie połączenia - szukamy winnych wierszy pojedynczo, reszta trafia do bazy
+                unwritten = await write_rows_one_by_one(flushing_rows)
+        finally:
+            flushing_rows = []
+        if unwritten:
+            # Baza niedostępna - wracamy z wierszami na początek bufora, ale nie rośniemy bez końca
+            pending = unwritten + write_buffer
+            write_buffer = pending[-WRITE_BUFFER_MAX_ROWS:]
+            dropped = len(pending) - len(write_buffer)
+            if dropped > 0:
+                mysql_logger.error(f"❌ Write buffer full, dropped {dropped} answer-query pairs.")
+
+
+async def write_rows_one_by_one(rows: list) -> list:
+    """Retries a rejected batch row by row; drops the rows MySQL rejects and returns the ones left unwritten."""
+    for index, row in enumerate(rows):
+        written = await insert_query_batch([row])
+        if written is None:
+            return rows[index:]
+        if written is False:
+            mysql_logger.error(f"❌ Dropped an answer-query pair of user {row[0]} rejected by MySQL.")
+    return []
+
+
+async def write_behind_loop():
+    # Zatrzymanie przez event, nie cancel() - anulowanie w trakcie wait_for(acquire) potrafi zostać połknięte
+    while not flush_stop.is_set():
+        try:
+            await asyncio.wait_for(flush_stop.wait(), timeout=WRITE_FLUSH_INTERVAL_MS / 1000)
+        except asyncio.TimeoutError:
+            pass
+        try:
+            await flush_write_buffer()
+        except Exception as e:
+            mysql_logger.error(f"❌ Write-behind flush failed: {e}")
+
+
+def start_write_behind():
+    global flush_task
+    if WRITE_BEHIND_ENABLED and flush_task is None:
+        flush_stop.clear()
+        flush_task = asyncio.create_task(write_behind_loop())
+        mysql_logger.info(f"✅ Write-behind buffer started (batch: {WRITE_BATCH_SIZE} rows, "
+                          f"interval: {WRITE_FLUSH_INTERVAL_MS} ms).")
+
+
+async def stop_write_behind():
+    global flush_task
+    if flush_task is not None:
+        flush_stop.set()
+        await asyncio.gather(flush_task, return_exceptions=True)
+        flush_task = None
+    await flush_write_buffer()
+
+
+def buffered_queries(whatsapp_number_id: int) -> list:
+    # Wiersze jeszcze niezapisane w MySQL, od najnowszego - tak jak zwraca je fetch_recent_queries (razem z wiekiem,
+    # żeby cache historii liczył TTL od zapisu odpowiedzi, a nie od wczytania)
+    now = datetime.now()
+    history = []
+    for number, query, answer, buffered_at in reversed(flushing_rows + write_buffer):
+        age = (now - buffered_at).total_seconds()
+        if number == whatsapp_number_id and age < HISTORY_TTL:
+            history.append({"query": query, "answer": answer, "created_at": buffered_at.isoformat(),
+                            "age_seconds": age})
+    return history
+
+
 @with_connection(pool_type="read", error_message="❌ Failed to retrieve recent queries form chat history.")
-async def get_recent_queries(cur, conn, whatsapp_number_id: int) -> list:
+async def fetch_recent_queries(cur, conn, whatsapp_number_id: int) -> list:
     await cur.execute("""
-        SELECT q.query, q.answer, q.created_at
+        SELECT q.query, q.answer, q.created_at, TIMESTAMPDIFF(SECOND, q.created_at, NOW())
         FROM queries q
         JOIN users u ON q.user_id = u.id
         WHERE u.whatsapp_number_id = %s
-        AND q.created_at >= NOW() - INTERVAL 2 HOUR
-        ORDER BY q.created_at DESC
-        LIMIT 5
-    """, (whatsapp_number_id,))
+        AND q.created_at >= NOW() - INTERVAL %s SECOND
+        ORDER BY q.created_at DESC, q.id DESC
+        LIMIT %s
+    """, (whatsapp_number_id, HISTORY_TTL, HISTORY_MAX_TURNS))
     results = await cur.fetchall()
     mysql_logger.info("➡️ Chat history retrieved successfully.")
 
     if results:
-        chat_history = [{"query": query, "answer": answer, "created_at": created_at.isoformat()} for
-                        query, answer, created_at in results]
-
-        # Szczegółowe logowanie historii czatu
-        log_message = f"📜 Retrieved {len(chat_history)} entries from chat history for user {whatsapp_number_id}:\n"
-        for i, entry in enumerate(chat_history, 1):
-            log_message += f"  {i}. 🗨️ Query: {entry['query'][:50]}{'...' if len(entry['query']) > 50 else ''}\n"
-            log_message += f"     💬 Answer: {entry['answer'][:50]}{'...' if len(entry['answer']) > 50 else ''}\n"
-            log_message += f"     🕒 Time: {entry['created_at']}\n"
-
-        mysql_logger.info(log_message)
-        mysql_logger.debug(f"Full chat history: {json.dumps(chat_history, indent=2)}")
+        chat_history = [{"query": query, "answer": answer, "created_at": created_at.isoformat(), "age_seconds": age}
+                        for query, answer, created_at, age in results]
+
+        # Szczegółowe logowanie historii czatu - budujemy je tylko, gdy poziom logowania na to pozwala
+        if mysql_logger.isEnabledFor(logging.INFO):
+            log_lines = [f"📜 Retrieved {len(chat_history)} entries from chat history "
+                         f"for user {whatsapp_number_id}:"]
+            for i, entry in enumerate(chat_history, 1):
+                query, answer = entry['query'], entry['answer']
+                log_lines.append(f"  {i}. 🗨️ Query: {query[:50]}{'...' if len(query) > 50 else ''}")
+                log_lines.append(f"     💬 Answer: {answer[:50]}{'...' if len(answer) > 50 else ''}")
+                log_lines.append(f"     🕒 Time: {entry['created_at']}")
+            mysql_logger.info("\n".join(log_lines))
+        if mysql_logger.isEnabledFor(logging.DEBUG):
+            mysql_logger.debug(f"Full chat history: {json.dumps(chat_history, indent=2)}")
 
         return chat_history
     else:
@@ -198,9 +426,37 @@ async def get_recent_queries(cur, conn, whatsapp_number_id: int) -> list:
         return []
 
 
+async def get_recent_queries(whatsapp_number_id: int) -> list:
+    if HISTORY_CACHE_ENABLED:
+        cached = history_cache.get(whatsapp_number_id)
+        if cached is not None:
+            mysql_logger.info(f"📜 Chat history for user {whatsapp_number_id} served from memory "
+                              f"({len(cached)} entries).")
+            return cached
+
+    history = await fetch_recent_queries(whatsapp_number_id)
+    pending = buffered_queries(whatsapp_number_id)
+    merged = (pending + (history or []))[:HISTORY_MAX_TURNS]
+    if HISTORY_CACHE_ENABLED and history is not None:
+        history_cache.load(whatsapp_number_id, merged)
+    if not pending:
+        return history
+    return merged
+
+
 async def insert_data_mysql(whatsapp_number_id: int, user_query: str, ai_answer: str):
-    user_id = await insert_or_get_user(whatsapp_number_id)
-    if user_id:
-        await insert_query(user_id, user_query, ai_answer)
-    else:
-        mysql_logger.error("❌ Failed to insert or retrieve user.")
+    if HISTORY_CACHE_ENABLED:
+        history_cache.append(whatsapp_number_id, user_query, ai_answer)
+
+    if flush_task is not None:
+        write_buffer.append((whatsapp_number_id, user_query, ai_answer, datetime.now()))
+        if len(write_buffer) >= WRITE_BATCH_SIZE and not flush_lock.locked():
+            await flush_write_buffer()
+        return
+
+    with metrics.span("mysql_write", rows=1):
+        user_id = await insert_or_get_user(whatsapp_number_id)
+        if user_id:
+            await insert_query(user_id, user_query, ai_answer)
+        else:
+            mysql_logger.error("❌ Failed to insert or retrieve user.")
@@ -0,0 +1,239 @@
+import asyncio
+import bisect
+import random
+import time
+from typing import List
+import asyncmy
+from asyncmy.errors import OperationalError, InterfaceError
+from src.logger import mysql_logger
+from src.config import MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, POOL_CONNECT_TIMEOUT, POOL_MIN_SIZE, \
+    POOL_MAX_SIZE, ACQUIRE_CONN_TIMEOUT, POOL_EJECT_AFTER, POOL_RECONNECT_INTERVAL, POOL_RECONNECT_MAX_INTERVAL
+
+# Upper bounds (ms) of the acquire latency histogram buckets, the last bucket catches everything slower
+ACQUIRE_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+WAIT_EWMA_ALPHA = 0.2
+
+
+def parse_hosts(value: str, default_host: str, default_port) -> List[tuple]:
+    """'db1:3306,db2' -> [('db1', 3306), ('db2', default_port)]; falls back to the default host."""
+    hosts = []
+    for item in (value or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        hosts.append((host, int(port or default_port)))
+    return hosts or [(default_host, int(default_port))]
+
+
+def is_connection_error(error: Exception) -> bool:
+    """Errors that say something about the pool's health rather than about the query itself."""
+    return isinstance(error, (OperationalError, InterfaceError, ConnectionError, OSError, asyncio.TimeoutError))
+
+
+class ManagedPool:
+    """One asyncmy pool plus the bookkeeping the manager routes on."""
+
+    def __init__(self, name: str, host: str, port: int):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.pool = None
+        self.healthy = False
+        self.in_use = 0
+        self.waiting = 0
+        self.wait_ewma_ms = 0.0
+        self.acquires = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.ejections = 0
+        self.consecutive_failures = 0
+        self.histogram = [0] * (len(ACQUIRE_BUCKETS_MS) + 1)
+        self.reconnect_task = None
+
+    def load(self, maxsize: int) -> float:
+        return (self.in_use + self.waiting) / maxsize
+
+    def record_acquire(self, wait_ms: float):
+        self.acquires += 1
+        self.histogram[bisect.bisect_left(ACQUIRE_BUCKETS_MS, wait_ms)] += 1
+        self.wait_ewma_ms += WAIT_EWMA_ALPHA * (wait_ms - self.wait_ewma_ms)
+
+    def stats(self) -> dict:
+        return {
+            "host": f"{self.host}:{self.port}",
+            "healthy": self.healthy,
+            "size": self.pool.size if self.pool else 0,
+            "free": self.pool.freesize if self.pool else 0,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquires": self.acquires,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "acquire_wait_ewma_ms": round(self.wait_ewma_ms, 2),
+            "acquire_histogram_ms": {
+                **{f"le_{bound}": count for bound, count in zip(ACQUIRE_BUCKETS_MS, self.histogram)},
+                "inf": self.histogram[-1],
+            },
+        }
+
+
+class PoolManager:
+    """
+    Routes each acquire to the least-loaded healthy pool (in-use + waiting connections, then recent
+    acquire wait). Pools that keep failing on connection-level errors are ejected, closed and
+    reconnected in the background with exponential backoff.
+    """
+
+    def __init__(self, kind: str, hosts: List[tuple], pool_count: int, minsize=POOL_MIN_SIZE,
+                 maxsize=POOL_MAX_SIZE, acquire_timeout=ACQUIRE_CONN_TIMEOUT, pool_factory=None):
+        self.kind = kind
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.acquire_timeout = acquire_timeout
+        self.pool_factory = pool_factory or self._create_pool
+        # Co najmniej jedna pula na host, pozostałe rozkładamy po kolei
+        count = max(pool_count, len(hosts))
+        self.pools = [ManagedPool(f"{kind}-{i + 1}", *hosts[i % len(hosts)]) for i in range(count)]
+        self.closed = False
+
+    async def _create_pool(self, host: str, port: int):
+        return await asyncmy.create_pool(
+            minsize=self.minsize,
+            maxsize=self.maxsize,
+            host=host,
+            port=port,
+            user=MYSQL_USER,
+            password=MYSQL_PASSWORD,
+            db=MYSQL_DATABASE,
+            connect_timeout=POOL_CONNECT_TIMEOUT
+        )
+
+    async def _open(self, managed: ManagedPool):
+        pool = await self.pool_factory(managed.host, managed.port)
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), timeout=self.acquire_timeout)
+            try:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT 1")
+                    await cur.fetchone()
+            finally:
+                await pool.release(conn)
+        except Exception:
+            await self._close_pool(pool)
+            raise
+        managed.pool = pool
+        managed.healthy = True
+        managed.consecutive_failures = 0
+
+    @staticmethod
+    async def _close_pool(pool):
+        try:
+            pool.close()
+            await pool.wait_closed()
+        except Exception as e:
+            mysql_logger.error(f"❌ Error closing pool: {e}")
+
+    async def _start_pool(self, managed: ManagedPool):
+        try:
+            await self._open(managed)
+            mysql_logger.info(f"✅ {self.kind.capitalize()} pool {managed.name} initialized "
+                              f"({managed.host}:{managed.port}).")
+        except Exception as e:
+            mysql_logger.error(f"❌ {self.kind.capitalize()} pool {managed.name} failed to start: {e}")
+            self._schedule_reconnect(managed)
+
+    async def start(self) -> int:
+        """Opens every pool; the ones that fail go straight to background reconnect. Returns the healthy count."""
+        self.closed = False
+        # Pule otwierane równolegle - start trwa tyle, co najwolniejsze połączenie, a nie ich suma
+        await asyncio.gather(*(self._start_pool(managed) for managed in self.pools))
+        return sum(managed.healthy for managed in self.pools)
+
+    def pick(self) -> ManagedPool:
+        candidates = [managed for managed in self.pools if managed.healthy]
+        if not candidates:
+            raise RuntimeError(f"❌ No healthy {self.kind} pools available")
+        return min(candidates, key=lambda managed: (managed.load(self.maxsize), managed.wait_ewma_ms, random.random()))
+
+    async def acquire(self, managed: ManagedPool):
+        """Returns (conn, pool) - the connection has to go back to the pool it came from, even after a reconnect."""
+        pool = managed.pool
+        managed.waiting += 1
+        started = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(pool.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            managed.timeouts += 1
+            managed.record_acquire((time.perf_counter() - started) * 1000)
+            raise
+        except Exception as e:
+            self.report_failure(managed, e)
+            raise
+        finally:
+            managed.waiting -= 1
+        managed.in_use += 1
+        managed.record_acquire((time.perf_counter() - started) * 1000)
+        return conn, pool
+
+    async def release(self, managed: ManagedPool, conn, pool):
+        managed.in_use -= 1
+        await pool.release(conn)
+
+    def report_success(self, managed: ManagedPool):
+        managed.consecutive_failures = 0
+
+    def report_failure(self, managed: ManagedPool, error: Exception):
+        managed.errors += 1
+        if not is_connection_error(error):
+            return
+        managed.consecutive_failures += 1
+        if managed.healthy and managed.consecutive_failures >= POOL_EJECT_AFTER:
+            managed.healthy = False
+            managed.ejections += 1
+            mysql_logger.warning(f"⚠️ Ejecting {self.kind} pool {managed.name} after "
+                                 f"{managed.consecutive_failures} consecutive failures: {error}")
+            self._schedule_reconnect(managed)
+
+    def _schedule_reconnect(self, managed: ManagedPool):
+        if self.closed or (managed.reconnect_task and not managed.reconnect_task.done()):
+            return
+        managed.reconnect_task = asyncio.create_task(self._reconnect(managed))
+
+    async def _reconnect(self, managed: ManagedPool):
+        old_pool, managed.pool = managed.pool, None
+        # Wypożyczone połączenia wrócą do starej puli - zamykamy ją dopiero po ich zwolnieniu
+        if old_pool is not None:
+            asyncio.create_task(self._close_pool(old_pool))
+        delay = POOL_RECONNECT_INTERVAL
+        while not self.closed:
+            await asyncio.sleep(delay)
+            try:
+                await self._open(managed)
+                mysql_logger.info(f"🔄 {self.kind.capitalize()} pool {managed.name} reconnected.")
+                return
+            except Exception as e:
+                mysql_logger.warning(f"⚠️ Reconnecting {self.kind} pool {managed.name} failed: {e}")
+                delay = min(delay * 2, POOL_RECONNECT_MAX_INTERVAL)
+
+    async def close(self):
+        self.closed = True
+        reconnects = [managed.reconnect_task for managed in self.pools
+                      if managed.reconnect_task and not managed.reconnect_task.done()]
+        for task in reconnects:
+            task.cancel()
+        # Czekamy na anulowanie - przerwany _open nie może otworzyć puli po zamknięciu managera
+        await asyncio.gather(*reconnects, return_exceptions=True)
+        for managed in self.pools:
+            if managed.pool is not None:
+                await self._close_pool(managed.pool)
+                mysql_logger.info(f"🚪️ {self.kind.capitalize()} pool {managed.name} closed.")
+            managed.pool = None
+            managed.healthy = False
+
+    def stats(self) -> dict:
+        return {managed.name: managed.stats() for managed in self.pools}
+
+    def __len__(self):
+        return sum(managed.healthy for managed in self.pools)
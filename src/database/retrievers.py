@@ -0,0 +1,101 @@
+import asyncio
+from src.config import RETRIEVER_BACKEND, LOCAL_INDEX_REFRESH_INTERVAL, LEXICAL_ENABLED, LEXICAL_REFRESH_INTERVAL
+from src.database.local_index import LocalVectorIndex
+from src.database.lexical_index import LexicalIndex
+from src.logger import cosmosdb_logger as logger
+
+
+class Retriever:
+    """Common interface of the retrieval backends used by RAGEngine."""
+
+    async def asearch(self, query_embedding, num_results=10, include_vectors=False):
+        raise NotImplementedError
+
+    async def astart(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class CosmosRetriever(Retriever):
+    def __init__(self, mongodb_client):
+        self.mongodb_client = mongodb_client
+
+    async def asearch(self, query_embedding, num_results=10, include_vectors=False):
+        return await self.mongodb_client.avector_search(query_embedding, num_results=num_results,
+                                                        include_vectors=include_vectors)
+
+
+class RefreshingRetriever(Retriever):
+    """Keeps a local snapshot index (anything with load / refresh / size) in sync with the collection."""
+
+    def __init__(self, mongodb_client, index, refresh_interval):
+        self.mongodb_client = mongodb_client
+        self.index = index
+        self.refresh_interval = refresh_interval
+        self._refresh_task = None
+
+    def refresh(self):
+        try:
+            if self.index.refresh(self.mongodb_client):
+                logger.info(f"🧭 {type(self.index).__name__} refreshed ({self.index.size} documents)")
+        except Exception as e:
+            logger.error(f"❌ {type(self.index).__name__} refresh failed: {e}", exc_info=True)
+
+    async def arefresh(self):
+        # Pobranie z Mongo i zapis snapshotu na dysk są blokujące - poza pętlą zdarzeń
+        await asyncio.to_thread(self.refresh)
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.arefresh()
+
+    async def astart(self):
+        if not self.index.load():
+            await self.arefresh()
+        if self.refresh_interval > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def aclose(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+class LocalRetriever(RefreshingRetriever):
+    """Searches a local snapshot of the collection and falls back to Cosmos while the snapshot is empty."""
+
+    def __init__(self, mongodb_client, index=None, refresh_interval=LOCAL_INDEX_REFRESH_INTERVAL):
+        super().__init__(mongodb_client, index or LocalVectorIndex(), refresh_interval)
+        self.fallback = CosmosRetriever(mongodb_client)
+
+    async def asearch(self, query_embedding, num_results=10, include_vectors=False):
+        if self.index.size == 0:
+            return await self.fallback.asearch(query_embedding, num_results, include_vectors)
+        return self.index.search(query_embedding, num_results, include_vectors)
+
+
+class LexicalRetriever(RefreshingRetriever):
+    """BM25 keyword search over a local inverted index; searched by question text, not by embedding."""
+
+    def __init__(self, mongodb_client, index=None, refresh_interval=LEXICAL_REFRESH_INTERVAL):
+        super().__init__(mongodb_client, index or LexicalIndex(), refresh_interval)
+
+    def search_text(self, question, num_results=10):
+        if self.index.size == 0:
+            return []
+        return self.index.search(question, num_results)
+
+
+def create_lexical_retriever(mongodb_client):
+    return LexicalRetriever(mongodb_client) if LEXICAL_ENABLED else None
+
+
+def create_retriever(mongodb_client) -> Retriever:
+    if RETRIEVER_BACKEND == "local":
+        return LocalRetriever(mongodb_client)
+    if RETRIEVER_BACKEND != "cosmos":
+        logger.warning(f"⚠️ Unknown RETRIEVER_BACKEND '{RETRIEVER_BACKEND}', using cosmos")
+    return CosmosRetriever(mongodb_client)
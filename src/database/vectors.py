@@ -0,0 +1,124 @@
+import base64
+import numpy as np
+from bson.binary import Binary
+
+# BSON Binary subtype 9 ("vector"): dtype byte, padding byte, little-endian payload.
+# Ten sam format co Binary.from_vector w nowszym pymongo, więc zapisane dokumenty przeżyją aktualizację sterownika
+VECTOR_SUBTYPE = 9
+BSON_FLOAT32 = 0x27
+BSON_INT8 = 0x03
+VECTOR_DTYPES = ("float32", "float16", "int8")
+PCA_SAMPLE_SIZE = 20000
+SCORE_BLOCK_ROWS = 256  # int8 / float16 rows widened to float32 per matmul
+
+
+def as_float32(vector) -> np.ndarray:
+    """Any embedding representation (list, array, base64 string from the API, packed BSON binary) -> float32 array."""
+    if isinstance(vector, np.ndarray):
+        return vector if vector.dtype == np.float32 else vector.astype(np.float32)
+    if isinstance(vector, str):
+        return np.frombuffer(base64.b64decode(vector), dtype="<f4")
+    if isinstance(vector, (bytes, bytearray, memoryview)):
+        return unpack_vector(vector)
+    return np.asarray(vector, dtype=np.float32)
+
+
+def pack_vector(vector) -> Binary:
+    """float32 BSON vector: 4 bytes per dimension instead of ~14 for an array of doubles."""
+    payload = np.asarray(vector, dtype="<f4").tobytes()
+    return Binary(bytes((BSON_FLOAT32, 0)) + payload, VECTOR_SUBTYPE)
+
+
+def unpack_vector(data) -> np.ndarray:
+    data = bytes(data)
+    if data[0] == BSON_FLOAT32:
+        return np.frombuffer(data, dtype="<f4", offset=2)
+    if data[0] == BSON_INT8:
+        return np.frombuffer(data, dtype=np.int8, offset=2).astype(np.float32)
+    raise ValueError(f"Unsupported BSON vector dtype 0x{data[0]:02x}")
+
+
+def normalize_rows(vectors):
+    """Unit-length float32 rows (in place when possible) and their original L2 norms."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) if vectors.size else np.zeros(len(vectors), dtype=np.float32)
+    vectors /= np.where(norms == 0, 1, norms)[:, None]
+    return vectors, norms.astype(np.float32)
+
+
+class VectorCodec:
+    """
+    Compact in-memory form of unit embeddings. Optionally projects onto the top principal components,
+    then stores float32 / float16 / int8 codes (int8 with one scale per row) plus a float32 factor per
+    row, precomputed so that `codes @ query * factor` is the cosine similarity of the decoded vector -
+    no norm is computed at query time.
+    """
+
+    def __init__(self, dtype="float32", components=None, mean=None):
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype {dtype!r}, expected one of {', '.join(VECTOR_DTYPES)}")
+        self.dtype = dtype
+        self.components = components
+        self.mean = mean
+
+    @classmethod
+    def fit(cls, vectors, dtype="float32", dimensions=0):
+        """PCA is fitted on (a sample of) the given unit vectors; dimensions=0 keeps the full space."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not dimensions or dimensions >= vectors.shape[1] or len(vectors) < 2:
+            return cls(dtype)
+        sample = vectors
+        if len(vectors) > PCA_SAMPLE_SIZE:
+            sample = vectors[np.random.default_rng(0).choice(len(vectors), PCA_SAMPLE_SIZE, replace=False)]
+        mean = sample.mean(axis=0)
+        # Wektory własne macierzy kowariancji (d x d) - tańsze niż SVD całej próbki przy 1536 wymiarach
+        centered = sample - mean
+        _, eigenvectors = np.linalg.eigh(centered.T @ centered)
+        components = np.ascontiguousarray(eigenvectors[:, ::-1][:, :min(dimensions, len(sample))].T)
+        return cls(dtype, components.astype(np.float32), mean.astype(np.float32))
+
+    @property
+    def dimensions(self):
+        return None if self.components is None else len(self.components)
+
+    def project(self, vectors):
+        """Raw embeddings -> unit float32 rows in the space the codes live in."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if self.components is not None:
+            vectors = (vectors - self.mean) @ self.components.T
+        return normalize_rows(vectors.copy())[0]
+
+    def encode(self, vectors):
+        """Unit rows from project() -> (codes, factors)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1, initial=0.0) / 127
+            scales[scales == 0] = 1.0
+            codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+            decoded_norms = np.linalg.norm(codes.astype(np.float32), axis=1) * scales
+            factors = scales / np.where(decoded_norms == 0, 1, decoded_norms)
+        else:
+            codes = vectors.astype(np.float16) if self.dtype == "float16" else vectors.copy()
+            norms = np.linalg.norm(codes.astype(np.float32), axis=1)
+            factors = 1 / np.where(norms == 0, 1, norms)
+        return codes, factors.astype(np.float32)
+
+    def decode(self, codes, factors):
+        return np.asarray(codes, dtype=np.float32) * np.asarray(factors)[:, None]
+
+    def scores(self, codes, factors, queries):
+        """(q, n) cosine similarities of prepared queries against encoded rows."""
+        if self.dtype == "float32":
+            return (queries @ codes.T) * factors
+        # Małe bloki konwertowane do jednego bufora mieszczą się w cache - int8 jest wtedy tak szybki jak float32
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        buffer = np.empty((min(SCORE_BLOCK_ROWS, len(codes)), codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            widened = buffer[:len(block)]
+            np.copyto(widened, block, casting="unsafe")
+            scores[:, start:start + len(block)] = queries @ widened.T
+        return scores * factors
+
@@ -0,0 +1,5 @@
+from .loaders import load_documents
+from .chunker import chunk_documents, chunk_page, content_hash
+from .pipeline import IngestionPipeline
+
+__all__ = ['load_documents', 'chunk_documents', 'chunk_page', 'content_hash', 'IngestionPipeline']
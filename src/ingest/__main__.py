@@ -0,0 +1,41 @@
+import argparse
+import asyncio
+import json
+from src.config import EMBEDDING_BATCH_SIZE, INGEST_CONCURRENCY, INGEST_CHUNK_WORDS, INGEST_CHUNK_OVERLAP_WORDS
+from src.ingest.pipeline import IngestionPipeline
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load PDF, text and JSONL files into the knowledge base collection.")
+    parser.add_argument("paths", nargs="*", help="files or directories to ingest")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_BATCH_SIZE, help="inputs per embedding request")
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY, help="embedding requests in flight")
+    parser.add_argument("--chunk-words", type=int, default=INGEST_CHUNK_WORDS)
+    parser.add_argument("--overlap", type=int, default=INGEST_CHUNK_OVERLAP_WORDS)
+    parser.add_argument("--prune", action="store_true",
+                        help="delete chunks of the ingested files that are no longer in them")
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be embedded")
+    parser.add_argument("--pack-vectors", action="store_true",
+                        help="add the packed (BSON binary) vector to documents ingested without it")
+    args = parser.parse_args()
+    if not args.paths and not args.pack_vectors:
+        parser.error("give files to ingest and / or --pack-vectors")
+    return args
+
+
+async def main():
+    args = parse_args()
+    pipeline = IngestionPipeline(batch_size=args.batch_size, concurrency=args.concurrency,
+                                 chunk_words=args.chunk_words, overlap=args.overlap, dry_run=args.dry_run)
+    try:
+        stats = await pipeline.run(args.paths, prune=args.prune) if args.paths else {}
+        if args.pack_vectors and not args.dry_run:
+            stats["packed"] = await pipeline.mongodb_client.abackfill_packed_vectors()
+    finally:
+        pipeline.mongodb_client.close()
+        await pipeline.openai_client.aclose()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
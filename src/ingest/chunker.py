@@ -0,0 +1,33 @@
+import hashlib
+from src.config import INGEST_CHUNK_WORDS, INGEST_CHUNK_OVERLAP_WORDS
+
+
+def content_hash(title, page_number, content) -> str:
+    normalized = " ".join(content.split())
+    return hashlib.sha256(f"{title}\x00{page_number}\x00{normalized}".encode("utf-8")).hexdigest()
+
+
+def chunk_page(page, chunk_words=INGEST_CHUNK_WORDS, overlap=INGEST_CHUNK_OVERLAP_WORDS):
+    """Splits one page into overlapping word windows ready to be stored next to their embedding."""
+    words = page["text"].split()
+    if not words:
+        return
+    step = max(chunk_words - overlap, 1)
+    for start in range(0, len(words), step):
+        content = " ".join(words[start:start + chunk_words])
+        yield {
+            "title": page["title"],
+            "pageNumber": page["pageNumber"],
+            "content": content,
+            # Ta sama definicja co dawne $split po spacji w $project - wyniki się nie zmieniają
+            "wordCount": len(content.split(" ")),
+            "contentHash": content_hash(page["title"], page["pageNumber"], content),
+            "source": page["source"],
+        }
+        if start + chunk_words >= len(words):
+            break
+
+
+def chunk_documents(pages, chunk_words=INGEST_CHUNK_WORDS, overlap=INGEST_CHUNK_OVERLAP_WORDS):
+    for page in pages:
+        yield from chunk_page(page, chunk_words, overlap)
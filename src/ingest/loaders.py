@@ -0,0 +1,72 @@
+import json
+import os
+from src.logger import main_logger
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF support is optional: pip install pypdf
+    PdfReader = None
+
+TEXT_EXTENSIONS = {".txt", ".md"}
+
+
+def load_pdf(path):
+    if PdfReader is None:
+        raise RuntimeError("PDF ingestion needs the pypdf package (pip install pypdf)")
+    title = os.path.splitext(os.path.basename(path))[0]
+    reader = PdfReader(path)
+    for page_number, page in enumerate(reader.pages, 1):
+        yield {"title": title, "pageNumber": page_number, "text": page.extract_text() or "", "source": path}
+
+
+def load_text(path):
+    # Znak \f (form feed) traktujemy jako granicę strony, np. w plikach z pdftotext
+    title = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8") as file:
+        for page_number, text in enumerate(file.read().split("\f"), 1):
+            yield {"title": title, "pageNumber": page_number, "text": text, "source": path}
+
+
+def load_jsonl(path):
+    """One record per line: {"content" or "text", "title", "pageNumber"}; missing fields get defaults."""
+    title = os.path.splitext(os.path.basename(path))[0]
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                main_logger.warning(f"⚠️ Skipping invalid JSON in {path}:{line_number}: {e}")
+                continue
+            yield {
+                "title": record.get("title", title),
+                "pageNumber": record.get("pageNumber", line_number),
+                "text": record.get("content", record.get("text", "")),
+                "source": path,
+            }
+
+
+def iter_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def load_documents(paths):
+    """Streams pages from files and directories, one dict per page, without reading everything up front."""
+    for path in iter_files(paths):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".pdf":
+            yield from load_pdf(path)
+        elif extension == ".jsonl":
+            yield from load_jsonl(path)
+        elif extension in TEXT_EXTENSIONS:
+            yield from load_text(path)
+        else:
+            main_logger.info(f"⏭️ Skipping unsupported file: {path}")
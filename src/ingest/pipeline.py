@@ -0,0 +1,101 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from src.config import EMBEDDING_BATCH_SIZE, INGEST_CONCURRENCY, INGEST_CHUNK_WORDS, INGEST_CHUNK_OVERLAP_WORDS
+from src.database.mongodb_client import MongoDBClient, vector_fields
+from src.ai.openai_client import OpenAIClient
+from src.ingest.loaders import load_documents
+from src.ingest.chunker import chunk_documents
+from src.logger import main_logger
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestionPipeline:
+    """
+    Loads files, chunks them and stores the chunks with their embeddings in the Cosmos collection.
+    Chunks are keyed by contentHash, so re-running over the same files only embeds what changed.
+    Up to `concurrency` embedding batches are in flight at once; pages are streamed, not read up front.
+    """
+
+    def __init__(self, mongodb_client=None, openai_client=None, batch_size=EMBEDDING_BATCH_SIZE,
+                 concurrency=INGEST_CONCURRENCY, chunk_words=INGEST_CHUNK_WORDS,
+                 overlap=INGEST_CHUNK_OVERLAP_WORDS, dry_run=False):
+        self.mongodb_client = mongodb_client or MongoDBClient()
+        self.openai_client = openai_client or OpenAIClient()
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.dry_run = dry_run
+        self.seen_hashes = set()
+        self.sources = set()
+        self.stats = {"chunks": 0, "unchanged": 0, "embedded": 0, "inserted": 0, "deleted": 0}
+
+    async def _process_batch(self, batch):
+        hashes = [chunk["contentHash"] for chunk in batch]
+        existing = await self.mongodb_client.afind_content_hashes(hashes)
+        new_chunks = [chunk for chunk in batch if chunk["contentHash"] not in existing]
+        self.stats["unchanged"] += len(batch) - len(new_chunks)
+        if not new_chunks:
+            return
+        self.stats["embedded"] += len(new_chunks)
+        if self.dry_run:
+            return
+
+        vectors = await self.openai_client.agenerate_embeddings_batch([chunk["content"] for chunk in new_chunks],
+                                                                      batch_size=self.batch_size)
+        created_at = datetime.now(timezone.utc)
+        documents = [{**chunk, **vector_fields(vector), "createdAt": created_at}
+                     for chunk, vector in zip(new_chunks, vectors)]
+        self.stats["inserted"] += await self.mongodb_client.abulk_upsert_documents(documents)
+        main_logger.info(f"📥 Ingested {len(documents)} chunks ({self.stats['inserted']} new so far)")
+
+    def _chunks(self, paths):
+        for chunk in chunk_documents(load_documents(paths), self.chunk_words, self.overlap):
+            self.sources.add(chunk["source"])
+            # Ten sam fragment dwa razy w jednym przebiegu (np. powtórzona stopka) zapisujemy raz
+            if chunk["contentHash"] in self.seen_hashes:
+                continue
+            self.seen_hashes.add(chunk["contentHash"])
+            self.stats["chunks"] += 1
+            yield chunk
+
+    async def run(self, paths, prune=False) -> dict:
+        started = time.perf_counter()
+        if not self.dry_run:
+            await self.mongodb_client.aensure_content_hash_index()
+
+        pending = set()
+        try:
+            for batch in batched(self._chunks(paths), self.batch_size):
+                while len(pending) >= self.concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                pending.add(asyncio.create_task(self._process_batch(batch)))
+            if pending:
+                for task in asyncio.as_completed(pending):
+                    await task
+        except BaseException:
+            for task in pending:
+                task.cancel()
+            raise
+
+        if prune and not self.dry_run:
+            self.stats["deleted"] = await self.mongodb_client.adelete_stale_documents(self.sources, self.seen_hashes)
+        if self.stats["inserted"] and not self.dry_run:
+            # Nowa kolekcja nie ma jeszcze indeksu wektorowego - tworzymy go od razu
+            await self.mongodb_client.aensure_vector_search_index(force=True)
+
+        main_logger.info(f"✅ Ingestion finished in {time.perf_counter() - started:.1f}s: {self.stats}")
+        return self.stats
@@ -1,49 +1,122 @@
+import atexit
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
 import pytz
+from src.config import LOG_DIR, LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_ENABLED
 
 # Define the timezone for Poland
 POLAND_TZ = pytz.timezone('Europe/Warsaw')
 
+# Atrybuty każdego LogRecord - reszta to pola przekazane przez extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
 
 class PolandFormatter(logging.Formatter):
+    """ISO timestamps in Europe/Warsaw; the timezone conversion is done once per second instead of per record."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached = (None, "", "")
+
     def formatTime(self, record, datefmt=None):
-        # Convert the timestamp to the Poland timezone
-        dt = datetime.fromtimestamp(record.created, POLAND_TZ)
         if datefmt:
-            s = dt.strftime(datefmt)
-        else:
-            try:
-                s = dt.isoformat(timespec='milliseconds')
-            except TypeError:
-                s = dt.isoformat()
-        return s
+            return datetime.fromtimestamp(record.created, POLAND_TZ).strftime(datefmt)
+        second = int(record.created)
+        cached_second, date, offset = self._cached
+        if second != cached_second:
+            # "2024-05-01T12:00:00+02:00" -> data do sekundy + przesunięcie strefy (zmienia się przy DST)
+            stamp = datetime.fromtimestamp(second, POLAND_TZ).isoformat()
+            date, offset = stamp[:19], stamp[19:]
+            self._cached = (second, date, offset)
+        return f"{date}.{int(record.msecs):03d}{offset}"
 
 
-def setup_logger(name, log_file, level=logging.INFO):
-    logger = logging.getLogger(name)
-    if logger.hasHandlers():
-        formatter = PolandFormatter('%(asctime)s %(levelname)s %(message)s')
+class JsonFormatter(PolandFormatter):
+    """One JSON object per line, fields passed with extra={...} included."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LoggerRoutingListener(QueueListener):
+    """
+    A single background thread writing records of all loggers: each record goes only to the handlers
+    registered for its logger (its own rotating file + the shared console).
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue, respect_handler_level=True)
+        self.routes = {}
+
+    def handle(self, record):
+        record = self.prepare(record)
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
 
-        file_handler = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5)
+def create_formatter():
+    if LOG_FORMAT == 'json':
+        return JsonFormatter()
+    return PolandFormatter('%(asctime)s %(levelname)s %(message)s')
+
+
+formatter = create_formatter()
+
+# Add console handler
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(formatter)
+console_handler.encoding = 'utf-8'
+
+log_queue = queue.SimpleQueue()
+listener = LoggerRoutingListener(log_queue) if LOG_QUEUE_ENABLED else None
+# Handlery (zapis na dysk, konsola) działają w wątku listenera - pętla zdarzeń tylko wrzuca rekord do kolejki
+queue_handler = QueueHandler(log_queue)
+
+
+def setup_logger(name, log_file, level=LOG_LEVEL):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        file_handler = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8')
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers = [file_handler, console_handler]
 
-        # Add console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        console_handler.encoding = 'utf-8'
-        logger.addHandler(console_handler)
+        if listener is not None:
+            listener.routes[name] = handlers
+            logger.addHandler(queue_handler)
+        else:
+            for handler in handlers:
+                logger.addHandler(handler)
+        logger.propagate = False
 
     logger.setLevel(level)
 
     return logger
 
 
+def stop_logging():
+    """Flushes the queued records; safe to call more than once."""
+    if listener is not None and listener._thread is not None:
+        listener.stop()
+
+
 # Ensure log directory exists
-log_dir = "logs"
+log_dir = LOG_DIR
 os.makedirs(log_dir, exist_ok=True)
 
 # Create loggers
@@ -52,3 +125,7 @@ mysql_logger = setup_logger('[Mysql]', os.path.join(log_dir, 'mysql.log'))
 cosmosdb_logger = setup_logger('[Cosmosdb]', os.path.join(log_dir, 'cosmosdb.log'))
 openai_logger = setup_logger('[Openai]', os.path.join(log_dir, 'openai.log'))
 whatsapp_logger = setup_logger('[Whatsapp]', os.path.join(log_dir, 'whatsapp.log'))
+
+if listener is not None:
+    listener.start()
+    atexit.register(stop_logging)
@@ -0,0 +1,186 @@
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from src.config import METRICS_ENABLED, METRICS_WINDOW, OTEL_ENABLED, OTEL_SERVICE_NAME
+from src.logger import main_logger
+
+# Granice kubełków w sekundach - od trafień w cache (ms) po długie odpowiedzi gpt-4o
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+tracer = None
+if OTEL_ENABLED:
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+        tracer = trace.get_tracer("whatsapp-rag")
+    except ImportError as e:
+        main_logger.warning(f"⚠️ OTEL_ENABLED is set but OpenTelemetry packages are missing: {e}")
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Histogram:
+    """Cumulative buckets for Prometheus plus a sliding window of recent samples for p50 / p95 / p99."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=METRICS_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self):
+        if not self.recent:
+            return {}
+        ordered = sorted(self.recent)
+        return {q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] for q in QUANTILES}
+
+
+class MetricsRegistry:
+    """
+    Process-wide store for stage timings and counters. Components with their own stats() are
+    registered as collectors and read only when /metrics is scraped.
+    """
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled or not value:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def register_collector(self, collector):
+        """`collector()` returns [(name, labels dict, value)] and is called on every scrape."""
+        self._collectors.append(collector)
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        """Times a pipeline stage into rag_stage_duration_seconds{stage=...} (and an OpenTelemetry span if enabled)."""
+        if not self.enabled:
+            yield
+            return
+        otel_span = tracer.start_as_current_span(stage, attributes=attributes) if tracer else None
+        started = time.perf_counter()
+        try:
+            if otel_span is not None:
+                with otel_span:
+                    yield
+            else:
+                yield
+        finally:
+            self.observe("rag_stage_duration_seconds", time.perf_counter() - started, stage=stage)
+
+    def timed(self, stage):
+        """Decorator version of span() for coroutine functions."""
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return await func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets_of(histogram), histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        for (name, labels), histogram in histograms:
+            if f"{name}_recent" not in typed:
+                # Kwantyle z ostatnich METRICS_WINDOW próbek - do szybkiego podglądu bez PromQL
+                lines.append(f"# TYPE {name}_recent gauge")
+                typed.add(f"{name}_recent")
+            for quantile, value in histogram.quantiles().items():
+                lines.append(f"{name}_recent{_format_labels(labels + (('quantile', quantile),))} {value}")
+
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        # Próbki jednej metryki muszą stać razem (np. mysql_pool_* zbierane pula po puli)
+        gauges = {}
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                main_logger.error(f"❌ Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, labels, value in samples:
+                gauges.setdefault(name, []).append((tuple(sorted(labels.items())), value))
+        for name, samples in gauges.items():
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def buckets_of(histogram):
+        return [*histogram.buckets, "+Inf"]
+
+
+def stats_samples(prefix, stats, **labels):
+    """Turns a flat stats() dict into gauge samples, skipping non-numeric values."""
+    return [(f"{prefix}_{key}", labels, value) for key, value in stats.items()
+            if isinstance(value, (int, float))]
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,57 @@
+"""
+Production entry point: serves main:app with WEB_WORKERS Hypercorn worker processes sharing one socket.
+
+    python -m src.server
+
+The parent process only reads the configuration and supervises; every worker imports the application
+and runs its own startup (pools, indexes, HTTP sessions) in parallel with the others. Read-only data
+is shared through the filesystem: local vector / lexical index snapshots are memory-mapped by every
+worker (built once under a file lock) and the embedding cache lives in one SQLite file.
+"""
+import os
+from hypercorn.config import Config
+from hypercorn.run import run
+from src.config import PORT, WEB_WORKERS, WEB_GRACEFUL_TIMEOUT
+from src.logger import main_logger
+
+SHARED_EMBEDDING_CACHE_PATH = os.path.join("data", "embedding_cache.sqlite")
+
+
+def worker_count() -> int:
+    return WEB_WORKERS if WEB_WORKERS > 0 else os.cpu_count() or 1
+
+
+def configure_workers(workers: int):
+    """Defaults for state that must not diverge between processes; explicit env settings always win."""
+    if workers <= 1:
+        return
+    # Wiadomości jednego nadawcy mogą trafić do różnych workerów - lokalna kopia historii byłaby nieaktualna
+    os.environ.setdefault("HISTORY_CACHE_ENABLED", "false")
+    # Ponowna dostawa od Meta może trafić do innego workera - zajęcie id musi być widoczne dla wszystkich
+    os.environ.setdefault("DEDUP_USE_MYSQL", "true")
+    # Wspólny plik SQLite zamiast osobnej kopii embeddingów w pamięci każdego workera
+    if "EMBEDDING_CACHE_PATH" not in os.environ:
+        os.makedirs(os.path.dirname(SHARED_EMBEDDING_CACHE_PATH), exist_ok=True)
+        os.environ["EMBEDDING_CACHE_PATH"] = SHARED_EMBEDDING_CACHE_PATH
+
+
+def create_config(workers: int) -> Config:
+    config = Config()
+    config.application_path = "main:app"
+    config.bind = [f"0.0.0.0:{PORT}"]
+    # 0 = aplikacja działa w tym samym procesie, bez procesu nadzorującego
+    config.workers = workers if workers > 1 else 0
+    config.graceful_timeout = WEB_GRACEFUL_TIMEOUT
+    config.accesslog = None
+    return config
+
+
+def main():
+    workers = worker_count()
+    configure_workers(workers)
+    main_logger.info(f"🚀 Starting {workers} worker process(es) on port {PORT}")
+    run(create_config(workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 from .whatsapp_client import WhatsAppClient
+from .message_chunker import MessageChunker
 
-__all__ = ['WhatsAppClient']
\ No newline at end of file
+__all__ = ['WhatsAppClient', 'MessageChunker']
\ No newline at end of file
@@ -0,0 +1,49 @@
+import re
+from src.config import STREAM_MIN_CHUNK_CHARS, WHATSAPP_MAX_MESSAGE_CHARS
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"[.!?…](?=\s)")
+
+
+class MessageChunker:
+    """
+    Collects streamed completion deltas and cuts them into WhatsApp-sized messages on paragraph
+    or sentence boundaries. Pieces shorter than `min_chars` are held back, so users don't get a
+    separate message for every sentence.
+    """
+
+    def __init__(self, min_chars=STREAM_MIN_CHUNK_CHARS, max_chars=WHATSAPP_MAX_MESSAGE_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buffer = ""
+
+    def _boundary(self):
+        paragraphs = [m.end() for m in PARAGRAPH_BREAK.finditer(self._buffer)
+                      if self.min_chars <= m.start() and m.end() <= self.max_chars]
+        if paragraphs:
+            return paragraphs[-1]
+        sentences = [m.end() for m in SENTENCE_END.finditer(self._buffer)
+                     if self.min_chars <= m.end() <= self.max_chars]
+        if sentences:
+            return sentences[-1]
+        if len(self._buffer) > self.max_chars:
+            # Brak granicy zdania w limicie WhatsAppa - tniemy na ostatniej spacji
+            cut = self._buffer.rfind(" ", 0, self.max_chars)
+            return cut if cut > 0 else self.max_chars
+        return None
+
+    def feed(self, delta):
+        self._buffer += delta
+        chunks = []
+        while True:
+            boundary = self._boundary()
+            if boundary is None:
+                break
+            chunk, self._buffer = self._buffer[:boundary].strip(), self._buffer[boundary:].lstrip()
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def flush(self):
+        chunk, self._buffer = self._buffer.strip(), ""
+        return chunk or None
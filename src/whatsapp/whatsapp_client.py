@@ -1,13 +1,100 @@
 import requests
+import asyncio
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from src.logger import whatsapp_logger
+from src.metrics import metrics
 import aiohttp
-from src.config import META_ENDPOINT, PHONE_NUMBER_ID, ACCESS_TOKEN
+from src.config import META_ENDPOINT, PHONE_NUMBER_ID, ACCESS_TOKEN, WHATSAPP_POOL_LIMIT, WHATSAPP_DNS_CACHE_TTL, \
+    WHATSAPP_KEEPALIVE_TIMEOUT, WHATSAPP_REQUEST_TIMEOUT, WHATSAPP_CONNECT_TIMEOUT, WHATSAPP_MAX_RETRIES, \
+    WHATSAPP_BACKOFF_BASE, WHATSAPP_BACKOFF_MAX
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    delay = min(WHATSAPP_BACKOFF_MAX, WHATSAPP_BACKOFF_BASE * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
 
 
 class WhatsAppClient:
-    @staticmethod
-    async def send_message(ai_response, sender_phone_number):
+    # Jedna sesja (i pula połączeń keep-alive do Graph API) na cały cykl życia aplikacji
+    _session = None
+
+    @classmethod
+    async def start(cls, ssl=None):
+        if cls._session is not None and not cls._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=WHATSAPP_POOL_LIMIT,
+            ttl_dns_cache=WHATSAPP_DNS_CACHE_TTL,
+            keepalive_timeout=WHATSAPP_KEEPALIVE_TIMEOUT,
+            ssl=ssl
+        )
+        cls._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=WHATSAPP_REQUEST_TIMEOUT, sock_connect=WHATSAPP_CONNECT_TIMEOUT),
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {ACCESS_TOKEN}'
+            }
+        )
+        whatsapp_logger.info(f'🔌 WhatsApp HTTP session opened (pool limit: {WHATSAPP_POOL_LIMIT})')
+
+    @classmethod
+    async def close(cls):
+        if cls._session is not None and not cls._session.closed:
+            await cls._session.close()
+            whatsapp_logger.info('🚪 WhatsApp HTTP session closed')
+        cls._session = None
+
+    @classmethod
+    async def _post(cls, payload, description):
+        if cls._session is None or cls._session.closed:
+            await cls.start()
         url = f'{META_ENDPOINT}{PHONE_NUMBER_ID}/messages'
+
+        for attempt in range(WHATSAPP_MAX_RETRIES + 1):
+            try:
+                async with cls._session.post(url, json=payload) as response:
+                    if response.status == 200:
+                        return True
+                    if response.status in RETRYABLE_STATUSES and attempt < WHATSAPP_MAX_RETRIES:
+                        delay = parse_retry_after(response.headers.get('Retry-After'))
+                        delay = backoff_delay(attempt) if delay is None else min(delay, WHATSAPP_BACKOFF_MAX)
+                        whatsapp_logger.warning(f'⏳ {description} got {response.status}, retrying in {delay:.2f}s '
+                                                f'(attempt {attempt + 1}/{WHATSAPP_MAX_RETRIES})')
+                        await asyncio.sleep(delay)
+                        continue
+                    whatsapp_logger.error(f'❌ Failed to {description}: {response.status} {response.reason}.')
+                    return False
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt < WHATSAPP_MAX_RETRIES:
+                    delay = backoff_delay(attempt)
+                    whatsapp_logger.warning(f'⏳ {description} failed ({e!r}), retrying in {delay:.2f}s')
+                    await asyncio.sleep(delay)
+                    continue
+                whatsapp_logger.error(f'❌ Failed to {description}: {e!r}')
+                return False
+        return False
+
+    @classmethod
+    async def send_message(cls, ai_response, sender_phone_number):
         payload = {
             'messaging_product': 'whatsapp',
             'recipient_type': 'individual',
@@ -18,13 +105,19 @@ class WhatsAppClient:
                 'body': ai_response,
             },
         }
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {ACCESS_TOKEN}'
+        with metrics.span("whatsapp_send"):
+            sent = await cls._post(payload, 'send message')
+        if sent:
+            whatsapp_logger.info('✅ AI answer sent successfully!')
+
+    @classmethod
+    async def send_typing_indicator(cls, message_id):
+        # Marks the incoming message as read and shows "typing..." until we reply (max ~25 s)
+        payload = {
+            'messaging_product': 'whatsapp',
+            'status': 'read',
+            'message_id': message_id,
+            'typing_indicator': {'type': 'text'},
         }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                if response.status == 200:
-                    whatsapp_logger.info('✅ AI answer sent successfully!')
-                else:
-                    whatsapp_logger.error(f'❌ Failed to send message: {response.status} {response.reason}.')
+        if await cls._post(payload, 'send typing indicator'):
+            whatsapp_logger.info('⌨️ Typing indicator sent')
@@ -0,0 +1,71 @@
+import pytest
+from src.ai import context_builder
+from src.ai.context_builder import build_context, count_tokens, format_document, trim_history
+from src.ai.rag_engine import prepare_messages
+from src.config import HISTORY_TOKEN_BUDGET
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # Liczymy szacunkowo (4 znaki = 1 token) - wynik nie zależy od tego, czy plik BPE tiktoken jest dostępny
+    monkeypatch.setattr(context_builder, "_encoding", None)
+    monkeypatch.setattr(context_builder, "_encoding_loaded", True)
+    count_tokens.cache_clear()
+    yield
+    count_tokens.cache_clear()
+
+
+def chunk(number, words=40):
+    return {"_id": number, "title": f"Usługa {number}", "pageNumber": number,
+            "content": " ".join(f"słowo{number}x{i}" for i in range(words)), "wordCount": words}
+
+
+def turn(number, words=60):
+    return {"query": f"Pytanie {number}?", "answer": " ".join(f"odpowiedź{number}x{i}" for i in range(words))}
+
+
+def test_history_is_cut_before_retrieved_chunks():
+    results = [chunk(number) for number in range(3)]
+    history = [turn(number) for number in range(30)]  # newest-first, jak z get_recent_queries
+    assert sum(count_tokens(entry["query"]) + count_tokens(entry["answer"]) for entry in history) > HISTORY_TOKEN_BUDGET
+
+    messages = prepare_messages(build_context(results), "Co dalej?", history)
+
+    # Wszystkie pobrane fragmenty zostają w kontekście, z historii odpadają najstarsze tury
+    assert all(result["content"] in messages[0]["content"] for result in results)
+    asked = [message["content"] for message in messages if message["role"] == "user"][:-1]
+    assert 0 < len(asked) < len(history)
+    assert asked == [entry["query"] for entry in reversed(history[:len(asked)])]
+
+
+def test_trim_history_keeps_the_newest_turns_within_budget():
+    history = [turn(number) for number in range(10)]
+    per_turn = count_tokens(history[0]["query"]) + count_tokens(history[0]["answer"])
+
+    kept = trim_history(history, budget=per_turn * 3 + 1)
+
+    assert kept == history[:3]
+    assert trim_history(history, budget=0) == []
+
+
+def test_single_chunk_over_budget_is_truncated_not_dropped():
+    long_chunk = chunk(1, words=2000)
+    budget = 200
+
+    context = build_context([long_chunk], budget=budget)
+
+    assert "Title: Usługa 1" in context
+    assert "słowo1x0 słowo1x1" in context
+    assert long_chunk["content"] not in context
+    assert count_tokens(context) <= budget
+
+
+def test_chunks_fill_the_budget_in_relevance_order():
+    results = [chunk(1, words=20), chunk(2, words=400), chunk(3, words=20)]
+    small = count_tokens(format_document(results[0]))
+
+    context = build_context(results, budget=small * 2 + 5)
+
+    # Za długi drugi fragment jest pomijany, krótszy i mniej trafny trzeci się jeszcze mieści
+    assert "Usługa 1" in context and "Usługa 3" in context
+    assert "Usługa 2" not in context
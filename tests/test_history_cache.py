@@ -0,0 +1,107 @@
+import asyncio
+import pytest
+from src.database import history_cache as history_cache_module
+from src.database import mysql_queries
+from src.database.history_cache import ChatHistoryCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(history_cache_module, "time", fake)
+    return fake
+
+
+def row(number, age=0):
+    return {"query": f"Pytanie {number}?", "answer": f"Odpowiedź {number}.", "created_at": "2024-01-01T12:00:00",
+            "age_seconds": age}
+
+
+def queries(history):
+    return [entry["query"] for entry in history]
+
+
+def test_answers_written_before_the_first_load_are_not_trusted(clock):
+    cache = ChatHistoryCache(max_turns=5, ttl=600)
+    cache.append(48111, "Pytanie 3?", "Odpowiedź 3.")
+    # Bez wczytania z MySQL nie wiadomo, czy to cała rozmowa
+    assert cache.get(48111) is None
+
+    cache.load(48111, [row(2), row(1)])
+    cache.append(48111, "Pytanie 3?", "Odpowiedź 3.")
+    assert queries(cache.get(48111)) == ["Pytanie 3?", "Pytanie 2?", "Pytanie 1?"]
+
+
+def test_ring_buffer_keeps_the_newest_turns(clock):
+    cache = ChatHistoryCache(max_turns=3, ttl=600)
+    cache.load(48111, [])
+    for number in range(5):
+        cache.append(48111, f"Pytanie {number}?", f"Odpowiedź {number}.")
+    assert queries(cache.get(48111)) == ["Pytanie 4?", "Pytanie 3?", "Pytanie 2?"]
+
+
+def test_turns_expire_after_ttl_counted_from_the_original_write(clock):
+    cache = ChatHistoryCache(max_turns=5, ttl=600)
+    cache.load(48111, [row(2, age=100), row(1, age=500)])
+
+    clock.now += 200
+    assert queries(cache.get(48111)) == ["Pytanie 2?"]
+
+    clock.now += 400
+    assert cache.get(48111) == []
+    assert cache.stats()["bytes"] == 0
+
+
+def test_least_recently_used_sender_is_evicted_over_the_byte_limit(clock):
+    one_sender = ChatHistoryCache(max_turns=5, ttl=600)
+    one_sender.load(1, [row(1)])
+    cache = ChatHistoryCache(max_turns=5, ttl=600, max_bytes=one_sender.stats()["bytes"] * 2)
+
+    cache.load(48111, [row(1)])
+    cache.load(48222, [row(1)])
+    cache.get(48111)  # 48111 używany ostatnio - odpada 48222
+    cache.load(48333, [row(1)])
+
+    assert cache.get(48222) is None
+    assert cache.get(48111) is not None and cache.get(48333) is not None
+    assert cache.stats()["users"] == 2
+
+
+def test_history_is_filled_on_write_and_served_without_mysql(clock, monkeypatch):
+    cache = ChatHistoryCache(max_turns=5, ttl=600)
+    fetches = []
+
+    async def fetch_recent_queries(number):
+        fetches.append(number)
+        return [row(1, age=30)]
+
+    async def insert_or_get_user(number):
+        return 1
+
+    async def insert_query(user_id, query, answer):
+        pass
+
+    monkeypatch.setattr(mysql_queries, "HISTORY_CACHE_ENABLED", True)
+    monkeypatch.setattr(mysql_queries, "history_cache", cache)
+    monkeypatch.setattr(mysql_queries, "flush_task", None)
+    monkeypatch.setattr(mysql_queries, "fetch_recent_queries", fetch_recent_queries)
+    monkeypatch.setattr(mysql_queries, "insert_or_get_user", insert_or_get_user)
+    monkeypatch.setattr(mysql_queries, "insert_query", insert_query)
+
+    async def conversation():
+        first = await mysql_queries.get_recent_queries(48111)
+        await mysql_queries.insert_data_mysql(48111, "Pytanie 2?", "Odpowiedź 2.")
+        return first, await mysql_queries.get_recent_queries(48111)
+
+    first, second = asyncio.run(conversation())
+    assert queries(first) == ["Pytanie 1?"]
+    assert queries(second) == ["Pytanie 2?", "Pytanie 1?"]
+    assert fetches == [48111]
@@ -0,0 +1,121 @@
+import base64
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from src.database.local_index import LocalVectorIndex
+from src.database.vectors import VectorCodec, as_float32, pack_vector, unpack_vector
+
+DIMENSIONS = 64
+START = datetime(2024, 1, 1)
+
+
+class FakeMongoDBClient:
+    """fetch_documents / count_documents over a list, like the in-memory collection the local index syncs from."""
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def fetch_documents(self, since=None, include_vectors=True):
+        return [dict(document) for document in self.documents if since is None or document["createdAt"] > since]
+
+    def count_documents(self):
+        return len(self.documents)
+
+
+def random_vectors(count, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, DIMENSIONS)).astype(np.float32)
+
+
+def make_documents(vectors, first=0):
+    return [{"_id": first + i, "title": f"doc {first + i}", "pageNumber": 1, "content": f"chunk {first + i}",
+             "createdAt": START + timedelta(seconds=first + i), "vector": vector}
+            for i, vector in enumerate(vectors)]
+
+
+def unit(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def brute_force_top(corpus, query, k):
+    return list(np.argsort(-(unit(corpus) @ (query / np.linalg.norm(query))))[:k])
+
+
+@pytest.mark.parametrize("dtype, min_cosine", [("float32", 0.99999), ("float16", 0.9999), ("int8", 0.999)])
+def test_codec_round_trip_keeps_the_direction(dtype, min_cosine):
+    vectors = random_vectors(50)
+    codec = VectorCodec(dtype)
+    codes, factors = codec.encode(codec.project(vectors))
+    decoded = codec.decode(codes, factors)
+    cosines = np.sum(unit(vectors) * unit(decoded), axis=1)
+    assert cosines.min() > min_cosine
+    # Czynnik wiersza sprowadza zdekodowany wektor do długości 1 - cosinus bez liczenia norm przy zapytaniu
+    assert np.allclose(np.linalg.norm(decoded, axis=1), 1, atol=1e-3)
+
+
+def test_packed_and_base64_vectors_decode_to_the_same_float32_array():
+    vector = random_vectors(1)[0]
+    assert np.array_equal(unpack_vector(pack_vector(vector)), vector)
+    assert np.array_equal(as_float32(bytes(pack_vector(vector))), vector)
+    assert np.array_equal(as_float32(base64.b64encode(vector.tobytes()).decode()), vector)
+
+
+@pytest.mark.parametrize("dtype, ivf_lists, ivf_probes, min_recall", [
+    ("float32", 0, 0, 1.0),
+    ("int8", 0, 0, 0.95),
+    ("float32", 8, 8, 1.0),  # wszystkie listy przeszukane = wynik dokładny
+    ("float32", 8, 4, 0.6),  # losowe wektory to najgorszy przypadek dla IVF
+])
+def test_recall_against_brute_force(tmp_path, dtype, ivf_lists, ivf_probes, min_recall):
+    corpus = random_vectors(400)
+    queries = random_vectors(20, seed=1)
+    index = LocalVectorIndex(str(tmp_path), ivf_lists=ivf_lists, ivf_probes=ivf_probes, dtype=dtype,
+                             pca_dimensions=0)
+    assert index.refresh(FakeMongoDBClient(make_documents(corpus)))
+
+    found = [[document["_id"] for document in index.search(query, num_results=10)] for query in queries]
+    expected = [brute_force_top(corpus, query, 10) for query in queries]
+    recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(found, expected)])
+    assert recall >= min_recall
+    if min_recall == 1.0:
+        assert found == expected
+
+
+def test_changed_codec_settings_rebuild_the_snapshot(tmp_path):
+    client = FakeMongoDBClient(make_documents(random_vectors(40)))
+    index = LocalVectorIndex(str(tmp_path), ivf_lists=0, dtype="float32", pca_dimensions=0)
+    index.refresh(client)
+    generation = index.generation
+
+    # Nowa wersja konfiguracji (np. po wdrożeniu) czyta ten sam katalog, ale snapshot ma inny kodek
+    rebuilt = LocalVectorIndex(str(tmp_path), ivf_lists=0, dtype="int8", pca_dimensions=16)
+    assert rebuilt.refresh(client)
+    assert rebuilt.generation != generation
+    assert rebuilt.codec.dtype == "int8" and rebuilt.codec.dimensions == 16
+    assert rebuilt.vectors.shape == (40, 16)
+
+
+def test_new_documents_are_appended_and_deleted_ones_force_a_rebuild(tmp_path):
+    corpus = random_vectors(30)
+    client = FakeMongoDBClient(make_documents(corpus[:20]))
+    index = LocalVectorIndex(str(tmp_path), ivf_lists=0, dtype="float32", pca_dimensions=0)
+    index.refresh(client)
+    assert not index.refresh(client)
+
+    client.documents += make_documents(corpus[20:], first=20)
+    assert index.refresh(client)
+    assert index.size == 30
+    assert index.search(corpus[25], num_results=1)[0]["_id"] == 25
+
+    del client.documents[:5]
+    assert index.refresh(client)
+    assert sorted(document["_id"] for document in index.documents) == list(range(5, 30))
+
+
+def test_empty_collection_gives_an_empty_index(tmp_path):
+    index = LocalVectorIndex(str(tmp_path), ivf_lists=8)
+    assert index.search(random_vectors(1)[0]) == []
+
+    index.refresh(FakeMongoDBClient([]))
+    assert index.size == 0
+    assert index.search(random_vectors(1)[0]) == []
+    assert index.search_batch([]) == []
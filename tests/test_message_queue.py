@@ -0,0 +1,89 @@
+import asyncio
+import src.api.dedup as dedup
+from src.api.dedup import MessageDeduplicator
+from src.api.message_queue import MessageQueue, SQLiteJobJournal
+
+
+def fake_mysql_claims(monkeypatch):
+    claimed = set()
+
+    async def claim_message_ids(message_ids):
+        fresh = set(message_ids) - claimed
+        claimed.update(fresh)
+        return fresh
+
+    monkeypatch.setattr(dedup, "claim_message_ids", claim_message_ids)
+    return claimed
+
+
+def test_job_replayed_after_crash_is_not_dropped_by_its_own_claim(tmp_path, monkeypatch):
+    fake_mysql_claims(monkeypatch)
+    path = str(tmp_path / "jobs.sqlite3")
+    deduplicator = MessageDeduplicator(use_mysql=True)
+    answered = []
+
+    async def crash_after_claim():
+        started = asyncio.Event()
+
+        async def handler(job):
+            await deduplicator.aclaim_messages(job["messages"], lambda: queue.checkpoint(job))
+            started.set()
+            await asyncio.Event().wait()  # proces ginie w trakcie generowania odpowiedzi
+
+        queue = MessageQueue(handler, workers=1, journal=SQLiteJobJournal(path))
+        await queue.start()
+        assert queue.submit({"sender": 48111, "messages": [{"id": "wamid.1", "text": "Cennik?"}]})
+        await started.wait()
+        await queue.stop(timeout=0)
+
+    async def replay():
+        async def handler(job):
+            messages = await deduplicator.aclaim_messages(job["messages"], lambda: queue.checkpoint(job))
+            answered.extend(message["id"] for message in messages)
+
+        queue = MessageQueue(handler, workers=1, journal=SQLiteJobJournal(path))
+        await queue.start()
+        await queue.stop()
+
+    asyncio.run(crash_after_claim())
+    asyncio.run(replay())
+
+    assert answered == ["wamid.1"]
+    assert SQLiteJobJournal(path).pending() == []
+
+
+def test_message_claimed_by_another_instance_is_dropped(monkeypatch):
+    claimed = fake_mysql_claims(monkeypatch)
+    claimed.add("wamid.2")
+    deduplicator = MessageDeduplicator(use_mysql=True)
+    messages = [{"id": "wamid.2", "text": "Hej"}, {"id": "wamid.3", "text": "Cennik?"}]
+
+    answered = asyncio.run(deduplicator.aclaim_messages(messages))
+
+    assert [message["id"] for message in answered] == ["wamid.3"]
+    assert deduplicator.stats()["suppressed_mysql"] == 1
+
+
+def test_quick_messages_are_journaled_on_receipt_and_merged_when_taken(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    handled = []
+
+    async def scenario():
+        async def handler(job):
+            handled.append([message["id"] for message in job["messages"]])
+
+        queue = MessageQueue(handler, workers=1, journal=SQLiteJobJournal(path), coalesce_window=0.1,
+                             coalesce_max_wait=1)
+        await queue.start()
+        for number in range(3):
+            assert queue.submit({"sender": 48111, "messages": [{"id": f"wamid.{number}", "text": "..."}]})
+            await asyncio.sleep(0.02)
+        # Jeszcze w oknie koalescencji - każda wiadomość jest już osobnym wpisem w dzienniku
+        assert len(queue.journal.pending()) == 3
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+    assert handled == [["wamid.0", "wamid.1", "wamid.2"]]
+    assert stats["coalesced"] == 2
+    assert SQLiteJobJournal(path).pending() == []
@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime
+import pytest
+from asyncmy.errors import DataError, OperationalError
+from src.database import mysql_queries
+
+
+class FakeCursor:
+    def __init__(self, fail_on_insert=None):
+        self.fail_on_insert = fail_on_insert
+        self.lastrowid = None
+        self.users = {}
+
+    async def execute(self, sql, params=()):
+        if sql.startswith("INSERT INTO users"):
+            self.lastrowid = self.users.setdefault(params[0], len(self.users) + 1)
+
+    async def executemany(self, sql, rows):
+        if self.fail_on_insert:
+            raise self.fail_on_insert
+
+
+class FakeConnection:
+    def __init__(self):
+        self.committed = False
+        self.rolled_back = False
+
+    async def commit(self):
+        self.committed = True
+
+    async def rollback(self):
+        self.rolled_back = True
+
+
+@pytest.fixture(autouse=True)
+def upsert_users(monkeypatch):
+    monkeypatch.setattr(mysql_queries, "users_unique_key", True)
+    monkeypatch.setattr(mysql_queries, "user_id_cache", {})
+
+
+def rows(*numbers):
+    return [(number, "Cennik?", "Cennik jest na stronie.", datetime.now()) for number in numbers]
+
+
+def test_user_ids_are_cached_after_the_batch_commits():
+    conn = FakeConnection()
+    asyncio.run(mysql_queries.insert_query_batch.__wrapped__(FakeCursor(), conn, rows(48111, 48222)))
+    assert conn.committed
+    assert mysql_queries.user_id_cache == {48111: 1, 48222: 2}
+
+
+def test_rolled_back_batch_leaves_no_user_ids_in_the_cache():
+    conn = FakeConnection()
+    lost_connection = OperationalError(2013, "Lost connection to MySQL server during query")
+    with pytest.raises(OperationalError):
+        asyncio.run(mysql_queries.insert_query_batch.__wrapped__(FakeCursor(fail_on_insert=lost_connection), conn,
+                                                                 rows(48111)))
+    assert conn.rolled_back
+    assert mysql_queries.user_id_cache == {}
+
+
+def test_rejected_batch_is_reported_as_a_data_error():
+    conn = FakeConnection()
+    too_long = DataError(1406, "Data too long for column 'answer' at row 1")
+    written = asyncio.run(mysql_queries.insert_query_batch.__wrapped__(FakeCursor(fail_on_insert=too_long), conn,
+                                                                       rows(48111)))
+    assert written is False
+    assert conn.rolled_back
+
+
+def fake_batch_writer(monkeypatch, outcome):
+    calls = []
+
+    async def insert_query_batch(batch):
+        calls.append([row[0] for row in batch])
+        return outcome(batch)
+
+    monkeypatch.setattr(mysql_queries, "insert_query_batch", insert_query_batch)
+    return calls
+
+
+def test_data_error_retries_row_by_row_and_drops_only_the_rejected_rows(monkeypatch):
+    calls = fake_batch_writer(monkeypatch, lambda batch: not any(row[0] == 48222 for row in batch))
+    monkeypatch.setattr(mysql_queries, "write_buffer", rows(48111, 48222, 48333))
+
+    asyncio.run(mysql_queries.flush_write_buffer())
+
+    assert calls == [[48111, 48222, 48333], [48111], [48222], [48333]]
+    assert mysql_queries.write_buffer == []
+
+
+def test_connection_error_puts_the_batch_back_into_the_buffer(monkeypatch):
+    calls = fake_batch_writer(monkeypatch, lambda batch: None)
+    monkeypatch.setattr(mysql_queries, "write_buffer", rows(48111, 48222))
+
+    asyncio.run(mysql_queries.flush_write_buffer())
+
+    assert calls == [[48111, 48222]]
+    assert [row[0] for row in mysql_queries.write_buffer] == [48111, 48222]
+
+
+def test_connection_lost_during_the_row_by_row_retry_keeps_the_unwritten_rows(monkeypatch):
+    outcomes = iter([False, True, None])
+    fake_batch_writer(monkeypatch, lambda batch: next(outcomes))
+    monkeypatch.setattr(mysql_queries, "write_buffer", rows(48111, 48222, 48333))
+
+    asyncio.run(mysql_queries.flush_write_buffer())
+
+    assert [row[0] for row in mysql_queries.write_buffer] == [48222, 48333]
+
+
+class ClaimCursor:
+    """processed_messages with claimed_by; `taken` ids were already claimed by another instance."""
+
+    def __init__(self, taken=()):
+        self.rows = {message_id: "other-instance" for message_id in taken}
+        self.statements = []
+        self.rowcount = 0
+        self._result = []
+
+    async def execute(self, sql, params=()):
+        self.statements.append(sql.split()[0])
+        if sql.startswith("INSERT IGNORE"):
+            pairs = list(zip(params[::2], params[1::2]))
+            fresh = [(message_id, token) for message_id, token in pairs if message_id not in self.rows]
+            self.rows.update(fresh)
+            self.rowcount = len(fresh)
+        elif sql.startswith("SELECT"):
+            token, *message_ids = params
+            self._result = [(message_id,) for message_id in message_ids if self.rows.get(message_id) == token]
+
+    async def fetchall(self):
+        return self._result
+
+
+def test_job_claims_all_its_message_ids_in_one_statement(monkeypatch):
+    monkeypatch.setattr(mysql_queries, "claim_tokens", True)
+    cur = ClaimCursor()
+    claimed = asyncio.run(mysql_queries.claim_message_ids.__wrapped__(cur, FakeConnection(),
+                                                                      ["wamid.1", "wamid.2", "wamid.3"]))
+    assert claimed == {"wamid.1", "wamid.2", "wamid.3"}
+    assert cur.statements == ["INSERT"]
+
+
+def test_partly_taken_claim_reads_back_its_own_rows(monkeypatch):
+    monkeypatch.setattr(mysql_queries, "claim_tokens", True)
+    cur = ClaimCursor(taken=["wamid.2"])
+    claimed = asyncio.run(mysql_queries.claim_message_ids.__wrapped__(cur, FakeConnection(),
+                                                                      ["wamid.1", "wamid.2", "wamid.3"]))
+    assert claimed == {"wamid.1", "wamid.3"}
+    assert cur.statements == ["INSERT", "SELECT"]
@@ -0,0 +1,138 @@
+import asyncio
+import pytest
+from asyncmy.errors import OperationalError, ProgrammingError
+from src.database import pool_manager
+from src.database.pool_manager import PoolManager
+
+
+class FakeCursor:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, sql, params=()):
+        pass
+
+    async def fetchone(self):
+        return (1,)
+
+
+class FakeConnection:
+    def cursor(self):
+        return FakeCursor()
+
+
+class FakePool:
+    def __init__(self, host):
+        self.host = host
+        self.closed = False
+        self.size = 1
+        self.freesize = 1
+
+    async def acquire(self):
+        return FakeConnection()
+
+    async def release(self, conn):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    async def wait_closed(self):
+        pass
+
+
+class FakeServers:
+    """pool_factory whose hosts can be taken down and brought back."""
+
+    def __init__(self, *down):
+        self.down = set(down)
+        self.opened = []
+
+    async def __call__(self, host, port):
+        if host in self.down:
+            raise OperationalError(2003, f"Can't connect to MySQL server on '{host}'")
+        pool = FakePool(host)
+        self.opened.append(pool)
+        return pool
+
+
+@pytest.fixture(autouse=True)
+def fast_reconnect(monkeypatch):
+    monkeypatch.setattr(pool_manager, "POOL_EJECT_AFTER", 2)
+    monkeypatch.setattr(pool_manager, "POOL_RECONNECT_INTERVAL", 0.01)
+    monkeypatch.setattr(pool_manager, "POOL_RECONNECT_MAX_INTERVAL", 0.02)
+
+
+def manager(servers):
+    return PoolManager("read", [("db1", 3306), ("db2", 3306)], 2, pool_factory=servers)
+
+
+async def wait_until(condition, timeout=1.0):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(poll(), timeout)
+
+
+def test_pool_that_fails_to_start_is_skipped_and_reconnected_in_the_background():
+    servers = FakeServers("db2")
+
+    async def scenario():
+        pools = manager(servers)
+        assert await pools.start() == 1
+        assert {pools.pick().host for _ in range(20)} == {"db1"}
+
+        servers.down.clear()
+        await wait_until(lambda: len(pools) == 2)
+        await pools.close()
+
+    asyncio.run(scenario())
+
+
+def test_connection_errors_eject_the_pool_and_traffic_fails_over():
+    servers = FakeServers()
+
+    async def scenario():
+        pools = manager(servers)
+        await pools.start()
+        db1 = next(managed for managed in pools.pools if managed.host == "db1")
+        old_pool = db1.pool
+
+        # Błąd zapytania nie mówi nic o zdrowiu puli
+        pools.report_failure(db1, ProgrammingError(1064, "You have an error in your SQL syntax"))
+        pools.report_failure(db1, ProgrammingError(1064, "You have an error in your SQL syntax"))
+        assert db1.healthy
+
+        servers.down.add("db1")
+        for _ in range(2):
+            pools.report_failure(db1, OperationalError(2013, "Lost connection to MySQL server during query"))
+        assert not db1.healthy and db1.ejections == 1
+        assert {pools.pick().host for _ in range(20)} == {"db2"}
+
+        conn, pool = await pools.acquire(pools.pick())
+        assert pool.host == "db2"
+        await pools.release(pools.pick(), conn, pool)
+
+        await asyncio.sleep(0.05)
+        assert not db1.healthy  # host wciąż leży - kolejne próby z rosnącym odstępem
+        servers.down.clear()
+        await wait_until(lambda: db1.healthy)
+        assert old_pool.closed and db1.pool is not old_pool
+        await pools.close()
+
+    asyncio.run(scenario())
+
+
+def test_no_healthy_pool_raises_instead_of_routing_to_a_dead_one():
+    async def scenario():
+        pools = manager(FakeServers("db1", "db2"))
+        assert await pools.start() == 0
+        with pytest.raises(RuntimeError):
+            pools.pick()
+        await pools.close()
+        assert all(managed.reconnect_task.cancelled() for managed in pools.pools)
+
+    asyncio.run(scenario())
@@ -0,0 +1,36 @@
+import pytest
+from src.ai.query_rewriter import is_follow_up
+from src.ai.rag_engine import RAGEngine
+
+
+@pytest.mark.parametrize("question", [
+    "Could you explain the second one in more detail?",
+    "What is the price of the first option?",
+    "And how long does it take?",
+    "A ile to kosztuje?",
+    "A SLA?",
+    "Jaka jest cena drugiej opcji?",
+    "Który z nich jest tańszy?",
+])
+def test_follow_ups(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "I would like to know the pricing of Azure migration services",
+    "To what extent do you support Kubernetes",
+    "So what does Euvic offer for Azure migrations?",
+    "What is the first step of an Azure migration?",
+    "Czy oferujecie migrację do Azure?",
+])
+def test_standalone_questions(question):
+    assert not is_follow_up(question)
+
+
+def test_history_is_kept_unless_the_answer_goes_to_the_semantic_cache():
+    history = [{"query": "Jakie pakiety macie?", "answer": "Basic i Premium.", "created_at": "2026-10-01T10:00:00"}]
+    question = "Could you explain the second one in more detail?"
+
+    assert RAGEngine._prompt_input(question, "Premium package details", False, history) == (question, history)
+    assert RAGEngine._prompt_input(question, "Premium package details", True, history) == \
+        ("Premium package details", None)
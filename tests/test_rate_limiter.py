@@ -0,0 +1,67 @@
+import asyncio
+import time
+import pytest
+from src.ai.rate_limiter import OpenAIScheduler, AIMDLimit, BudgetExceeded, PRIORITY_BACKGROUND, \
+    PRIORITY_INTERACTIVE, estimate_tokens, token_batches
+
+
+def make_scheduler(tpm=100000, concurrency=8):
+    return OpenAIScheduler("test-model", rpm=0, tpm=tpm, background_reserve=0.2,
+                           concurrency=AIMDLimit(initial=concurrency, minimum=1, maximum=concurrency))
+
+
+def test_oversized_background_call_does_not_overdraw_the_budget():
+    async def scenario():
+        scheduler = make_scheduler()
+        with pytest.raises(BudgetExceeded):
+            await scheduler.acquire(150000, PRIORITY_BACKGROUND, time.monotonic() + 1)
+        assert scheduler.tokens.remaining == pytest.approx(100000, rel=0.01)
+
+        lease = await scheduler.acquire(10000, PRIORITY_INTERACTIVE, time.monotonic() + 0.5)
+        assert lease.granted_at is not None
+
+    asyncio.run(scenario())
+
+
+def test_background_work_leaves_the_reserve_to_interactive_calls():
+    async def scenario():
+        scheduler = make_scheduler()
+        await scheduler.acquire(scheduler.max_tokens(PRIORITY_BACKGROUND), PRIORITY_BACKGROUND)
+        waiting = asyncio.create_task(scheduler.acquire(10000, PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+
+        lease = await scheduler.acquire(15000, PRIORITY_INTERACTIVE, time.monotonic() + 0.1)
+        assert lease.granted_at is not None
+        assert scheduler.tokens.remaining >= 0
+        waiting.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_lease_granted_to_a_cancelled_caller_is_returned():
+    async def scenario():
+        scheduler = make_scheduler(concurrency=1)
+        first = await scheduler.acquire(100)
+        second = asyncio.create_task(scheduler.acquire(100))
+        await asyncio.sleep(0)
+        assert scheduler.queued == 1
+
+        scheduler.release(first)  # przyznaje slot drugiemu wywołaniu...
+        second.cancel()  # ...które zostaje anulowane, zanim zdążyło go odebrać
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        assert scheduler.in_flight == 0
+
+        third = await scheduler.acquire(100, deadline=time.monotonic() + 0.1)
+        assert third.granted_at is not None
+
+    asyncio.run(scenario())
+
+
+def test_token_batches_respect_count_and_token_limits():
+    texts = ["x" * 400] * 7  # 104 tokens each
+    assert [len(batch) for batch in token_batches(texts, 3)] == [3, 3, 1]
+    batches = list(token_batches(texts, 5, lambda: 250))
+    assert [len(batch) for batch in batches] == [2, 2, 2, 1]
+    assert all(estimate_tokens(batch) <= 250 for batch in batches)
@@ -0,0 +1,68 @@
+import numpy as np
+from src.ai.reranker import Reranker, mmr, reciprocal_rank_fusion
+from src.database.lexical_index import bm25_scores
+
+
+def doc(doc_id, score=0.0, vector=None, content=""):
+    document = {"_id": doc_id, "similarityScore": score, "content": content}
+    if vector is not None:
+        document["vector"] = np.asarray(vector, dtype=np.float32)
+    return document
+
+
+def test_rrf_ranks_documents_found_by_both_retrievers_first():
+    vector = [doc("a"), doc("b"), doc("c")]
+    lexical = [doc("c"), doc("d"), doc("b")]
+
+    fused = reciprocal_rank_fusion([vector, lexical], limit=10, k=60)
+
+    # b: 1/62 + 1/63, c: 1/63 + 1/61 - c wyżej; a: 1/61 przed d: 1/62
+    assert [result["_id"] for result in fused] == ["c", "b", "a", "d"]
+    assert fused[0]["fusedScore"] == 1 / 63 + 1 / 61
+
+
+def test_rrf_keeps_the_vector_entry_and_trims_to_the_limit():
+    vector = [doc("a", score=0.9), doc("b", score=0.8)]
+    lexical = [{"_id": "a", "lexicalScore": 7.0}, {"_id": "e", "lexicalScore": 3.0}]
+
+    fused = reciprocal_rank_fusion([vector, lexical], limit=2)
+
+    assert [result["_id"] for result in fused] == ["a", "b"]
+    assert fused[0]["similarityScore"] == 0.9
+
+
+def test_mmr_demotes_a_near_duplicate():
+    vectors = [[1.0, 0.0, 0.0], [0.999, 0.04, 0.0], [0.6, 0.8, 0.0]]
+    relevance = [0.95, 0.94, 0.80]
+
+    assert mmr(vectors, relevance, 3, lambda_=1.0) == [0, 1, 2]
+    # Prawie kopia pierwszego chunku spada za mniej trafny, ale różny
+    assert mmr(vectors, relevance, 3, lambda_=0.5) == [0, 2, 1]
+
+
+def test_reranker_over_fetches_and_trims_to_top_k_without_vectors():
+    reranker = Reranker(enabled=True, fetch_multiplier=3, top_k=4, lambda_=0.7, bm25_weight=0.0)
+    assert reranker.candidates(5) == 15
+    assert reranker.final_k(5) == 4
+
+    rng = np.random.default_rng(0)
+    candidates = [doc(i, score=1 - i / 100, vector=rng.standard_normal(8)) for i in range(15)]
+    reranked = reranker.rerank("pytanie", None, candidates, num_results=5)
+
+    assert len(reranked) == 4
+    assert all("vector" not in result for result in reranked)
+    assert reranked[0]["_id"] == 0
+
+
+def test_disabled_reranker_passes_results_through():
+    reranker = Reranker(enabled=False, fetch_multiplier=3, top_k=4)
+    assert reranker.candidates(5) == 5
+    results = [doc(i, score=1 - i / 10) for i in range(5)]
+    assert [result["_id"] for result in reranker.rerank("pytanie", None, results, 5)] == [0, 1, 2, 3, 4]
+
+
+def test_candidate_bm25_uses_the_index_tokenizer():
+    # Ten sam stemming co indeks BM25: "Gliwicach" trafia w "Gliwice", "Łódź" w "lodz"
+    scores = bm25_scores("biuro w Gliwicach i Łodzi", ["Biuro Gliwice", "Oddział lodzi", "Cennik usług"])
+    assert scores[0] > 0 and scores[1] > 0
+    assert scores[2] == 0
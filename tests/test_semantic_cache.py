@@ -0,0 +1,32 @@
+import numpy as np
+from src.ai.semantic_cache import SemanticCache, context_fingerprint
+
+DOCUMENTS = [{"_id": "azure-migration", "createdAt": "2026-09-01"}, {"_id": "pricing", "createdAt": "2026-09-01"}]
+EDITED = [{"_id": "azure-migration", "createdAt": "2026-10-10"}, {"_id": "pricing", "createdAt": "2026-09-01"}]
+
+
+def embedding(seed, noise=0.0):
+    vector = np.random.default_rng(seed).standard_normal(1536).astype(np.float32)
+    return vector + noise * np.random.default_rng(seed + 1).standard_normal(1536).astype(np.float32)
+
+
+def test_hit_requires_the_same_retrieved_context():
+    cache = SemanticCache(capacity=16, threshold=0.98, ttl=0)
+    cache.store(embedding(1), "Migracja trwa 2-4 tygodnie.", context_fingerprint(DOCUMENTS))
+
+    assert cache.lookup(embedding(1, noise=0.05), context_fingerprint(DOCUMENTS))[0] == "Migracja trwa 2-4 tygodnie."
+    assert cache.lookup(embedding(1, noise=0.05), context_fingerprint(EDITED)) is None
+
+
+def test_newer_answer_for_the_current_context_wins_over_a_stale_one():
+    cache = SemanticCache(capacity=16, threshold=0.98, ttl=0)
+    cache.store(embedding(1), "stara odpowiedź", context_fingerprint(DOCUMENTS))
+    cache.store(embedding(1, noise=0.01), "nowa odpowiedź", context_fingerprint(EDITED))
+
+    assert cache.lookup(embedding(1), context_fingerprint(EDITED))[0] == "nowa odpowiedź"
+
+
+def test_related_but_different_question_is_a_miss():
+    cache = SemanticCache(capacity=16, threshold=0.98, ttl=0)
+    cache.store(embedding(1), "Migracja trwa 2-4 tygodnie.", context_fingerprint(DOCUMENTS))
+    assert cache.lookup(embedding(1, noise=0.3), context_fingerprint(DOCUMENTS)) is None
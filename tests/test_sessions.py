@@ -0,0 +1,83 @@
+import asyncio
+import src.api.webhook as webhook
+from src.api.sessions import SingleFlight
+
+HISTORY_A = [{"query": "Czy robicie migracje do Azure?", "answer": "Tak.", "created_at": "2026-10-01T10:00:00"}]
+HISTORY_B = [{"query": "Jaki jest numer mojej umowy?", "answer": "PL-2231.", "created_at": "2026-10-01T10:00:00"}]
+
+
+def test_single_flight_shares_only_identical_keys():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return key
+
+        results = await asyncio.gather(flight.run("a", lambda: work("a")), flight.run("a", lambda: work("a")),
+                                       flight.run("b", lambda: work("b")))
+        assert results == ["a", "a", "b"]
+        assert sorted(calls) == ["a", "b"]
+        assert flight.stats() == {"in_flight": 0, "executions": 2, "shared": 1}
+
+    asyncio.run(scenario())
+
+
+def record_queries(monkeypatch):
+    prompts = []
+
+    async def aprocess_query(question, num_results=10, chat_history=None):
+        prompts.append((question, chat_history))
+        await asyncio.sleep(0.01)
+        return f"answer to {question}"
+
+    monkeypatch.setattr(webhook.get_rag_engine(), "aprocess_query", aprocess_query)
+    single_flight = SingleFlight()
+    monkeypatch.setattr(webhook, "get_single_flight", lambda: single_flight)
+    return prompts
+
+
+def test_senders_without_history_share_one_answer(monkeypatch):
+    prompts = record_queries(monkeypatch)
+
+    async def scenario():
+        return await asyncio.gather(webhook.answer_query("Jakie usługi chmurowe oferuje Euvic?", []),
+                                    webhook.answer_query("jakie usługi chmurowe oferuje euvic?", None))
+
+    first, second = asyncio.run(scenario())
+    assert first == second
+    assert prompts == [("Jakie usługi chmurowe oferuje Euvic?", None)]
+
+
+def test_senders_with_history_are_answered_separately_with_their_own_history(monkeypatch):
+    prompts = record_queries(monkeypatch)
+
+    async def scenario():
+        await asyncio.gather(webhook.answer_query("Jakie usługi chmurowe oferuje Euvic?", HISTORY_A),
+                             webhook.answer_query("Jakie usługi chmurowe oferuje Euvic?", HISTORY_B))
+
+    asyncio.run(scenario())
+    assert sorted(prompts, key=lambda prompt: prompt[1][0]["query"]) == [
+        ("Jakie usługi chmurowe oferuje Euvic?", HISTORY_A), ("Jakie usługi chmurowe oferuje Euvic?", HISTORY_B)]
+
+
+def test_interrupted_stream_sends_an_apology_and_keeps_only_the_generated_text(monkeypatch):
+    sent = []
+
+    async def astream_query(question, num_results=10, chat_history=None):
+        yield "Euvic oferuje migracje do Azure. "
+        raise webhook.AnswerInterrupted("Euvic oferuje migracje do Azure. ", ConnectionError("stream reset"))
+
+    async def send_message(text, recipient):
+        sent.append(text)
+
+    monkeypatch.setattr(webhook.get_rag_engine(), "astream_query", astream_query)
+    monkeypatch.setattr(webhook.WhatsAppClient, "send_message", send_message)
+
+    saved = asyncio.run(webhook.stream_answer("Co oferuje Euvic?", [], 48111))
+
+    assert sent == ["Euvic oferuje migracje do Azure.", webhook.STREAM_INTERRUPTED_MESSAGE]
+    assert saved == "Euvic oferuje migracje do Azure. " + webhook.INCOMPLETE_ANSWER_MARK
+    assert "Kurza twarz" not in saved